@@ -0,0 +1,175 @@
+import json
+import os
+import threading
+from typing import Iterable, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from app.config import ANALYTICS_DIR
+from app.agent.file_store import atomic_write, file_lock
+from app.agent.export_journal import EXPORT_COLUMNS, AppointmentJournal, current_bookings, get_appointment_journal
+
+# Merge a day's part files once it has more than this many
+MAX_PARTS_PER_PARTITION = 8
+
+# Attempts at a range read whose files were merged away while it was reading
+_READ_ATTEMPTS = 5
+
+_SCHEMA = pa.schema([
+    (col, pa.int64() if col == 'duration_minutes' else pa.string()) for col in EXPORT_COLUMNS + ['event']
+])
+
+
+class AppointmentAnalyticsStore:
+    """
+    Columnar copy of the booking journal (bookings and cancellations),
+    partitioned by appointment date:
+    <ANALYTICS_DIR>/date=YYYY-MM-DD/{merged,part}-<journal offset>.parquet.
+
+    sync() only converts journal bytes appended since the last checkpoint.
+    Every process serving reports syncs, so the whole of sync() runs under
+    a file lock on the checkpoint; files appear by atomic rename and readers
+    never lock (a file merged away mid-read just means listing again).
+    Range reads open just the partitions inside the range and just the
+    requested columns, so a report's cost follows the size of its range,
+    not the total booking history.
+    """
+
+    def __init__(self, root: str = ANALYTICS_DIR, journal: Optional[AppointmentJournal] = None):
+        self.root = root
+        self.journal = journal
+        self._lock = threading.Lock()
+        self._checkpoint_path = os.path.join(root, '_checkpoint.json')
+
+    def _journal(self) -> AppointmentJournal:
+        return self.journal or get_appointment_journal()
+
+    def _read_checkpoint(self) -> int:
+        try:
+            with open(self._checkpoint_path, 'r', encoding='utf-8') as f:
+                return int(json.load(f).get('journal_offset', 0))
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _write_checkpoint(self, offset: int) -> None:
+        atomic_write(self._checkpoint_path, lambda f: json.dump({'journal_offset': offset}, f), encoding='utf-8')
+
+    @staticmethod
+    def _write_parquet(table: pa.Table, path: str) -> None:
+        # Readers list the directory without locking: they must never see a half-written file
+        tmp = path + '.tmp'
+        pq.write_table(table, tmp)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _parquet_files(part_dir: str) -> list:
+        """Data files of a partition in journal order: the merged history (if any), then newer parts."""
+        try:
+            names = os.listdir(part_dir)
+        except FileNotFoundError:
+            return []
+        return sorted(f for f in names if f.endswith('.parquet'))
+
+    def _partition_dir(self, date: str) -> str:
+        return os.path.join(self.root, f"date={date}")
+
+    @staticmethod
+    def _to_table(rows: list) -> pa.Table:
+        df = pd.DataFrame(rows)
+        for col in _SCHEMA.names:
+            if col not in df.columns:
+                df[col] = ''
+        df = df[_SCHEMA.names]
+        df['duration_minutes'] = pd.to_numeric(df['duration_minutes'], errors='coerce').fillna(0).astype('int64')
+        for col in _SCHEMA.names:
+            if col != 'duration_minutes':
+                df[col] = df[col].fillna('').astype(str)
+        df['date'] = df['date'].str.split(' ').str[0]
+        return pa.Table.from_pandas(df, schema=_SCHEMA, preserve_index=False)
+
+    def sync(self) -> int:
+        """Convert newly journaled bookings into Parquet parts. Returns rows added."""
+        os.makedirs(self.root, exist_ok=True)
+        with self._lock, file_lock(self._checkpoint_path):
+            offset = self._read_checkpoint()
+            rows, new_offset = self._journal().read_from(offset)
+            touched = []
+            if rows:
+                table = self._to_table(rows)
+                for date in sorted(set(table.column('date').to_pylist())):
+                    part_dir = self._partition_dir(date)
+                    os.makedirs(part_dir, exist_ok=True)
+                    # Named by journal offset: a re-run after a crash overwrites, never duplicates
+                    part = table.filter(pc.equal(table.column('date'), date))
+                    self._write_parquet(part, os.path.join(part_dir, f"part-{offset:012d}.parquet"))
+                    touched.append(part_dir)
+            if new_offset != offset:
+                self._write_checkpoint(new_offset)
+            for part_dir in touched:
+                self._maybe_merge(part_dir)
+            return len(rows)
+
+    def _maybe_merge(self, part_dir: str) -> None:
+        files = self._parquet_files(part_dir)
+        if len(files) <= MAX_PARTS_PER_PARTITION:
+            return
+        merged = pa.concat_tables(pq.read_table(os.path.join(part_dir, f), schema=_SCHEMA) for f in files)
+        # Its own name (never a part's), after the newest offset it covers; "merged-" sorts
+        # before every "part-", so name order stays journal order
+        target = f"merged-{files[-1].rsplit('-', 1)[-1]}"
+        self._write_parquet(merged, os.path.join(part_dir, target))
+        for f in files:
+            if f != target:
+                os.remove(os.path.join(part_dir, f))
+
+    def partitions(self, start_date: str, end_date: str) -> list:
+        """Partition dates inside [start_date, end_date], in order."""
+        if not os.path.isdir(self.root):
+            return []
+        dates = []
+        for entry in os.scandir(self.root):
+            if entry.is_dir() and entry.name.startswith('date='):
+                date = entry.name[len('date='):]
+                if start_date <= date <= end_date:
+                    dates.append(date)
+        return sorted(dates)
+
+    def read_range(self, start_date: str, end_date: str, columns: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        """Bookings dated within [start_date, end_date], reading only the given columns."""
+        self.sync()
+        cols = list(columns) if columns else list(EXPORT_COLUMNS)
+        # booking_id/event are needed to drop re-exported and cancelled bookings
+        read_cols = cols + [c for c in ('booking_id', 'event') if c not in cols]
+        for attempt in range(_READ_ATTEMPTS):
+            files = []
+            for date in self.partitions(start_date, end_date):
+                part_dir = self._partition_dir(date)
+                files.extend(os.path.join(part_dir, f) for f in self._parquet_files(part_dir))
+            if not files:
+                return pd.DataFrame(columns=cols)
+            try:
+                # A dataset over the pruned file list reads the parts in parallel
+                df = ds.dataset(files, format='parquet', schema=_SCHEMA).to_table(columns=read_cols).to_pandas()
+            except FileNotFoundError:
+                # Another process merged some parts away after the listing: their rows are in the merged file now
+                if attempt == _READ_ATTEMPTS - 1:
+                    raise
+                continue
+            return current_bookings(df)[cols].reset_index(drop=True)
+
+
+_store: Optional[AppointmentAnalyticsStore] = None
+_store_lock = threading.Lock()
+
+
+def get_analytics_store() -> AppointmentAnalyticsStore:
+    """Process-wide analytics store for ANALYTICS_DIR."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = AppointmentAnalyticsStore(ANALYTICS_DIR)
+        return _store
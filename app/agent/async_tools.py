@@ -0,0 +1,35 @@
+import asyncio
+import functools
+
+from langchain_core.tools import BaseTool, StructuredTool
+
+from app.agent.executor import get_tool_pool
+from app.agent.tools import all_tools
+
+
+def make_async_tool(sync_tool: BaseTool) -> StructuredTool:
+    """
+    Async variant of a tool with the same name, description and schema.
+
+    The tools do blocking pandas/openpyxl/SQLite work, so the coroutine
+    hands the call to the shared tool pool (TOOL_MAX_WORKERS threads): the
+    event loop never blocks, and however many sessions are waiting, at
+    most that many tool calls touch the data files at once. E-mail never
+    blocks a tool either way: messages go to the MailQueue's sender threads.
+    """
+    func = sync_tool.func
+
+    async def run(**kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_tool_pool(), functools.partial(func, **kwargs))
+
+    return StructuredTool(
+        name=sync_tool.name,
+        description=sync_tool.description,
+        args_schema=sync_tool.args_schema,
+        func=func,
+        coroutine=run,
+    )
+
+
+all_async_tools = [make_async_tool(t) for t in all_tools]
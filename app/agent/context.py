@@ -0,0 +1,176 @@
+import json
+import re
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, ToolMessage
+
+from app.config import AGENT_MODEL_NAME, CONTEXT_KEEP_TURNS, CONTEXT_MAX_TOKENS, CONTEXT_TOOL_DIGEST_CHARS
+
+# Rough per-message overhead of the chat format (role, separators)
+_MESSAGE_OVERHEAD_TOKENS = 4
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    """tiktoken encoding for the agent model, or None (e.g. offline) to fall back to an estimate."""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.encoding_for_model(AGENT_MODEL_NAME)
+        except Exception:
+            _encoding = None
+    return _encoding
+
+
+def count_text_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages: list) -> int:
+    """Approximate prompt tokens for a message list, tool-call arguments included."""
+    total = 0
+    for message in messages:
+        content = message.content if isinstance(message.content, str) else json.dumps(message.content)
+        total += _MESSAGE_OVERHEAD_TOKENS + count_text_tokens(content)
+        for call in getattr(message, 'tool_calls', None) or []:
+            total += count_text_tokens(call.get('name', '') + json.dumps(call.get('args', {})))
+    return total
+
+
+def digest_tool_result(content: str, max_chars: int = CONTEXT_TOOL_DIGEST_CHARS) -> str:
+    """Short stand-in for a tool result the model has already acted on."""
+    if len(content) <= max_chars:
+        return content
+    try:
+        data = json.loads(content)
+    except ValueError:
+        data = None
+    if isinstance(data, list):
+        first = json.dumps(data[0], separators=(',', ':'))[:max_chars // 2] if data else ''
+        return f"[earlier result shortened: {len(data)} items; first: {first}]"
+    if isinstance(data, dict):
+        fields = {k: (v if len(str(v)) <= 60 else str(v)[:60] + '...') for k, v in data.items()}
+        return f"[earlier result shortened] {json.dumps(fields, separators=(',', ':'))[:max_chars]}"
+    return content[:max_chars] + f"... [earlier result shortened, {len(content)} chars]"
+
+
+# Tool arguments worth remembering once the turn that used them leaves the window
+_FACT_ARGS = {
+    'lookup_patient': {'first_name': 'first_name', 'last_name': 'last_name', 'dob': 'dob'},
+    'save_new_patient': {'first_name': 'first_name', 'last_name': 'last_name', 'dob': 'dob',
+                         'email': 'email', 'phone': 'phone', 'preferred_doctor': 'doctor', 'location': 'location'},
+    'get_calendly_availability_with_duration': {'doctor_name': 'doctor', 'date': 'date',
+                                                'required_duration_minutes': 'duration_minutes'},
+    'search_availability': {'start_date': 'date', 'required_duration_minutes': 'duration_minutes',
+                            'location': 'location'},
+    'book_calendly_slot': {'slot_id': 'slot_id', 'patient_name': 'patient', 'patient_email': 'email'},
+    'export_appointment': {'booking_id': 'booking_id', 'doctor': 'doctor', 'date': 'date',
+                           'start_time': 'start_time', 'location': 'location'},
+    'schedule_enhanced_reminders': {'booking_id': 'booking_id', 'appointment_time': 'start_time'},
+    'cancel_appointment': {'booking_id': 'booking_id'},
+}
+
+_BOOKING_ID_RE = re.compile(r'Booking ID: (calendly_booking_[\w]+)')
+
+
+class ConversationContext:
+    """
+    Decides what part of a session's history is sent to the model.
+
+    The full message list stays intact (the UI shows it); build() returns
+    a bounded view: the system prompt, a summary of facts extracted from
+    tool calls (patient, doctor, slot, booking ID...) once older turns
+    have been dropped, and the most recent turns. Tool results from
+    earlier turns are replaced by short digests, and whole turns are
+    dropped oldest-first until the view fits max_tokens. A turn (user
+    message through the final reply) is never split, so every tool call
+    stays next to its result.
+    """
+
+    def __init__(self, max_tokens: int = CONTEXT_MAX_TOKENS, keep_turns: int = CONTEXT_KEEP_TURNS,
+                 digest_chars: int = CONTEXT_TOOL_DIGEST_CHARS):
+        self.max_tokens = max_tokens
+        self.keep_turns = keep_turns
+        self.digest_chars = digest_chars
+        self.facts: dict = {}
+        self.last_tokens = 0  # size of the last view sent to the model
+        self.full_tokens = 0  # size the whole history would have been
+        self._seen = 0
+        self._digests: dict = {}  # tool_call_id -> digested ToolMessage
+
+    def observe(self, messages: list) -> None:
+        """Pick up facts from messages added since the last call."""
+        new_messages = messages[self._seen:]
+        self.full_tokens += count_message_tokens(new_messages)
+        for message in new_messages:
+            if isinstance(message, AIMessage):
+                for call in message.tool_calls or []:
+                    for arg, fact in _FACT_ARGS.get(call.get('name', ''), {}).items():
+                        value = (call.get('args') or {}).get(arg)
+                        if value not in (None, ''):
+                            self.facts[fact] = value
+                    if call.get('name') == 'cancel_appointment':
+                        self.facts['status'] = 'cancelled'
+            elif isinstance(message, ToolMessage) and isinstance(message.content, str):
+                match = _BOOKING_ID_RE.search(message.content)
+                if match:
+                    self.facts['booking_id'] = match.group(1)
+                    self.facts['status'] = 'booked'
+        self._seen = len(messages)
+
+    def summary(self) -> str:
+        if not self.facts:
+            return ""
+        known = "; ".join(f"{k}={v}" for k, v in self.facts.items())
+        return f"Facts established earlier in this conversation (older messages omitted): {known}"
+
+    def _digest(self, message: BaseMessage) -> BaseMessage:
+        if not isinstance(message, ToolMessage) or len(str(message.content)) <= self.digest_chars:
+            return message
+        digested = self._digests.get(message.tool_call_id)
+        if digested is None:
+            digested = ToolMessage(content=digest_tool_result(str(message.content), self.digest_chars),
+                                   tool_call_id=message.tool_call_id)
+            self._digests[message.tool_call_id] = digested
+        return digested
+
+    def build(self, messages: list) -> list:
+        """Bounded message list for the next model call."""
+        self.observe(messages)
+        head = [m for m in messages[:1] if isinstance(m, SystemMessage)]
+        body_start = len(head)
+        turn_starts = [i for i in range(body_start, len(messages)) if isinstance(messages[i], HumanMessage)]
+        if not turn_starts:
+            self.last_tokens = self.full_tokens
+            return messages
+
+        first_kept = max(0, len(turn_starts) - self.keep_turns)
+        current = turn_starts[-1]
+        # Earlier turns in the window keep their shape but not their bulky tool output
+        window = [self._digest(m) for m in messages[turn_starts[first_kept]:current]] + messages[current:]
+        # Index in `window` of each kept turn's first message
+        kept_starts = [i - turn_starts[first_kept] for i in turn_starts[first_kept:]]
+        dropped = first_kept > 0
+
+        def assemble() -> list:
+            summary = self.summary() if dropped else ""
+            return head + ([SystemMessage(content=summary)] if summary else []) + window
+
+        context = assemble()
+        tokens = count_message_tokens(context)
+        while tokens > self.max_tokens and len(kept_starts) > 1:
+            # Drop the oldest remaining turn (never the current one)
+            window = window[kept_starts[1]:]
+            kept_starts = [i - kept_starts[1] for i in kept_starts[1:]]
+            dropped = True
+            context = assemble()
+            tokens = count_message_tokens(context)
+
+        self.last_tokens = tokens
+        return context
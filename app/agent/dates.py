@@ -0,0 +1,91 @@
+import re
+from datetime import date, datetime
+from functools import lru_cache
+
+import pandas as pd
+
+# Distinct raw inputs remembered by normalize_date() (dates repeat a lot: DOBs, report bounds, slot days)
+_CACHE_SIZE = 4096
+
+_ISO_RE = re.compile(r"^(\d{4})-(\d{2})-(\d{2})(?:[ T]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?)?$")
+_ORDINAL_RE = re.compile(r"(\d)(st|nd|rd|th)\b", re.IGNORECASE)
+
+# Explicit formats, tried in order. Dashed day-month-year is day first (how
+# unmigrated patients.csv files store DOBs, e.g. 20-05-1985); slashed is US month first.
+DATE_FORMATS = (
+    "%Y-%m-%d",
+    "%d-%m-%Y",
+    "%Y/%m/%d",
+    "%m/%d/%Y",
+    "%d.%m.%Y",
+    "%B %d, %Y",
+    "%b %d, %Y",
+    "%B %d %Y",
+    "%b %d %Y",
+    "%d %B %Y",
+    "%d %b %Y",
+)
+
+
+def _iso(value: str) -> str:
+    """The YYYY-MM-DD prefix of an ISO date(time) string if it is a real date, else ''."""
+    match = _ISO_RE.match(value)
+    if match is None:
+        return ""
+    try:
+        date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+    except ValueError:
+        return ""
+    return value[:10]
+
+
+@lru_cache(maxsize=_CACHE_SIZE)
+def normalize_date(value: str) -> str:
+    """
+    Canonical YYYY-MM-DD for a human date ("September 10th, 2025",
+    "2025/09/10", "20-05-1985"...). Returns the input unchanged if it
+    cannot be parsed. ISO input skips parsing; other inputs are cached.
+    """
+    text = str(value).strip()
+    iso = _iso(text)
+    if iso:
+        return iso
+    cleaned = _ORDINAL_RE.sub(r"\1", text)
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(cleaned, fmt).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    try:
+        # Free-form text ("Sept. 10 2025", "10 of September, 2025"); day first like the formats above
+        return pd.to_datetime(cleaned, dayfirst=True, errors='raise').strftime('%Y-%m-%d')
+    except (ValueError, OverflowError, TypeError):
+        return text
+
+
+def normalize_date_series(series: pd.Series) -> pd.Series:
+    """
+    normalize_date() over a whole column: one vectorized pass per format
+    (ISO first) for the values still unparsed, and the cached scalar path
+    only for the few left over. Unparseable values come back unchanged.
+    """
+    raw = series.astype(str).str.strip()
+    out = pd.Series(pd.NA, index=raw.index, dtype=object)
+    # ISO dates and datetimes need no parsing beyond a validity check
+    iso = raw.str.match(_ISO_RE.pattern)
+    if iso.any():
+        head = raw[iso].str[:10]
+        valid = pd.to_datetime(head, format="%Y-%m-%d", errors='coerce').notna()
+        out.loc[valid[valid].index] = head[valid]
+    for fmt in DATE_FORMATS[1:]:
+        pending = out.isna()
+        if not pending.any():
+            return out
+        parsed = pd.to_datetime(raw[pending], format=fmt, errors='coerce')
+        ok = parsed.notna()
+        if ok.any():
+            out.loc[ok[ok].index] = parsed[ok].dt.strftime('%Y-%m-%d')
+    pending = out.isna()
+    if pending.any():
+        out.loc[pending] = raw[pending].map(normalize_date)
+    return out
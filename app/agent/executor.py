@@ -0,0 +1,224 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+
+from langchain_core.messages import ToolMessage
+
+from app.config import TOOL_MAX_WORKERS
+
+# Shared state each tool touches. Calls that share a resource run one after
+# another in the order the model issued them; everything else runs in parallel.
+TOOL_RESOURCES = {
+    'lookup_patient': {'patients'},
+    'save_new_patient': {'patients'},
+    'get_calendly_availability_with_duration': {'schedule'},
+    'search_availability': {'schedule'},
+    'book_calendly_slot': {'schedule', 'exports', 'mail'},
+    'cancel_appointment': {'schedule', 'exports', 'reminders'},
+    'export_appointment': {'exports'},
+    'compact_appointments_export': {'exports'},
+    'build_admin_report': {'exports'},
+    'schedule_enhanced_reminders': {'reminders'},
+    'send_intake_forms': {'mail'},
+    'validate_email_config': set(),
+}
+
+# Tools missing from TOOL_RESOURCES hold this, which conflicts with every call
+_EXCLUSIVE = '*'
+
+
+def parse_tool_call(tool_call: dict) -> tuple:
+    """(name, args, id) from an OpenAI-style or LangChain-style tool call."""
+    if 'function' in tool_call:
+        tool_name = tool_call['function'].get('name', '')
+        tool_args = tool_call['function'].get('arguments', '{}')
+    else:
+        tool_name = tool_call.get('name', '')
+        tool_args = tool_call.get('args', '{}')
+    try:
+        tool_args = json.loads(tool_args) if isinstance(tool_args, str) else (tool_args or {})
+    except ValueError:
+        tool_args = {}
+    return tool_name, tool_args, tool_call.get('id', '') or ''
+
+
+def format_tool_result(result) -> str:
+    """Tool output as message content; structured results become compact JSON."""
+    if isinstance(result, (dict, list)):
+        return json.dumps(result, ensure_ascii=False, separators=(',', ':'), default=str)
+    return str(result)
+
+
+def invoke_tool(tools: list, tool_name: str, tool_args: dict, call_id: str) -> ToolMessage:
+    """Run one tool and wrap its result (or error) for the model."""
+    tool_func = next((t for t in tools if t.name == tool_name), None)
+    if tool_func is None:
+        return ToolMessage(content=f"Tool {tool_name} not found", tool_call_id=call_id)
+    try:
+        return ToolMessage(content=format_tool_result(tool_func.invoke(tool_args)), tool_call_id=call_id)
+    except Exception as e:
+        print(f"[Tool call error: {str(e)}]")
+        return ToolMessage(content=f"Tool call error: {str(e)}", tool_call_id=call_id)
+
+
+async def ainvoke_tool(tools: list, tool_name: str, tool_args: dict, call_id: str) -> ToolMessage:
+    """invoke_tool() for the asyncio runtime; pass async tools (see app.agent.async_tools)."""
+    tool_func = next((t for t in tools if t.name == tool_name), None)
+    if tool_func is None:
+        return ToolMessage(content=f"Tool {tool_name} not found", tool_call_id=call_id)
+    try:
+        return ToolMessage(content=format_tool_result(await tool_func.ainvoke(tool_args)), tool_call_id=call_id)
+    except Exception as e:
+        print(f"[Tool call error: {str(e)}]")
+        return ToolMessage(content=f"Tool call error: {str(e)}", tool_call_id=call_id)
+
+
+def _log_batch(durations: list, started: float) -> None:
+    if len(durations) > 1:
+        print(f"[TOOLS] {len(durations)} calls in {(time.perf_counter() - started) * 1000:.0f} ms "
+              f"(sequential would be {sum(durations) * 1000:.0f} ms)")
+
+
+class ToolBatch:
+    """
+    The tool calls of one model turn.
+
+    submit() starts a call right away unless an earlier call in the batch
+    holds one of its resources; then it starts the moment that call
+    finishes (chained through future callbacks, so no worker ever blocks
+    waiting). results() returns the ToolMessages in submission order, and
+    the turn costs about the slowest chain of conflicting calls rather
+    than the sum of all calls.
+    """
+
+    def __init__(self, pool: ThreadPoolExecutor, tools: list):
+        self._pool = pool
+        self._tools = tools
+        self._lock = threading.Lock()
+        self._futures: list = []
+        self._last: dict = {}  # resource -> future of the latest call holding it
+        self._durations: list = []
+        self._started = time.perf_counter()
+
+    def add_result(self, message: ToolMessage) -> None:
+        """Record a message produced without running a tool (keeps its place in the order)."""
+        future = Future()
+        future.set_result(message)
+        with self._lock:
+            self._futures.append(future)
+
+    def submit(self, tool_name: str, tool_args: dict, call_id: str) -> None:
+        resources = TOOL_RESOURCES.get(tool_name)
+        future = Future()
+        with self._lock:
+            if resources is None:
+                deps = list(self._last.values())
+                resources = set(self._last) | {_EXCLUSIVE}
+            else:
+                deps = [self._last[r] for r in resources | {_EXCLUSIVE} if r in self._last]
+            for resource in resources:
+                self._last[resource] = future
+            self._futures.append(future)
+        deps = [d for d in {id(d): d for d in deps}.values() if not d.done()]
+
+        def run() -> None:
+            started = time.perf_counter()
+            try:
+                future.set_result(invoke_tool(self._tools, tool_name, tool_args, call_id))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    self._durations.append(time.perf_counter() - started)
+
+        if not deps:
+            self._pool.submit(run)
+            return
+        waiting = [len(deps)]
+
+        def dependency_done(_) -> None:
+            with self._lock:
+                waiting[0] -= 1
+                ready = waiting[0] == 0
+            if ready:
+                self._pool.submit(run)
+
+        for dep in deps:
+            dep.add_done_callback(dependency_done)
+
+    def results(self) -> list:
+        messages = [f.result() for f in self._futures]
+        _log_batch(self._durations, self._started)
+        return messages
+
+
+class AsyncToolBatch:
+    """
+    ToolBatch for the asyncio runtime: the same per-resource ordering, with
+    each call an asyncio task that first waits for the calls it conflicts
+    with. Must be used from the event loop's thread.
+    """
+
+    def __init__(self, tools: list):
+        self._tools = tools
+        self._tasks: list = []
+        self._last: dict = {}  # resource -> task of the latest call holding it
+        self._durations: list = []
+        self._started = time.perf_counter()
+
+    def add_result(self, message: ToolMessage) -> None:
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(message)
+        self._tasks.append(future)
+
+    def submit(self, tool_name: str, tool_args: dict, call_id: str) -> None:
+        resources = TOOL_RESOURCES.get(tool_name)
+        if resources is None:
+            deps = list(self._last.values())
+            resources = set(self._last) | {_EXCLUSIVE}
+        else:
+            deps = [self._last[r] for r in resources | {_EXCLUSIVE} if r in self._last]
+        deps = [d for d in {id(d): d for d in deps}.values() if not d.done()]
+
+        async def run() -> ToolMessage:
+            if deps:
+                await asyncio.wait(deps)
+            started = time.perf_counter()
+            try:
+                return await ainvoke_tool(self._tools, tool_name, tool_args, call_id)
+            finally:
+                self._durations.append(time.perf_counter() - started)
+
+        task = asyncio.ensure_future(run())
+        for resource in resources:
+            self._last[resource] = task
+        self._tasks.append(task)
+
+    async def results(self) -> list:
+        messages = list(await asyncio.gather(*self._tasks))
+        _log_batch(self._durations, self._started)
+        return messages
+
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_tool_pool() -> ThreadPoolExecutor:
+    """Process-wide worker pool for tool calls (TOOL_MAX_WORKERS threads)."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=TOOL_MAX_WORKERS, thread_name_prefix='tool')
+        return _pool
+
+
+def new_tool_batch(tools: list) -> ToolBatch:
+    return ToolBatch(get_tool_pool(), tools)
+
+
+def new_async_tool_batch(tools: list) -> AsyncToolBatch:
+    return AsyncToolBatch(tools)
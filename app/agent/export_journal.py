@@ -0,0 +1,192 @@
+import atexit
+import json
+import os
+import threading
+import time
+from typing import Iterable, Optional
+
+import pandas as pd
+
+from app.agent.file_store import atomic_write
+from app.config import APPOINTMENTS_JOURNAL_PATH, EXPORTS_DIR, EXPORT_FSYNC, EXPORT_FSYNC_INTERVAL
+
+EXPORT_COLUMNS = [
+    'booking_id', 'patient_name', 'patient_email', 'patient_phone',
+    'doctor', 'location', 'date', 'start_time', 'end_time',
+    'duration_minutes', 'created_at'
+]
+
+APPOINTMENTS_XLSX_PATH = os.path.join(EXPORTS_DIR, 'appointments.xlsx')
+
+# Journal lines carry an "event"; lines without one are bookings
+EVENT_BOOKED = 'booked'
+EVENT_CANCELLED = 'cancelled'
+
+# Keep Windows from translating newlines in the raw descriptor
+_O_BINARY = getattr(os, 'O_BINARY', 0)
+
+
+class AppointmentJournal:
+    """
+    Append-only JSON-lines log of exported bookings.
+
+    Each booking is one os.write() on an O_APPEND descriptor, so the cost of
+    an export no longer depends on how many bookings came before it, and
+    concurrent processes never interleave partial lines. Durability follows
+    EXPORT_FSYNC: "always", "interval" (group commit, at most one fsync per
+    EXPORT_FSYNC_INTERVAL seconds) or "never".
+    """
+
+    def __init__(self, path: str = APPOINTMENTS_JOURNAL_PATH, fsync_policy: str = EXPORT_FSYNC,
+                 fsync_interval: float = EXPORT_FSYNC_INTERVAL, seed_xlsx_path: Optional[str] = APPOINTMENTS_XLSX_PATH):
+        self.path = path
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+        self.seed_xlsx_path = seed_xlsx_path
+        self._lock = threading.Lock()
+        self._fd = None
+        self._last_fsync = 0.0
+        self._dirty = False
+
+    def _open(self) -> int:
+        if self._fd is None:
+            try:
+                # O_EXCL: exactly one process creates (and seeds) the journal
+                self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_EXCL | _O_BINARY, 0o644)
+            except FileExistsError:
+                self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | _O_BINARY)
+            else:
+                self._seed_from_xlsx()
+        return self._fd
+
+    def _seed_from_xlsx(self) -> None:
+        """Carry bookings exported before the journal existed over from appointments.xlsx."""
+        if not self.seed_xlsx_path or not os.path.exists(self.seed_xlsx_path):
+            return
+        df = pd.read_excel(self.seed_xlsx_path)
+        if df.empty:
+            return
+        for col in EXPORT_COLUMNS:
+            if col not in df.columns:
+                df[col] = ''
+        df = df[EXPORT_COLUMNS].fillna('')
+        records = [
+            {**{col: str(row[col]) for col in EXPORT_COLUMNS}, 'duration_minutes': int(row['duration_minutes'] or 0)}
+            for row in df.to_dict('records')
+        ]
+        self._write_lines(records)
+        os.fsync(self._fd)
+        print(f"[EXPORT] Seeded journal with {len(records)} rows from {self.seed_xlsx_path}")
+
+    def _write_lines(self, records: Iterable[dict]) -> None:
+        payload = ''.join(json.dumps(r, ensure_ascii=False, separators=(',', ':')) + '\n' for r in records)
+        if payload:
+            os.write(self._fd, payload.encode('utf-8'))
+            self._dirty = True
+
+    def _maybe_fsync(self) -> None:
+        if not self._dirty or self.fsync_policy == 'never':
+            return
+        now = time.monotonic()
+        if self.fsync_policy == 'always' or now - self._last_fsync >= self.fsync_interval:
+            os.fsync(self._fd)
+            self._last_fsync = now
+            self._dirty = False
+
+    def append(self, record: dict) -> None:
+        self.append_many([record])
+
+    def append_many(self, records: Iterable[dict]) -> None:
+        """Write a batch of records with a single syscall (and at most one fsync)."""
+        with self._lock:
+            self._open()
+            self._write_lines(records)
+            self._maybe_fsync()
+
+    def flush(self) -> None:
+        """Force any un-synced appends to disk."""
+        with self._lock:
+            if self._fd is not None and self._dirty:
+                os.fsync(self._fd)
+                self._last_fsync = time.monotonic()
+                self._dirty = False
+
+    def read_from(self, offset: int = 0) -> tuple:
+        """
+        Records appended at or after byte offset, plus the offset just past the
+        last complete line (a line still being written is left for next time).
+        """
+        with self._lock:
+            self._open()
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+        end = data.rfind(b'\n') + 1
+        rows = []
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                # A torn line from a crash mid-write; everything around it is intact
+                continue
+        return rows, offset + end
+
+    def read_dataframe(self) -> pd.DataFrame:
+        """Bookings that are still active, in append order, with the export columns."""
+        rows, _ = self.read_from(0)
+        df = pd.DataFrame(rows)
+        for col in EXPORT_COLUMNS + ['event']:
+            if col not in df.columns:
+                df[col] = ''
+        return current_bookings(df)[EXPORT_COLUMNS]
+
+    def compact_to_excel(self, export_path: str = APPOINTMENTS_XLSX_PATH, force: bool = False) -> int:
+        """
+        Materialize the journal as appointments.xlsx. Skipped when the workbook is
+        already newer than the journal unless force=True. Returns rows written
+        (or -1 if it was already up to date).
+        """
+        self.flush()
+        with self._lock:
+            self._open()
+        if not force and os.path.exists(export_path) and os.path.getmtime(export_path) >= os.path.getmtime(self.path):
+            return -1
+        df = self.read_dataframe()
+
+        def write(f) -> None:
+            with pd.ExcelWriter(f, engine='openpyxl') as writer:
+                df.to_excel(writer, index=False)
+
+        # Unique temp file per writer, so concurrent compactions cannot trample each other
+        atomic_write(export_path, write, mode='wb')
+        return len(df)
+
+
+def current_bookings(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Reduce journal rows (in append order) to the active bookings: the last
+    event per booking_id wins, and it must be a booking, not a cancellation.
+    Re-exports of the same booking therefore count once.
+    """
+    if df.empty:
+        return df
+    pos = pd.Series(range(len(df)), index=df.index)
+    is_last = pos == pos.groupby(df['booking_id']).transform('max')
+    events = df['event'].fillna('') if 'event' in df.columns else pd.Series('', index=df.index)
+    return df[is_last & (events != EVENT_CANCELLED)]
+
+
+_journal: Optional[AppointmentJournal] = None
+_journal_lock = threading.Lock()
+
+
+def get_appointment_journal() -> AppointmentJournal:
+    """Process-wide journal for APPOINTMENTS_JOURNAL_PATH."""
+    global _journal
+    with _journal_lock:
+        if _journal is None:
+            _journal = AppointmentJournal()
+            atexit.register(_journal.flush)
+        return _journal
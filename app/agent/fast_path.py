@@ -0,0 +1,300 @@
+import json
+import re
+from datetime import datetime, timedelta
+from typing import Generator, Optional
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from app.agent.dates import normalize_date
+from app.config import AVAILABILITY_MAX_RESULTS
+
+# Visit length by patient type (workflow step 2)
+NEW_PATIENT_MINUTES = 60
+RETURNING_PATIENT_MINUTES = 30
+
+_AVAILABILITY_TOOLS = ('get_calendly_availability_with_duration', 'search_availability')
+
+_MONTHS = (r"(?:jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?|"
+           r"sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)")
+_DATE_RE = re.compile(
+    r"\b(?:\d{4}-\d{1,2}-\d{1,2}"                                   # 2025-09-10
+    r"|\d{1,2}[-/]\d{1,2}[-/]\d{4}"                                 # 20-05-1985, 09/10/2025
+    rf"|{_MONTHS}\.?\s+\d{{1,2}}(?:st|nd|rd|th)?,?\s+\d{{4}}"        # September 10th, 2025
+    rf"|\d{{1,2}}(?:st|nd|rd|th)?\s+(?:of\s+)?{_MONTHS}\.?,?\s+\d{{4}}"  # 10 Sep 2025
+    r"|today|tomorrow)\b",
+    re.IGNORECASE,
+)
+_DOCTOR_RE = re.compile(r"\bDr\.?\s+([A-Z][a-zA-Z'\-]+)")
+_NAME_WORD = r"([A-Za-z][A-Za-z'\-]+)"
+# Only an explicit introduction: "I am free on ..." or "I'm available ..." is not a name
+_INTRO_RE = re.compile(rf"\b(?:my name is|name:)\s+{_NAME_WORD}\s+{_NAME_WORD}", re.IGNORECASE)
+# "Aarav Sharma, 1985-05-20, ..." (name first, then a comma)
+_LEADING_NAME_RE = re.compile(rf"^\s*{_NAME_WORD}\s+{_NAME_WORD}\s*,")
+_NOT_NAMES = {'dr', 'doctor', 'born', 'dob', 'and', 'the', 'a', 'an', 'new', 'returning', 'patient', 'looking', 'trying'}
+
+# Whole-message date answers: "2025-09-10", "on September 10th, 2025 please"
+_DATE_ONLY_RE = re.compile(
+    rf"^\s*(?:(?:on|for|how about|what about|let's do|lets do|maybe|try)\s+)?(?P<date>{_DATE_RE.pattern})"
+    r"(?:\s+(?:please|works|then))?\s*[.!?]?\s*$",
+    re.IGNORECASE,
+)
+_ORDINALS = {'first': 1, 'second': 2, 'third': 3, 'fourth': 4, 'fifth': 5,
+             'sixth': 6, 'seventh': 7, 'eighth': 8, 'last': -1}
+_CHOICE_RE = re.compile(
+    r"^\s*(?:i'll take |i will take |let's do |lets do |book |take )?(?:option |slot |number |no\.? |#)?"
+    r"(?P<number>\d{1,2})(?:st|nd|rd|th)?(?: please)?\s*[.!]?\s*$"
+    r"|^\s*(?:i'll take |i will take |let's do |lets do |book |take )?the (?P<ordinal>" + "|".join(_ORDINALS) +
+    r")(?: one| option| slot)?(?: please)?\s*[.!]?\s*$",
+    re.IGNORECASE,
+)
+_TIME_CHOICE_RE = re.compile(
+    r"^\s*(?:(?:at|book|take|let's do|lets do)\s+)?(?P<hour>\d{1,2})(?::(?P<minute>\d{2}))?\s*(?P<ampm>am|pm)?"
+    r"(?: please)?\s*[.!]?\s*$",
+    re.IGNORECASE,
+)
+_SLOT_ID_RE = re.compile(r"\bcalendly_(?:run_)?[\d_]+\b")
+
+
+def _parse_date(text: str) -> str:
+    """YYYY-MM-DD for a date found by _DATE_RE, or '' if it is not a real date."""
+    lowered = text.strip().lower()
+    today = datetime.today()
+    if lowered == 'today':
+        return today.strftime('%Y-%m-%d')
+    if lowered == 'tomorrow':
+        return (today + timedelta(days=1)).strftime('%Y-%m-%d')
+    cleaned = re.sub(r"\bof\s+", "", text.strip(), flags=re.IGNORECASE)
+    parsed = normalize_date(cleaned)
+    return parsed if re.fullmatch(r"\d{4}-\d{2}-\d{2}", parsed) else ""
+
+
+def _calendly_link(doctor: str) -> str:
+    return "https://calendly.com/" + doctor.lower().replace('.', '').replace(' ', '-')
+
+
+def _load_json(content) -> Optional[dict]:
+    try:
+        data = json.loads(content) if isinstance(content, str) else content
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _expand_slots(result: dict) -> list:
+    """Rows of a compact availability table as dicts, shared fields included."""
+    columns = result.get('columns') or []
+    shared = {k: v for k, v in result.items() if k not in ('columns', 'slots', 'next_cursor', 'more_available')}
+    return [{**shared, **dict(zip(columns, row))} for row in result.get('slots') or []]
+
+
+class BookingState:
+    """
+    Where a conversation stands in the booking workflow, read back from its
+    messages (tool calls and their results), so it survives reruns and
+    session stores without being kept anywhere else.
+    """
+
+    def __init__(self):
+        self.patient: Optional[dict] = None  # lookup_patient args
+        self.is_new: Optional[bool] = None
+        self.doctor = ""
+        self.offer: list = []  # slots shown by the latest availability result, if not yet booked
+        self.booked = False
+
+    @classmethod
+    def from_messages(cls, messages: list) -> 'BookingState':
+        state = cls()
+        calls = {}
+        for message in messages:
+            if isinstance(message, HumanMessage) and isinstance(message.content, str):
+                doctor = _DOCTOR_RE.search(message.content)
+                if doctor:
+                    state.doctor = f"Dr. {doctor.group(1).capitalize()}"
+            elif isinstance(message, AIMessage):
+                for call in message.tool_calls or []:
+                    calls[call.get('id')] = call
+            elif isinstance(message, ToolMessage):
+                call = calls.get(message.tool_call_id)
+                if call is not None:
+                    state._apply(call['name'], call.get('args') or {}, message.content)
+        return state
+
+    def _apply(self, tool_name: str, args: dict, content) -> None:
+        if tool_name == 'lookup_patient':
+            result = _load_json(content)
+            if result is None or 'error' in result or result.get('possible_matches'):
+                # Unresolved until the patient confirms a near-match (the model takes that turn)
+                return
+            self.patient = args
+            self.is_new = 'patient_id' not in result
+            self.booked = False
+            self.offer = []
+            preferred = result.get('preferred_doctor')
+            if not self.doctor and isinstance(preferred, str) and preferred.strip():
+                self.doctor = preferred.strip()
+        elif tool_name in _AVAILABILITY_TOOLS:
+            result = _load_json(content) or {}
+            self.offer = _expand_slots(result)
+            if args.get('doctor_name'):
+                self.doctor = args['doctor_name']
+        elif tool_name == 'book_calendly_slot':
+            if str(content).startswith('Success'):
+                self.booked = True
+                self.offer = []
+
+    @property
+    def duration(self) -> int:
+        return NEW_PATIENT_MINUTES if self.is_new else RETURNING_PATIENT_MINUTES
+
+    @property
+    def patient_name(self) -> str:
+        if not self.patient:
+            return ""
+        return f"{self.patient.get('first_name', '')} {self.patient.get('last_name', '')}".strip()
+
+
+class FastPathRouter:
+    """
+    Handles the predictable steps of the booking workflow (AGENT_SYSTEM_PROMPT
+    steps 1-3) without the model:
+    - name and date of birth given -> lookup_patient (then availability too if
+      the message also names a doctor and a date)
+    - a bare date once the patient and doctor are known -> availability
+    - a choice from the slots just shown ("2", "the first one", "10:30") ->
+      book_calendly_slot
+    Anything else returns None and goes to the model. route() returns a
+    generator that yields (tool_name, args), is sent each tool's result
+    content, and returns the reply text; the runtime records the calls and
+    results in the history exactly as if the model had made them.
+    """
+
+    def route(self, messages: list, user_input: str) -> Optional[Generator]:
+        state = BookingState.from_messages(messages)
+        identity = self._identity(user_input)
+        if identity is not None:
+            if state.patient is None or self._different_patient(state.patient, identity):
+                return self._lookup_turn(state, user_input, identity)
+            # Same patient again, or only part of the identity changed: the model sorts that out
+            return None
+        if state.patient is None:
+            return None
+        if state.offer and not state.booked:
+            slot = self._chosen_slot(state.offer, user_input)
+            if slot is not None:
+                return self._booking_turn(state, slot)
+        date_match = _DATE_ONLY_RE.match(user_input)
+        if date_match and state.doctor:
+            date = _parse_date(date_match.group('date'))
+            if date:
+                return self._availability_turn(state, state.doctor, date)
+        return None
+
+    @staticmethod
+    def _different_patient(patient: dict, identity: dict) -> bool:
+        """True if both the name and the date of birth differ from the patient already looked up."""
+        name = (str(patient.get('first_name', '')).lower(), str(patient.get('last_name', '')).lower())
+        same_name = name == (identity['first_name'].lower(), identity['last_name'].lower())
+        same_dob = _parse_date(str(patient.get('dob', ''))) == identity['dob']
+        return not same_name and not same_dob
+
+    @staticmethod
+    def _identity(text: str) -> Optional[dict]:
+        match = _INTRO_RE.search(text) or _LEADING_NAME_RE.match(text)
+        if match is None or {match.group(1).lower(), match.group(2).lower()} & _NOT_NAMES:
+            return None
+        dates = [_parse_date(m.group(0)) for m in _DATE_RE.finditer(text)]
+        dates = [d for d in dates if d]
+        # The date of birth is the earliest date mentioned and must be in the past; a later one is the visit date
+        today = datetime.today().strftime('%Y-%m-%d')
+        past = [d for d in dates if d < today]
+        if not past:
+            return None
+        dob = min(past)
+        later = [d for d in dates if d >= today]
+        return {'first_name': match.group(1).capitalize(), 'last_name': match.group(2).capitalize(),
+                'dob': dob, 'visit_date': later[0] if later else ""}
+
+    @staticmethod
+    def _chosen_slot(offer: list, text: str) -> Optional[dict]:
+        slot_id = _SLOT_ID_RE.search(text)
+        if slot_id:
+            return next((s for s in offer if s.get('slot_id') == slot_id.group(0)), None)
+        match = _CHOICE_RE.match(text)
+        if match:
+            index = int(match.group('number')) if match.group('number') else _ORDINALS[match.group('ordinal').lower()]
+            if index == -1:
+                return offer[-1]
+            return offer[index - 1] if 1 <= index <= len(offer) else None
+        match = _TIME_CHOICE_RE.match(text)
+        if match and (match.group('minute') or match.group('ampm')):
+            hour, minute = int(match.group('hour')), int(match.group('minute') or 0)
+            ampm = (match.group('ampm') or '').lower()
+            if ampm == 'pm' and hour < 12:
+                hour += 12
+            elif ampm == 'am' and hour == 12:
+                hour = 0
+            wanted = f"{hour:02d}:{minute:02d}"
+            return next((s for s in offer if str(s.get('start', ''))[:5] == wanted), None)
+        return None
+
+    def _lookup_turn(self, state: BookingState, text: str, identity: dict) -> Generator:
+        args = {k: identity[k] for k in ('first_name', 'last_name', 'dob')}
+        content = yield 'lookup_patient', args
+        result = _load_json(content)
+        if result is None or 'error' in result:
+            return ("I'm sorry, I couldn't look up your record just now. "
+                    "Could you confirm your full name and date of birth (YYYY-MM-DD)?")
+        if result.get('possible_matches'):
+            options = [f"{m.get('first_name', '')} {m.get('last_name', '')}, born {m.get('dob', '')}"
+                       for m in result['possible_matches']]
+            return (f"I couldn't find an exact match for {args['first_name']} {args['last_name']} "
+                    f"({args['dob']}), but we have a record for " + " or ".join(options) +
+                    ". Is that you? If not, I'll register you as a new patient.")
+        state._apply('lookup_patient', args, json.dumps(result))
+        doctor = _DOCTOR_RE.search(text)
+        if doctor:
+            state.doctor = f"Dr. {doctor.group(1).capitalize()}"
+
+        first = identity['first_name']
+        if state.is_new:
+            reply = (f"Thanks, {first}! I don't see you in our system yet, so I'll book a "
+                     f"{NEW_PATIENT_MINUTES}-minute new-patient visit.")
+        else:
+            reply = (f"Welcome back, {first}! I found your record. As a returning patient, "
+                     f"your visit will be {RETURNING_PATIENT_MINUTES} minutes.")
+        if state.doctor and identity['visit_date']:
+            follow_up = yield from self._availability_turn(state, state.doctor, identity['visit_date'])
+            return f"{reply}\n\n{follow_up}"
+        if state.doctor:
+            return f"{reply}\n\nWhat date would you like to see {state.doctor}?"
+        return f"{reply}\n\nWhich doctor would you like to see, and on what date?"
+
+    def _availability_turn(self, state: BookingState, doctor: str, date: str) -> Generator:
+        args = {'calendly_link': _calendly_link(doctor), 'date': date,
+                'required_duration_minutes': state.duration, 'doctor_name': doctor,
+                'limit': AVAILABILITY_MAX_RESULTS}
+        result = _load_json((yield 'get_calendly_availability_with_duration', args)) or {}
+        slots = _expand_slots(result)
+        when = datetime.strptime(date, '%Y-%m-%d').strftime('%A, %B %d, %Y')
+        if not slots:
+            reason = result.get('error') or result.get('message') or "No slots are available that day."
+            return f"{reason} Would you like to try a different date with {doctor}?"
+        lines = [f"{n}. {s['start']} - {s['end']} (slot ID: {s['slot_id']})" for n, s in enumerate(slots, 1)]
+        location = f" at {slots[0]['location']}" if slots[0].get('location') else ""
+        more = " More times are available later that day if none of these work." if result.get('next_cursor') else ""
+        return (f"Here are the available {state.duration}-minute appointments with {doctor}{location} "
+                f"on {when}:\n\n" + "\n".join(lines) +
+                f"\n\nReply with the number of the time that works for you.{more}")
+
+    def _booking_turn(self, state: BookingState, slot: dict) -> Generator:
+        args = {'calendly_link': slot.get('calendly_link') or _calendly_link(slot.get('doctor', state.doctor)),
+                'slot_id': slot['slot_id'], 'patient_name': state.patient_name}
+        content = str((yield 'book_calendly_slot', args))
+        if not content.startswith('Success'):
+            return f"I couldn't book that time: {content.removeprefix('Error: ')} Please choose another option."
+        booking_id = re.search(r'Booking ID: (\S+?)\.?\s', content)
+        date = datetime.strptime(str(slot['date']), '%Y-%m-%d').strftime('%A, %B %d, %Y')
+        return (f"You're booked with {slot.get('doctor', state.doctor)} on {date} from {slot['start']} to "
+                f"{slot['end']}" + (f" at {slot['location']}" if slot.get('location') else "") + ". "
+                + (f"Your booking ID is {booking_id.group(1)}.\n\n" if booking_id else "\n\n")
+                + "What email address should I send your intake forms and calendar invite to?")
@@ -0,0 +1,129 @@
+import os
+import stat
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+from app.config import FILE_LOCK_TIMEOUT
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Sentinel for "write whatever version is on disk"
+ANY_VERSION = object()
+
+_held = threading.local()
+
+
+class FileLockTimeout(TimeoutError):
+    pass
+
+
+class FileVersionConflict(Exception):
+    """The file changed on disk since the version a writer based its update on."""
+
+
+def file_version(path: str) -> Optional[tuple]:
+    """
+    Version token of a file, or None if it does not exist. Every atomic_write
+    replaces the inode, so the token changes even within one mtime tick.
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def _try_lock(fd: int) -> bool:
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+
+def _unlock(fd: int) -> None:
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def file_lock(path: str, timeout: float = FILE_LOCK_TIMEOUT):
+    """
+    Exclusive advisory lock for writers of path, held on a path + '.lock'
+    sidecar (the data file itself is swapped out by atomic_write). Excludes
+    other processes and other threads; reentrant within a thread. Waits up
+    to timeout seconds, then raises FileLockTimeout.
+    """
+    lock_path = os.path.abspath(path) + '.lock'
+    held = getattr(_held, 'counts', None)
+    if held is None:
+        held = _held.counts = {}
+    if held.get(lock_path):
+        held[lock_path] += 1
+        try:
+            yield
+        finally:
+            held[lock_path] -= 1
+        return
+
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        deadline = time.monotonic() + timeout
+        delay = 0.001
+        while not _try_lock(fd):
+            if time.monotonic() >= deadline:
+                raise FileLockTimeout(f"Timed out after {timeout:g}s waiting for the lock on {path}")
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+        held[lock_path] = 1
+        try:
+            yield
+        finally:
+            held[lock_path] = 0
+            _unlock(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path: str, write: Callable, mode: str = 'w', expected_version=ANY_VERSION, **open_kwargs) -> tuple:
+    """
+    Replace path with what write(f) writes to a temp file in the same
+    directory: readers see the old file or the new one, never a partial
+    one. With expected_version (a file_version() token, None for "must not
+    exist yet"), raises FileVersionConflict instead if the file changed.
+    Runs under file_lock(path). Returns the new version.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    with file_lock(path):
+        if expected_version is not ANY_VERSION and file_version(path) != expected_version:
+            raise FileVersionConflict(f"{path} changed since it was read")
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, mode, **open_kwargs) as f:
+                write(f)
+                f.flush()
+                os.fsync(f.fileno())
+            # mkstemp files are owner-only; keep the mode of the file being replaced
+            try:
+                os.chmod(tmp_path, stat.S_IMODE(os.stat(path).st_mode))
+            except FileNotFoundError:
+                os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return file_version(path)
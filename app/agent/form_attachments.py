@@ -0,0 +1,128 @@
+import copy
+import os
+import threading
+from collections import OrderedDict
+from email.mime.application import MIMEApplication
+from typing import Optional
+
+from app.config import FORMS_DIR, FORM_CACHE_MAX_BYTES
+
+FORM_EXTENSIONS = ('.pdf', '.doc', '.docx')
+
+# Always attached first when present
+MAIN_FORM_NAME = "New Patient Intake Form.pdf"
+
+_SUBTYPES = {
+    '.pdf': 'pdf',
+    '.doc': 'msword',
+    '.docx': 'vnd.openxmlformats-officedocument.wordprocessingml.document',
+}
+
+
+class FormAttachmentCache:
+    """
+    Ready-to-attach MIME parts for the files in FORMS_DIR.
+
+    Each part is read and base64-encoded once and kept under its
+    (path, mtime, size) key, so sending forms to another patient costs a
+    directory scan plus a copy of the part's headers, not a disk read and
+    re-encode. A changed file gets a new key and is rebuilt; removed files
+    drop out. Cached parts are capped at max_bytes of encoded data (least
+    recently used evicted first); a form bigger than the cap is built
+    fresh for every email instead of being cached.
+    """
+
+    def __init__(self, forms_dir: str = FORMS_DIR, max_bytes: int = FORM_CACHE_MAX_BYTES):
+        self.forms_dir = forms_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._parts: OrderedDict = OrderedDict()  # (path, mtime_ns, size) -> (part, encoded_bytes)
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _form_entries(self) -> list:
+        entries = [e for e in os.scandir(self.forms_dir) if e.is_file() and e.name.endswith(FORM_EXTENSIONS)]
+        # Main intake form first, then the others in directory order
+        return sorted(entries, key=lambda e: e.name != MAIN_FORM_NAME)
+
+    @staticmethod
+    def _build_part(path: str, filename: str) -> MIMEApplication:
+        with open(path, 'rb') as f:
+            content = f.read()
+        subtype = _SUBTYPES.get(os.path.splitext(filename)[1].lower(), 'octet-stream')
+        part = MIMEApplication(content, _subtype=subtype)
+        part.add_header('Content-Disposition', 'attachment', filename=filename)
+        return part
+
+    def _evict(self) -> None:
+        while self._bytes > self.max_bytes and self._parts:
+            _, (_, size) = self._parts.popitem(last=False)
+            self._bytes -= size
+
+    def _get(self, entry: os.DirEntry) -> MIMEApplication:
+        stat = entry.stat()
+        key = (entry.path, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._parts.get(key)
+            if cached is not None:
+                self._parts.move_to_end(key)
+                self.hits += 1
+                return cached[0]
+        part = self._build_part(entry.path, entry.name)
+        encoded = len(part.get_payload())
+        with self._lock:
+            self.misses += 1
+            # Older versions of this file are stale now
+            for stale in [k for k in self._parts if k[0] == entry.path and k != key]:
+                self._bytes -= self._parts.pop(stale)[1]
+            if encoded <= self.max_bytes:
+                self._parts[key] = (part, encoded)
+                self._bytes += encoded
+                self._evict()
+        return part
+
+    def get_attachments(self) -> list:
+        """
+        One dict per form file: filename, size (bytes on disk) and part, a
+        MIME part private to the caller (safe to attach to a message).
+        Files that cannot be read are skipped.
+        """
+        attachments = []
+        for entry in self._form_entries():
+            try:
+                part = self._get(entry)
+            except OSError as e:
+                print(f"[FORM READ ERROR] Could not read {entry.name}: {str(e)}")
+                continue
+            # Shallow copy with its own header list; the encoded payload (a str) is shared
+            clone = copy.copy(part)
+            clone._headers = list(part._headers)
+            attachments.append({
+                "filename": entry.name,
+                "size": entry.stat().st_size,
+                "part": clone,
+            })
+        return attachments
+
+    def clear(self) -> None:
+        with self._lock:
+            self._parts.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'entries': len(self._parts), 'bytes': self._bytes, 'hits': self.hits, 'misses': self.misses}
+
+
+_cache: Optional[FormAttachmentCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_form_attachment_cache() -> FormAttachmentCache:
+    """Process-wide attachment cache for FORMS_DIR."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = FormAttachmentCache(FORMS_DIR)
+        return _cache
@@ -0,0 +1,84 @@
+import threading
+from typing import Optional
+
+import httpx
+from langchain_openai import ChatOpenAI
+from pydantic import SecretStr
+
+from app.config import (
+    AGENT_MODEL_NAME, OPENAI_API_KEY, OPENAI_BASE_URL, OPENAI_KEEPALIVE_EXPIRY, OPENAI_MAX_CONNECTIONS,
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS, OPENAI_TIMEOUT,
+)
+
+_lock = threading.Lock()
+_http_client: Optional[httpx.Client] = None
+_http_async_client: Optional[httpx.AsyncClient] = None
+_models: dict = {}
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+    )
+
+
+def get_http_client() -> httpx.Client:
+    """Process-wide keep-alive pool for OpenAI calls (thread-safe, shared by all sessions)."""
+    global _http_client
+    with _lock:
+        if _http_client is None:
+            _http_client = httpx.Client(limits=_limits(), timeout=OPENAI_TIMEOUT)
+        return _http_client
+
+
+def get_http_async_client() -> httpx.AsyncClient:
+    global _http_async_client
+    with _lock:
+        if _http_async_client is None:
+            _http_async_client = httpx.AsyncClient(limits=_limits(), timeout=OPENAI_TIMEOUT)
+        return _http_async_client
+
+
+def create_chat_model(tools: Optional[list] = None, api_key: Optional[str] = OPENAI_API_KEY,
+                      model: str = AGENT_MODEL_NAME, base_url: Optional[str] = OPENAI_BASE_URL,
+                      http_client: Optional[httpx.Client] = None,
+                      http_async_client: Optional[httpx.AsyncClient] = None):
+    """Build a ChatOpenAI (bound to tools when given). Prefer get_chat_model() in request paths."""
+    llm = ChatOpenAI(
+        api_key=SecretStr(api_key or ""),
+        model=model,
+        temperature=0,
+        base_url=base_url,
+        timeout=OPENAI_TIMEOUT,
+        # Token usage on streamed replies too (the runtime enforces a token budget)
+        stream_usage=True,
+        http_client=http_client,
+        http_async_client=http_async_client,
+    )
+    return llm.bind_tools(tools) if tools else llm
+
+
+def get_chat_model(tools: Optional[list] = None):
+    """
+    The agent's chat model, built once per process and tools list.
+
+    Creating ChatOpenAI and binding tools each turn re-creates the HTTP
+    client (new TCP/TLS connections) and re-serializes every tool schema.
+    Here both happen once; every session reuses the bound model and its
+    keep-alive pool (OPENAI_MAX_CONNECTIONS / OPENAI_MAX_KEEPALIVE_CONNECTIONS).
+    """
+    if tools is None:
+        from app.agent.tools import all_tools
+        tools = all_tools
+    key = (OPENAI_API_KEY, AGENT_MODEL_NAME, OPENAI_BASE_URL, tuple(t.name for t in tools))
+    model = _models.get(key)
+    if model is None:
+        http_client, http_async_client = get_http_client(), get_http_async_client()
+        with _lock:
+            model = _models.get(key)
+            if model is None:
+                model = create_chat_model(tools, http_client=http_client, http_async_client=http_async_client)
+                _models[key] = model
+    return model
@@ -0,0 +1,274 @@
+import atexit
+import heapq
+import itertools
+import queue
+import smtplib
+import threading
+import time
+from collections import OrderedDict
+from email.message import Message
+from typing import Optional
+
+from app.config import (
+    SMTP_BATCH_SIZE, SMTP_IDLE_PROBE_SECONDS, SMTP_MAX_RETRIES, SMTP_PASSWORD, SMTP_POOL_SIZE,
+    SMTP_PORT, SMTP_SERVER, SMTP_TIMEOUT, SMTP_USE_TLS, SMTP_USERNAME,
+)
+
+# First retry waits this long; each further attempt doubles it
+RETRY_BASE_SECONDS = 2.0
+
+# How many finished jobs status() remembers
+MAX_TRACKED_RESULTS = 1000
+
+# Errors that will not go away by trying again
+_PERMANENT_ERRORS = (smtplib.SMTPAuthenticationError, smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused)
+
+
+class SMTPConnection:
+    """
+    One long-lived SMTP session. Connect, STARTTLS and login happen once;
+    later messages reuse the session. A connection idle for longer than
+    SMTP_IDLE_PROBE_SECONDS is probed with NOOP and reopened if the server
+    has dropped it.
+    """
+
+    def __init__(self, server: str, port: int, username: str = "", password: str = "",
+                 use_tls: bool = True, timeout: float = SMTP_TIMEOUT):
+        self.server = server
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.timeout = timeout
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+
+    def _connect(self) -> smtplib.SMTP:
+        smtp = smtplib.SMTP(self.server, self.port, timeout=self.timeout)
+        try:
+            if self.use_tls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+        except BaseException:
+            smtp.close()
+            raise
+        print(f"[MAILER] Connected to {self.server}:{self.port}")
+        return smtp
+
+    def _ensure(self) -> smtplib.SMTP:
+        if self._smtp is not None and time.monotonic() - self._last_used > SMTP_IDLE_PROBE_SECONDS:
+            try:
+                if self._smtp.noop()[0] != 250:
+                    self.close()
+            except (smtplib.SMTPException, OSError):
+                self.close()
+        if self._smtp is None:
+            self._smtp = self._connect()
+        return self._smtp
+
+    def send(self, msg: Message) -> None:
+        try:
+            self._ensure().send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            # Drop the session so the next attempt starts a fresh one
+            self.close()
+            raise
+        except smtplib.SMTPException:
+            # An error reply (e.g. a rejected recipient): leave the session usable
+            # for the next message. SMTPException subclasses OSError, so it goes first.
+            if self._smtp is not None:
+                try:
+                    self._smtp.rset()
+                except (smtplib.SMTPException, OSError):
+                    self.close()
+            raise
+        except OSError:
+            # Socket-level failure: the session is gone
+            self.close()
+            raise
+        self._last_used = time.monotonic()
+
+    def close(self) -> None:
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                self._smtp.close()
+            self._smtp = None
+
+
+class MailQueue:
+    """
+    Background outbound mail queue.
+
+    enqueue() returns at once; a pool of sender threads, each holding one
+    persistent SMTPConnection, drains the queue in batches of up to
+    batch_size messages per wake-up. Transient failures (disconnects, 4xx
+    replies) are retried with exponential backoff without blocking the
+    caller; refused recipients and bad credentials fail immediately.
+    """
+
+    def __init__(self, server: str = SMTP_SERVER, port: int = SMTP_PORT, username: str = SMTP_USERNAME,
+                 password: str = SMTP_PASSWORD, use_tls: bool = SMTP_USE_TLS, pool_size: int = SMTP_POOL_SIZE,
+                 batch_size: int = SMTP_BATCH_SIZE, max_retries: int = SMTP_MAX_RETRIES,
+                 timeout: float = SMTP_TIMEOUT):
+        self._connection_args = (server, port, username, password, use_tls, timeout)
+        self.pool_size = max(1, pool_size)
+        self.batch_size = max(1, batch_size)
+        self.max_retries = max(1, max_retries)
+        self._queue: queue.Queue = queue.Queue()
+        self._retries: list = []  # heap of (not_before, seq, job)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._pending = 0
+        self._stop = threading.Event()
+        self._threads: list = []
+        self._results: OrderedDict = OrderedDict()
+        self._stats = {'sent': 0, 'failed': 0, 'retried': 0}
+        self._first_enqueued: Optional[float] = None
+        self._last_finished: Optional[float] = None
+
+    # --- Producer side ---
+
+    def enqueue(self, msg: Message) -> str:
+        """Queue a message for delivery and return its job ID."""
+        job_id = f"mail_{next(self._seq)}"
+        with self._cond:
+            self._pending += 1
+            if self._first_enqueued is None:
+                self._first_enqueued = time.monotonic()
+            self._results[job_id] = {'status': 'queued', 'to': msg.get('To', ''), 'attempts': 0}
+            self._trim_results()
+        self._start()
+        self._queue.put({'id': job_id, 'msg': msg, 'attempts': 0})
+        return job_id
+
+    def status(self, job_id: str) -> Optional[dict]:
+        with self._cond:
+            result = self._results.get(job_id)
+            return dict(result) if result else None
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every queued message is sent or has failed. False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stats(self) -> dict:
+        """Counters plus throughput (messages/second from first enqueue to last completion)."""
+        with self._cond:
+            stats = dict(self._stats, pending=self._pending)
+            if self._first_enqueued is not None and self._last_finished is not None:
+                elapsed = max(self._last_finished - self._first_enqueued, 1e-9)
+                stats['elapsed_seconds'] = round(elapsed, 3)
+                stats['messages_per_second'] = round(self._stats['sent'] / elapsed, 1)
+            return stats
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    # --- Sender threads ---
+
+    def _start(self) -> None:
+        with self._cond:
+            if self._threads:
+                return
+            self._stop.clear()
+            for n in range(self.pool_size):
+                thread = threading.Thread(target=self._run, name=f"mail-sender-{n}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _trim_results(self) -> None:
+        while len(self._results) > MAX_TRACKED_RESULTS:
+            self._results.popitem(last=False)
+
+    def _next_batch(self) -> list:
+        """Due retries first, then fresh messages, up to batch_size."""
+        batch = []
+        with self._cond:
+            now = time.monotonic()
+            while self._retries and self._retries[0][0] <= now and len(batch) < self.batch_size:
+                batch.append(heapq.heappop(self._retries)[2])
+            wait = min(self._retries[0][0] - now, 1.0) if self._retries else 1.0
+        if not batch:
+            try:
+                batch.append(self._queue.get(timeout=max(wait, 0.01)))
+            except queue.Empty:
+                return batch
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _finish(self, job: dict, status: str, error: str = "") -> None:
+        with self._cond:
+            self._stats[status] += 1
+            self._pending -= 1
+            self._last_finished = time.monotonic()
+            result = self._results.get(job['id'])
+            if result is not None:
+                result.update(status=status, attempts=job['attempts'], error=error)
+            self._cond.notify_all()
+
+    def _retry_later(self, job: dict, error: str) -> None:
+        delay = RETRY_BASE_SECONDS * 2 ** (job['attempts'] - 1)
+        print(f"[MAILER] {job['id']} attempt {job['attempts']}/{self.max_retries} failed ({error}); retrying in {delay:.0f}s")
+        with self._cond:
+            self._stats['retried'] += 1
+            result = self._results.get(job['id'])
+            if result is not None:
+                result.update(status='retrying', attempts=job['attempts'], error=error)
+            heapq.heappush(self._retries, (time.monotonic() + delay, next(self._seq), job))
+
+    def _run(self) -> None:
+        conn = SMTPConnection(*self._connection_args)
+        try:
+            while not self._stop.is_set():
+                for job in self._next_batch():
+                    self._deliver(conn, job)
+        finally:
+            conn.close()
+
+    def _deliver(self, conn: SMTPConnection, job: dict) -> None:
+        job['attempts'] += 1
+        try:
+            conn.send(job['msg'])
+        except _PERMANENT_ERRORS as e:
+            print(f"[REAL EMAIL ERROR] {job['id']} to {job['msg'].get('To', '')}: {str(e)}")
+            self._finish(job, 'failed', str(e))
+        except (smtplib.SMTPException, OSError) as e:
+            code = getattr(e, 'smtp_code', 0) or 0
+            if 500 <= code < 600 or job['attempts'] >= self.max_retries:
+                print(f"[REAL EMAIL ERROR] {job['id']} to {job['msg'].get('To', '')} gave up: {str(e)}")
+                self._finish(job, 'failed', str(e))
+            else:
+                self._retry_later(job, str(e))
+        else:
+            self._finish(job, 'sent')
+
+
+_mail_queue: Optional[MailQueue] = None
+_mail_queue_lock = threading.Lock()
+
+
+def get_mail_queue() -> MailQueue:
+    """Process-wide mail queue for the SMTP_* settings."""
+    global _mail_queue
+    with _mail_queue_lock:
+        if _mail_queue is None:
+            _mail_queue = MailQueue()
+            # Give queued mail a chance to go out before the process exits
+            atexit.register(_mail_queue.join, SMTP_TIMEOUT)
+        return _mail_queue
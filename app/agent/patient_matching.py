@@ -0,0 +1,106 @@
+from functools import lru_cache
+from typing import Optional
+
+# Minimum mean name similarity (0-1) for a near-miss to be offered as a possible match
+FUZZY_MIN_SCORE = 0.75
+# ...and neither name alone may be further off than this
+FUZZY_MIN_NAME_SCORE = 0.5
+# A candidate whose DOB is a likely typo (see dob_variant) scores this much lower
+DOB_VARIANT_PENALTY = 0.9
+
+_SOUNDEX_CODES = {letter: str(code)
+                  for code, letters in enumerate(('aeiouy', 'bfpv', 'cgjkqsxz', 'dt', 'l', 'mn', 'r'))
+                  for letter in letters}
+
+
+@lru_cache(maxsize=65536)
+def soundex(name: str) -> str:
+    """
+    American Soundex of a name ("Aarav" and "Arav" -> A610, "Mohammed" and
+    "Muhammad" -> M530). Non-letters are ignored; '' for an empty name.
+    """
+    letters = [c for c in name.lower() if 'a' <= c <= 'z']
+    if not letters:
+        return ""
+    code = letters[0].upper()
+    previous = _SOUNDEX_CODES.get(letters[0], '')
+    for letter in letters[1:]:
+        if letter in 'hw':
+            # h and w do not separate two letters with the same code
+            continue
+        digit = _SOUNDEX_CODES[letter]
+        if digit != '0' and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        previous = digit
+    return code.ljust(4, '0')
+
+
+def edit_distance(a: str, b: str, limit: Optional[int] = None) -> int:
+    """
+    Levenshtein distance (insertions, deletions, substitutions). With a
+    limit, gives up as soon as the distance must exceed it and returns
+    limit + 1, which is most of the work saved on clearly different names.
+    """
+    if a == b:
+        return 0
+    if len(a) < len(b):
+        a, b = b, a
+    if limit is not None and len(a) - len(b) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if limit is not None and min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1] if limit is None else min(previous[-1], limit + 1)
+
+
+def name_similarity(a: str, b: str, floor: float = 0.0) -> float:
+    """
+    1 - edit distance / longer length, on already normalized names; 0.0 if
+    it would be below floor.
+    """
+    if not a or not b:
+        return 0.0
+    longest = max(len(a), len(b))
+    limit = int((1.0 - floor) * longest + 1e-9)
+    distance = edit_distance(a, b, limit)
+    return 0.0 if distance > limit else 1.0 - distance / longest
+
+
+def name_score(first: str, last: str, candidate_first: str, candidate_last: str) -> float:
+    """
+    Mean similarity of the two names, or 0.0 if either is too far off or
+    the mean is below FUZZY_MIN_SCORE. First and last name entered the
+    wrong way round count as well.
+    """
+    best = 0.0
+    for cand_first, cand_last in ((candidate_first, candidate_last), (candidate_last, candidate_first)):
+        first_sim = name_similarity(first, cand_first, FUZZY_MIN_NAME_SCORE)
+        if first_sim < FUZZY_MIN_NAME_SCORE:
+            continue
+        # The last name only has to lift the mean to the threshold
+        last_sim = name_similarity(last, cand_last, max(FUZZY_MIN_NAME_SCORE, 2 * FUZZY_MIN_SCORE - first_sim))
+        if last_sim >= FUZZY_MIN_NAME_SCORE:
+            best = max(best, (first_sim + last_sim) / 2)
+    return best if best >= FUZZY_MIN_SCORE else 0.0
+
+
+def dob_variant(dob: str, candidate_dob: str) -> bool:
+    """
+    Whether two different ISO dates of the same year look like one typo
+    apart: day and month swapped, or one digit of the day or month wrong.
+    """
+    if len(dob) != 10 or len(candidate_dob) != 10 or dob[:4] != candidate_dob[:4] or dob == candidate_dob:
+        return False
+    month, day = dob[5:7], dob[8:10]
+    cand_month, cand_day = candidate_dob[5:7], candidate_dob[8:10]
+    if (month, day) == (cand_day, cand_month):
+        return True
+    differing = sum(x != y for x, y in zip(month + day, cand_month + cand_day))
+    return differing == 1
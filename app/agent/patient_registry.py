@@ -0,0 +1,338 @@
+import csv
+import io
+import os
+import sys
+import threading
+from typing import Optional
+
+import pandas as pd
+
+from app.agent.dates import normalize_date, normalize_date_series
+from app.agent.file_store import atomic_write, file_lock
+from app.agent.patient_matching import (
+    DOB_VARIANT_PENALTY, FUZZY_MIN_SCORE, dob_variant, name_score, soundex,
+)
+from app.config import PATIENT_CSV_PATH
+
+
+# Lookup keys stored next to the display names, so reads never re-normalize them
+KEY_COLUMNS = ('first_name_key', 'last_name_key')
+
+_ISO_DATE = r'^\d{4}-\d{2}-\d{2}$'
+
+
+def _norm_name(value) -> str:
+    return str(value).strip().lower()
+
+
+def _canonical_dob(value) -> str:
+    return normalize_date(str(value).strip())
+
+
+def read_patients_csv(source) -> pd.DataFrame:
+    """patients.csv as text: no 101.0 / 9876543210.0 floats, empty cells stay ''."""
+    return pd.read_csv(source, dtype=str, keep_default_na=False)
+
+
+def normalize_patient_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    The at-rest format of patients.csv: ISO DOBs, patient IDs and phones as
+    plain digits (no trailing .0), and lowercase name keys in KEY_COLUMNS.
+    """
+    df = df.copy()
+    df['dob'] = normalize_date_series(df['dob'])
+    for col in ('patient_id', 'phone'):
+        if col in df.columns:
+            df[col] = df[col].astype(str).str.strip().str.replace(r'\.0$', '', regex=True)
+    df['first_name_key'] = df['first_name'].astype(str).str.strip().str.lower()
+    df['last_name_key'] = df['last_name'].astype(str).str.strip().str.lower()
+    return df
+
+
+def patient_record(row: dict) -> dict:
+    """Display values of a stored row, with the ID and flags typed."""
+    record = {k: v for k, v in row.items() if k not in KEY_COLUMNS}
+    patient_id = str(record.get('patient_id', '')).strip()
+    if patient_id.isdigit():
+        record['patient_id'] = int(patient_id)
+    if record.get('is_returning') in ('True', 'False'):
+        record['is_returning'] = record['is_returning'] == 'True'
+    return record
+
+
+def write_patients_csv(df: pd.DataFrame, csv_path: str = PATIENT_CSV_PATH) -> None:
+    """Rewrite the whole file atomically (a reader never sees it half-written)."""
+    atomic_write(csv_path, lambda f: df.to_csv(f, index=False), newline='', encoding='utf-8')
+
+
+def migrate_patients_csv(csv_path: str = PATIENT_CSV_PATH) -> int:
+    """Rewrite patients.csv in the normalized at-rest format. Returns the number of rows."""
+    with file_lock(csv_path):
+        df = normalize_patient_frame(read_patients_csv(csv_path))
+        write_patients_csv(df, csv_path)
+    return len(df)
+
+
+class PatientRegistry:
+    """
+    In-memory view of patients.csv with a hash index on
+    (first name, last name, DOB), all normalized. Files in the at-rest
+    format (see migrate_patients_csv) are indexed straight from their key
+    columns; older files are normalized while loading.
+
+    The file is parsed once; afterwards every call only stats it. Rows that
+    were appended by another process are parsed incrementally from the last
+    known byte offset, anything else (rewrite, truncation) triggers a full
+    reload. Writers in this process update the index in place.
+
+    fuzzy_lookup() narrows near-misses down with two blocking indexes, built
+    on its first call and kept up to date after that: rows by DOB (name
+    typos and transliterations) and rows by (Soundex of each name, birth
+    year) (DOB typos). Only the few rows in those blocks are edit-distance
+    scored, never the whole registry.
+    """
+
+    def __init__(self, csv_path: str = PATIENT_CSV_PATH):
+        self.csv_path = csv_path
+        self._lock = threading.RLock()
+        self._columns: list = []
+        self._records: list = []
+        self._index: dict = {}
+        self._keys: list = []
+        self._max_id = 0  # highest numeric patient_id on file, kept as rows come in
+        self._dob_block: Optional[dict] = None
+        self._phonetic_block: Optional[dict] = None
+        self._stamp = None
+        self._offset = 0
+
+    # --- Loading ---
+
+    def _stat(self):
+        try:
+            st = os.stat(self.csv_path)
+        except FileNotFoundError:
+            return None
+        # The inode changes on every atomic rewrite, even one that keeps size and mtime
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _reset(self) -> None:
+        self._columns = []
+        self._records = []
+        self._index = {}
+        self._keys = []
+        self._max_id = 0
+        self._dob_block = None
+        self._phonetic_block = None
+        self._offset = 0
+
+    def _ingest(self, df: pd.DataFrame) -> None:
+        if df.empty:
+            return
+        if all(col in df.columns for col in KEY_COLUMNS):
+            # Normalized at rest; only rows written by an older writer need work
+            first, last, dob = df['first_name_key'], df['last_name_key'], df['dob']
+            if (first == '').any() or (last == '').any():
+                first = first.where(first != '', df['first_name'].str.strip().str.lower())
+                last = last.where(last != '', df['last_name'].str.strip().str.lower())
+            legacy_dob = ~dob.str.match(_ISO_DATE)
+            if legacy_dob.any():
+                dob = dob.where(~legacy_dob, normalize_date_series(dob[legacy_dob]))
+            keys = zip(first, last, dob)
+        else:
+            keys = zip(
+                df['first_name'].str.strip().str.lower(),
+                df['last_name'].str.strip().str.lower(),
+                normalize_date_series(df['dob']),
+            )
+        base = len(self._records)
+        # Every column is text, so rows are built from plain column lists (no per-cell boxing)
+        columns = list(df.columns)
+        self._records.extend(dict(zip(columns, row)) for row in zip(*(df[col].tolist() for col in columns)))
+        self._keys.extend(keys)
+        if 'patient_id' in df.columns:
+            ids = df['patient_id'].str.strip()
+            ids = ids[ids.str.fullmatch(r'\d+')]
+            if not ids.empty:
+                self._max_id = max(self._max_id, int(ids.astype('int64').max()))
+        for pos in range(base, len(self._keys)):
+            # First occurrence wins, matching the previous scan semantics
+            self._index.setdefault(self._keys[pos], pos)
+        self._block_from(base)
+
+    def _full_load(self, stamp) -> None:
+        self._reset()
+        df = read_patients_csv(self.csv_path)
+        self._columns = list(df.columns)
+        self._ingest(df)
+        self._offset = stamp[1]
+        self._stamp = stamp
+
+    def _tail_load(self, stamp) -> bool:
+        """Parse only bytes appended since the last load. Returns False if the file was rewritten."""
+        if not self._columns or stamp[1] <= self._offset:
+            return False
+        with open(self.csv_path, 'rb') as f:
+            header = f.readline()
+            if next(csv.reader([header.decode('utf-8-sig')]), []) != self._columns:
+                return False
+            f.seek(self._offset - 1)
+            if f.read(1) != b'\n':
+                return False
+            tail = f.read(stamp[1] - self._offset)
+        if tail.strip():
+            df = pd.read_csv(io.BytesIO(tail), header=None, names=self._columns, dtype=str, keep_default_na=False)
+            self._ingest(df)
+        self._offset = stamp[1]
+        self._stamp = stamp
+        return True
+
+    def refresh(self) -> None:
+        """Reload from disk if the file changed since it was last seen."""
+        with self._lock:
+            stamp = self._stat()
+            if stamp == self._stamp:
+                return
+            if stamp is None:
+                self._reset()
+                self._stamp = None
+                return
+            # A different inode means the file was rewritten (atomic_write), not appended to
+            if self._stamp is None or stamp[2] != self._stamp[2] or not self._tail_load(stamp):
+                self._full_load(stamp)
+
+    # --- Queries ---
+
+    @staticmethod
+    def make_key(first_name: str, last_name: str, dob: str) -> tuple:
+        return (_norm_name(first_name), _norm_name(last_name), _canonical_dob(dob))
+
+    def find_position(self, first_name: str, last_name: str, dob: str) -> Optional[int]:
+        """Row position (0-based, file order) of the patient, or None."""
+        key = self.make_key(first_name, last_name, dob)
+        with self._lock:
+            self.refresh()
+            return self._index.get(key)
+
+    def lookup(self, first_name: str, last_name: str, dob: str) -> Optional[dict]:
+        with self._lock:
+            pos = self.find_position(first_name, last_name, dob)
+            return patient_record(self._records[pos]) if pos is not None else None
+
+    def fuzzy_lookup(self, first_name: str, last_name: str, dob: str, limit: int = 3) -> list:
+        """
+        Near-misses for a patient with no exact match, best first: the name,
+        DOB and 'match_score' (0-1, at least FUZZY_MIN_SCORE) of each, and
+        nothing else from their record. Candidates
+        share the DOB, or share both names' Soundex codes and birth year with
+        a DOB one typo away (see dob_variant).
+        """
+        first, last, dob = self.make_key(first_name, last_name, dob)
+        with self._lock:
+            self.refresh()
+            if self._dob_block is None:
+                self._dob_block, self._phonetic_block = {}, {}
+                self._block_from(0)
+            scores = {}
+            for pos in self._dob_block.get(dob, ()):
+                cand_first, cand_last, _ = self._keys[pos]
+                scores[pos] = name_score(first, last, cand_first, cand_last)
+            for pos in self._phonetic_block.get((soundex(first), soundex(last), dob[:4]), ()):
+                cand_first, cand_last, cand_dob = self._keys[pos]
+                if pos not in scores and dob_variant(dob, cand_dob):
+                    scores[pos] = name_score(first, last, cand_first, cand_last) * DOB_VARIANT_PENALTY
+            ranked = sorted((pos for pos, score in scores.items() if score >= FUZZY_MIN_SCORE),
+                            key=lambda pos: (-scores[pos], pos))
+            seen, matches = set(), []
+            for pos in ranked:
+                if self._keys[pos] in seen:
+                    continue
+                seen.add(self._keys[pos])
+                row = self._records[pos]
+                # Identity only: contact and insurance details stay private until the patient confirms
+                matches.append({'first_name': row.get('first_name', ''), 'last_name': row.get('last_name', ''),
+                                'dob': self._keys[pos][2], 'match_score': round(scores[pos], 2)})
+                if len(matches) == limit:
+                    break
+            return matches
+
+    def _block_from(self, start: int) -> None:
+        """Add rows from position start on to the blocking indexes, once they exist."""
+        if self._dob_block is None:
+            return
+        for pos in range(start, len(self._keys)):
+            first, last, dob = self._keys[pos]
+            self._dob_block.setdefault(dob, []).append(pos)
+            self._phonetic_block.setdefault((soundex(first), soundex(last), dob[:4]), []).append(pos)
+
+    def next_patient_id(self) -> int:
+        """One more than the highest numeric patient_id on file."""
+        with self._lock:
+            self.refresh()
+            return max(self._max_id, 100) + 1
+
+    @property
+    def columns(self) -> list:
+        with self._lock:
+            self.refresh()
+            return list(self._columns)
+
+    def __len__(self) -> int:
+        with self._lock:
+            self.refresh()
+            return len(self._records)
+
+    # --- In-place maintenance by writers in this process ---
+
+    def record_appended(self, record: dict) -> None:
+        """Register a row that was just appended to the CSV by this process."""
+        with self._lock:
+            row = {col: record.get(col, "") for col in self._columns} if self._columns else dict(record)
+            key = self.make_key(record.get('first_name', ''), record.get('last_name', ''), record.get('dob', ''))
+            self._records.append(row)
+            self._keys.append(key)
+            patient_id = str(record.get('patient_id', '')).strip()
+            if patient_id.isdigit():
+                self._max_id = max(self._max_id, int(patient_id))
+            self._index.setdefault(key, len(self._records) - 1)
+            self._block_from(len(self._keys) - 1)
+            self._mark_synced()
+
+    def record_updated(self, position: int, fields: dict) -> None:
+        """Apply field updates made to an existing row by this process."""
+        with self._lock:
+            if 0 <= position < len(self._records):
+                self._records[position].update(fields)
+            self._mark_synced()
+
+    def invalidate(self) -> None:
+        """Force a full reload on the next access."""
+        with self._lock:
+            self._stamp = None
+
+    def _mark_synced(self) -> None:
+        stamp = self._stat()
+        self._stamp = stamp
+        self._offset = stamp[1] if stamp else 0
+
+
+_registry: Optional[PatientRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_patient_registry() -> PatientRegistry:
+    """Process-wide registry for PATIENT_CSV_PATH."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = PatientRegistry(PATIENT_CSV_PATH)
+        return _registry
+
+
+if __name__ == "__main__":
+    # python -m app.agent.patient_registry --migrate
+    if '--migrate' in sys.argv[1:]:
+        rows = migrate_patients_csv()
+        get_patient_registry().invalidate()
+        print(f"Migrated {rows} patients in {PATIENT_CSV_PATH} to the normalized format")
+    else:
+        print(f"{len(get_patient_registry())} patients in {PATIENT_CSV_PATH}")
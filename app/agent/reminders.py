@@ -0,0 +1,288 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from app.config import (
+    REMINDER_BATCH_SIZE, REMINDER_LEASE_SECONDS, REMINDER_MAX_ATTEMPTS, REMINDERS_DB_PATH,
+)
+
+_TS_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Longest a worker sleeps without re-checking the store (other processes may add reminders)
+MAX_IDLE_SECONDS = 60.0
+
+
+def _ts(value: datetime) -> str:
+    return value.strftime(_TS_FORMAT)
+
+
+class ReminderStore:
+    """
+    Durable reminder queue in SQLite, one row per (booking_id, reminder_number).
+
+    Due reminders are found through an index on (status, due_at), so a tick
+    costs O(batch) regardless of how many reminders are pending. Rows move
+    scheduled -> sending -> sent; a "sending" claim older than the lease is
+    handed out again after a crash, and only one worker can complete a
+    claim, which makes delivery idempotent per (booking_id, reminder_number).
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS reminders (
+            booking_id TEXT NOT NULL,
+            reminder_number INTEGER NOT NULL,
+            due_at TEXT NOT NULL,
+            type TEXT NOT NULL,
+            message TEXT NOT NULL,
+            patient_name TEXT NOT NULL DEFAULT '',
+            patient_email TEXT NOT NULL DEFAULT '',
+            patient_phone TEXT NOT NULL DEFAULT '',
+            status TEXT NOT NULL DEFAULT 'scheduled',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            claimed_at TEXT,
+            sent_at TEXT,
+            last_error TEXT,
+            PRIMARY KEY (booking_id, reminder_number)
+        );
+        CREATE INDEX IF NOT EXISTS idx_reminders_status_due ON reminders (status, due_at);
+    """
+
+    def __init__(self, db_path: str = REMINDERS_DB_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._connection().executescript(self.SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+    def schedule(self, booking: dict, reminders: list) -> int:
+        """
+        Insert (or reschedule) reminders for a booking. Re-running for the same
+        booking only updates reminders that have not been sent yet.
+        Returns the number of reminders that are pending afterwards.
+        """
+        rows = [
+            (str(booking['booking_id']), int(r['reminder_number']), r['due_at'], r['type'], r['message'],
+             booking.get('patient_name', '') or '', booking.get('patient_email', '') or '',
+             booking.get('patient_phone', '') or '', r.get('status', 'scheduled'))
+            for r in reminders
+        ]
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO reminders (booking_id, reminder_number, due_at, type, message, "
+                "patient_name, patient_email, patient_phone, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (booking_id, reminder_number) DO UPDATE SET "
+                "due_at = excluded.due_at, type = excluded.type, message = excluded.message, "
+                "patient_name = excluded.patient_name, patient_email = excluded.patient_email, "
+                "patient_phone = excluded.patient_phone, status = excluded.status "
+                "WHERE reminders.status IN ('scheduled', 'skipped', 'cancelled')",
+                rows,
+            )
+            return conn.execute(
+                "SELECT COUNT(*) FROM reminders WHERE booking_id = ? AND status = 'scheduled'",
+                (str(booking['booking_id']),),
+            ).fetchone()[0]
+
+    def cancel_booking(self, booking_id: str) -> int:
+        """Drop the unsent reminders of a booking. Returns how many were cancelled."""
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE reminders SET status = 'cancelled' WHERE booking_id = ? AND status = 'scheduled'",
+                (str(booking_id),),
+            ).rowcount
+
+    def recover(self, now: Optional[datetime] = None) -> int:
+        """Return expired "sending" claims (from a crashed worker) to the queue."""
+        now = now or datetime.now()
+        cutoff = _ts(now - timedelta(seconds=REMINDER_LEASE_SECONDS))
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE reminders SET status = 'scheduled', claimed_at = NULL "
+                "WHERE status = 'sending' AND claimed_at < ?",
+                (cutoff,),
+            ).rowcount
+
+    def claim_due(self, now: Optional[datetime] = None, limit: int = REMINDER_BATCH_SIZE) -> list:
+        """Atomically claim up to `limit` due reminders, oldest first."""
+        now_ts = _ts(now or datetime.now())
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT * FROM reminders WHERE status = 'scheduled' AND due_at <= ? ORDER BY due_at LIMIT ?",
+                (now_ts, limit),
+            ).fetchall()
+            if rows:
+                conn.executemany(
+                    "UPDATE reminders SET status = 'sending', claimed_at = ?, attempts = attempts + 1 "
+                    "WHERE booking_id = ? AND reminder_number = ?",
+                    [(now_ts, r['booking_id'], r['reminder_number']) for r in rows],
+                )
+        return [dict(r) for r in rows]
+
+    def mark_sent(self, booking_id: str, reminder_number: int) -> bool:
+        """Complete a claim. False if the claim was lost (e.g. recovered by another worker)."""
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE reminders SET status = 'sent', sent_at = ?, last_error = NULL "
+                "WHERE booking_id = ? AND reminder_number = ? AND status = 'sending'",
+                (_ts(datetime.now()), booking_id, reminder_number),
+            ).rowcount == 1
+
+    def mark_failed(self, reminder: dict, error: str) -> None:
+        """Requeue with exponential backoff, or give up after REMINDER_MAX_ATTEMPTS."""
+        attempts = int(reminder.get('attempts', 0)) + 1
+        if attempts >= REMINDER_MAX_ATTEMPTS:
+            status, due_at = 'failed', reminder['due_at']
+        else:
+            status, due_at = 'scheduled', _ts(datetime.now() + timedelta(seconds=30 * 2 ** attempts))
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE reminders SET status = ?, due_at = ?, last_error = ?, claimed_at = NULL "
+                "WHERE booking_id = ? AND reminder_number = ? AND status = 'sending'",
+                (status, due_at, error[:500], reminder['booking_id'], reminder['reminder_number']),
+            )
+
+    def next_due_at(self) -> Optional[datetime]:
+        row = self._connection().execute(
+            "SELECT MIN(due_at) FROM reminders WHERE status = 'scheduled'"
+        ).fetchone()
+        return datetime.strptime(row[0], _TS_FORMAT) if row and row[0] else None
+
+    def counts(self) -> dict:
+        rows = self._connection().execute("SELECT status, COUNT(*) FROM reminders GROUP BY status").fetchall()
+        return {r[0]: r[1] for r in rows}
+
+
+def deliver_reminder(reminder: dict) -> None:
+    """Default dispatcher: simulated delivery, like the rest of the demo messaging."""
+    key = f"{reminder['booking_id']}:{reminder['reminder_number']}"
+    target = reminder.get('patient_email') or reminder.get('patient_phone') or reminder.get('patient_name')
+    print(f"[REMINDER SENT] ({key}) to {target}: {reminder['message']}")
+
+
+class ReminderWorker:
+    """
+    Background thread that dispatches due reminders in batches.
+
+    Instead of polling every row each tick it asks the store for the next
+    due time and sleeps until then (capped at MAX_IDLE_SECONDS, and woken
+    early by wake() when this process schedules something new).
+    """
+
+    def __init__(self, store: ReminderStore, dispatch: Callable[[dict], None] = deliver_reminder,
+                 batch_size: int = REMINDER_BATCH_SIZE):
+        self.store = store
+        self.dispatch = dispatch
+        self.batch_size = batch_size
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def run_once(self, now: Optional[datetime] = None) -> int:
+        """Dispatch one batch of due reminders. Returns how many were claimed."""
+        batch = self.store.claim_due(now, self.batch_size)
+        for reminder in batch:
+            try:
+                self.dispatch(reminder)
+            except Exception as e:
+                print(f"[REMINDER ERROR] {reminder['booking_id']}#{reminder['reminder_number']}: {str(e)}")
+                self.store.mark_failed(reminder, str(e))
+            else:
+                self.store.mark_sent(reminder['booking_id'], reminder['reminder_number'])
+        return len(batch)
+
+    def _seconds_until_next(self) -> float:
+        next_due = self.store.next_due_at()
+        if next_due is None:
+            return MAX_IDLE_SECONDS
+        return min(max((next_due - datetime.now()).total_seconds(), 0.0), MAX_IDLE_SECONDS)
+
+    def run_forever(self) -> None:
+        recovered = self.store.recover()
+        if recovered:
+            print(f"[REMINDER SYSTEM] Recovered {recovered} interrupted reminder(s)")
+        while not self._stop.is_set():
+            try:
+                if self.run_once() >= self.batch_size:
+                    continue  # More are due right now
+                self._wake.wait(self._seconds_until_next())
+                self._wake.clear()
+            except Exception as e:
+                print(f"[REMINDER ERROR] Worker loop: {str(e)}")
+                self._stop.wait(5)
+
+    def start(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run_forever, name="reminder-worker", daemon=True)
+            self._thread.start()
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+_store: Optional[ReminderStore] = None
+_worker: Optional[ReminderWorker] = None
+_lock = threading.Lock()
+
+
+def get_reminder_store() -> ReminderStore:
+    """Process-wide reminder store for REMINDERS_DB_PATH."""
+    global _store
+    with _lock:
+        if _store is None:
+            _store = ReminderStore(REMINDERS_DB_PATH)
+        return _store
+
+
+def start_reminder_worker() -> ReminderWorker:
+    """Start (once per process) the background worker that sends due reminders."""
+    global _worker
+    store = get_reminder_store()
+    with _lock:
+        if _worker is None:
+            _worker = ReminderWorker(store)
+        _worker.start()
+        return _worker
+
+
+def notify_reminder_worker() -> None:
+    """Wake this process's worker, if any, after new reminders were scheduled."""
+    if _worker is not None:
+        _worker.wake()
+
+
+if __name__ == "__main__":
+    # python -m app.agent.reminders  (standalone worker process)
+    worker = ReminderWorker(get_reminder_store())
+    print(f"[REMINDER SYSTEM] Worker started: {worker.store.counts()}")
+    try:
+        worker.run_forever()
+    except KeyboardInterrupt:
+        pass
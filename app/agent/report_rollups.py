@@ -0,0 +1,256 @@
+import os
+import sqlite3
+import sys
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+import pandas as pd
+
+from app.config import ROLLUPS_DB_PATH
+from app.agent.export_journal import (
+    EVENT_CANCELLED, EXPORT_COLUMNS, AppointmentJournal, current_bookings, get_appointment_journal,
+)
+
+_GROUPINGS = {
+    'doctor': ('date', 'doctor'),
+    'location': ('date', 'location'),
+    'week': ("date(date, 'weekday 0', '-6 days') AS week_start", 'doctor'),
+}
+
+
+class RollupStore:
+    """
+    Per-(date, doctor, location) appointment counts and booked minutes,
+    maintained incrementally from the booking journal.
+
+    sync() applies only the journal lines appended since the last run and
+    stores the new journal offset in the same transaction, so every event
+    is counted exactly once even across crashes and processes. The last
+    event per booking_id wins (re-exports replace, cancellations remove),
+    matching current_bookings() on the raw data. Reports then only sum
+    pre-aggregated rows.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS daily_rollups (
+            date TEXT NOT NULL,
+            doctor TEXT NOT NULL,
+            location TEXT NOT NULL,
+            appointments INTEGER NOT NULL,
+            minutes INTEGER NOT NULL,
+            PRIMARY KEY (date, doctor, location)
+        );
+        CREATE TABLE IF NOT EXISTS booking_state (
+            booking_id TEXT PRIMARY KEY,
+            date TEXT NOT NULL,
+            doctor TEXT NOT NULL,
+            location TEXT NOT NULL,
+            minutes INTEGER NOT NULL,
+            active INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS rollup_meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+    """
+
+    def __init__(self, db_path: str = ROLLUPS_DB_PATH, journal: Optional[AppointmentJournal] = None):
+        self.db_path = db_path
+        self.journal = journal
+        self._local = threading.local()
+        self._connection().executescript(self.SCHEMA)
+
+    def _journal(self) -> AppointmentJournal:
+        return self.journal or get_appointment_journal()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+    # --- Maintenance ---
+
+    @staticmethod
+    def _add(conn, date, doctor, location, appointments, minutes) -> None:
+        conn.execute(
+            "INSERT INTO daily_rollups (date, doctor, location, appointments, minutes) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (date, doctor, location) DO UPDATE SET "
+            "appointments = appointments + excluded.appointments, minutes = minutes + excluded.minutes",
+            (date, doctor, location, appointments, minutes),
+        )
+        if appointments < 0:
+            conn.execute(
+                "DELETE FROM daily_rollups WHERE date = ? AND doctor = ? AND location = ? AND appointments <= 0",
+                (date, doctor, location),
+            )
+
+    def _apply_event(self, conn, row: dict) -> None:
+        booking_id = str(row.get('booking_id', ''))
+        prev = conn.execute(
+            "SELECT date, doctor, location, minutes FROM booking_state WHERE booking_id = ? AND active = 1",
+            (booking_id,),
+        ).fetchone()
+        if prev is not None:
+            self._add(conn, prev['date'], prev['doctor'], prev['location'], -1, -prev['minutes'])
+        if row.get('event') == EVENT_CANCELLED:
+            conn.execute("UPDATE booking_state SET active = 0 WHERE booking_id = ?", (booking_id,))
+            return
+        date = str(row.get('date', '')).split(' ')[0]
+        doctor = str(row.get('doctor', ''))
+        location = str(row.get('location', '') or '')
+        try:
+            minutes = int(row.get('duration_minutes') or 0)
+        except (TypeError, ValueError):
+            minutes = 0
+        conn.execute(
+            "INSERT OR REPLACE INTO booking_state (booking_id, date, doctor, location, minutes, active) "
+            "VALUES (?, ?, ?, ?, ?, 1)",
+            (booking_id, date, doctor, location, minutes),
+        )
+        self._add(conn, date, doctor, location, 1, minutes)
+
+    def _offset(self, conn) -> int:
+        row = conn.execute("SELECT value FROM rollup_meta WHERE key = 'journal_offset'").fetchone()
+        return row['value'] if row else 0
+
+    def sync(self) -> int:
+        """Apply journal events appended since the last sync. Returns events applied."""
+        journal = self._journal()
+        with self._transaction() as conn:
+            offset = self._offset(conn)
+            rows, new_offset = journal.read_from(offset)
+            if os.path.getsize(journal.path) < offset:
+                # The journal was replaced underneath us; start over from raw data
+                return self._rebuild(conn)
+            for row in rows:
+                self._apply_event(conn, row)
+            conn.execute("INSERT OR REPLACE INTO rollup_meta (key, value) VALUES ('journal_offset', ?)", (new_offset,))
+        return len(rows)
+
+    def _expected(self) -> tuple:
+        """Rollups recomputed from the raw journal, plus the offset they cover."""
+        journal = self._journal()
+        rows, offset = journal.read_from(0)
+        df = pd.DataFrame(rows)
+        for col in EXPORT_COLUMNS + ['event']:
+            if col not in df.columns:
+                df[col] = ''
+        df = current_bookings(df).copy()
+        df['date'] = df['date'].astype(str).str.split(' ').str[0]
+        df['location'] = df['location'].fillna('').astype(str)
+        df['duration_minutes'] = pd.to_numeric(df['duration_minutes'], errors='coerce').fillna(0).astype(int)
+        expected = (
+            df.groupby(['date', 'doctor', 'location'])
+            .agg(appointments=('booking_id', 'count'), minutes=('duration_minutes', 'sum'))
+            .reset_index()
+        )
+        return expected, df, offset
+
+    def _rebuild(self, conn) -> int:
+        expected, active, offset = self._expected()
+        conn.execute("DELETE FROM daily_rollups")
+        conn.execute("DELETE FROM booking_state")
+        conn.executemany(
+            "INSERT INTO daily_rollups (date, doctor, location, appointments, minutes) VALUES (?, ?, ?, ?, ?)",
+            [(r.date, r.doctor, r.location, int(r.appointments), int(r.minutes)) for r in expected.itertuples()],
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO booking_state (booking_id, date, doctor, location, minutes, active) "
+            "VALUES (?, ?, ?, ?, ?, 1)",
+            [(r.booking_id, r.date, r.doctor, r.location, int(r.duration_minutes)) for r in active.itertuples()],
+        )
+        conn.execute("INSERT OR REPLACE INTO rollup_meta (key, value) VALUES ('journal_offset', ?)", (offset,))
+        return len(expected)
+
+    def rebuild(self) -> int:
+        """Recompute every rollup from the raw journal. Returns rollup rows written."""
+        with self._transaction() as conn:
+            return self._rebuild(conn)
+
+    def verify(self) -> list:
+        """
+        Consistency check: compare the stored rollups with a rebuild from raw
+        data. Returns a list of mismatching (date, doctor, location) rows;
+        empty means consistent.
+        """
+        self.sync()
+        expected, _, _ = self._expected()
+        stored = pd.read_sql_query(
+            "SELECT date, doctor, location, appointments, minutes FROM daily_rollups", self._connection()
+        )
+        merged = expected.merge(stored, on=['date', 'doctor', 'location'], how='outer',
+                                suffixes=('_expected', '_stored'), indicator=True)
+        merged = merged.fillna({'appointments_expected': 0, 'minutes_expected': 0,
+                                'appointments_stored': 0, 'minutes_stored': 0})
+        bad = merged[(merged['appointments_expected'] != merged['appointments_stored']) |
+                     (merged['minutes_expected'] != merged['minutes_stored'])]
+        return bad.drop(columns=['_merge']).to_dict('records')
+
+    # --- Queries ---
+
+    def booking(self, booking_id: str) -> Optional[dict]:
+        """Current state of one booking (None if it was never exported)."""
+        self.sync()
+        row = self._connection().execute(
+            "SELECT * FROM booking_state WHERE booking_id = ?", (booking_id,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def summary(self, start_date: str, end_date: str, by: str = 'doctor') -> pd.DataFrame:
+        """
+        Totals for start_date <= date <= end_date grouped per day and doctor
+        (by="doctor"), per day and location (by="location") or per week
+        (Monday start) and doctor (by="week").
+        """
+        self.sync()
+        key_exprs = _GROUPINGS[by]
+        keys = [k.split(' AS ')[-1] for k in key_exprs]
+        sql = (
+            f"SELECT {', '.join(key_exprs)}, SUM(appointments) AS total_appointments, "
+            f"SUM(minutes) AS total_minutes_booked FROM daily_rollups "
+            f"WHERE date BETWEEN ? AND ? GROUP BY {', '.join(keys)} ORDER BY {', '.join(keys)}"
+        )
+        df = pd.read_sql_query(sql, self._connection(), params=(start_date, end_date))
+        df['avg_duration_minutes'] = (df['total_minutes_booked'] / df['total_appointments']).round(1)
+        return df
+
+
+_store: Optional[RollupStore] = None
+_store_lock = threading.Lock()
+
+
+def get_rollup_store() -> RollupStore:
+    """Process-wide rollup store for ROLLUPS_DB_PATH."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = RollupStore(ROLLUPS_DB_PATH)
+        return _store
+
+
+if __name__ == "__main__":
+    # python -m app.agent.report_rollups [--rebuild]
+    store = get_rollup_store()
+    if '--rebuild' in sys.argv[1:]:
+        print(f"Rebuilt {store.rebuild()} rollup rows from the journal")
+    mismatches = store.verify()
+    print("Rollups consistent with raw data" if not mismatches else f"{len(mismatches)} mismatching rollup rows:")
+    for row in mismatches:
+        print(f"- {row}")
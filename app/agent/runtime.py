@@ -0,0 +1,285 @@
+import time
+import uuid
+from typing import Callable, Generator, Optional
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+
+from app.agent.context import ConversationContext
+from app.agent.executor import ainvoke_tool, invoke_tool, new_async_tool_batch, new_tool_batch, parse_tool_call
+from app.agent.fast_path import FastPathRouter
+from app.agent.prompts import AGENT_SYSTEM_PROMPT
+from app.agent.streaming import astream_response, stream_response
+from app.config import AGENT_FAST_PATH, AGENT_MAX_ROUNDS, AGENT_MAX_TURN_SECONDS, AGENT_MAX_TURN_TOKENS, AGENT_STREAMING
+
+
+def new_conversation(system_prompt: str = AGENT_SYSTEM_PROMPT) -> list:
+    """Message list for a new session: the system prompt, then the conversation."""
+    return [SystemMessage(content=system_prompt)]
+
+
+def _default_prepare(tool_call: dict) -> tuple:
+    tool_name, tool_args, call_id = parse_tool_call(tool_call)
+    return tool_name, tool_args, call_id, None
+
+
+class AgentRuntime:
+    """
+    One user turn = model -> tools -> model ... until the model answers
+    without tool calls or the turn's budget (rounds, tokens, wall time)
+    runs out. Shared by the CLI and the Streamlit UI; arun_turn() is the
+    asyncio version for the headless server (pass async tools, see
+    app.agent.async_tools).
+
+    The session's message list is extended in place and handed to the
+    model as is each round, so a long conversation is never copied. Front
+    ends customise a turn through hooks:
+    - on_token(text): streamed reply text
+    - prepare_call(tool_call) -> (name, args, call_id, blocked_message_or_None),
+      on the caller's thread before dispatch (e.g. the UI's insurance checks)
+    - on_results(submitted, tool_messages): after each round's tools, with
+      submitted = [(name, args), ...] in call order
+    - on_round(info, response): per-round timing and the round's AIMessage,
+      after the round's tools
+
+    With fast_path on, structured inputs the FastPathRouter recognizes
+    (name + DOB, a bare date, a slot choice) are answered by calling the
+    tools directly with a templated reply; the turn reports one round with
+    'fast_path': True and no model call.
+    """
+
+    def __init__(self, model, tools: list, max_rounds: int = AGENT_MAX_ROUNDS,
+                 max_tokens: int = AGENT_MAX_TURN_TOKENS, max_seconds: float = AGENT_MAX_TURN_SECONDS,
+                 streaming: bool = AGENT_STREAMING, fast_path: bool = AGENT_FAST_PATH):
+        self.model = model
+        self.tools = tools
+        self.max_rounds = max_rounds
+        self.max_tokens = max_tokens
+        self.max_seconds = max_seconds
+        self.streaming = streaming
+        self.router = FastPathRouter() if fast_path else None
+
+    def _budget_exceeded(self, rounds: list, started: float) -> Optional[str]:
+        if len(rounds) >= self.max_rounds:
+            return f"{self.max_rounds} rounds"
+        if sum(r['tokens'] for r in rounds) >= self.max_tokens:
+            return f"{self.max_tokens} tokens"
+        if time.perf_counter() - started >= self.max_seconds:
+            return f"{self.max_seconds:.0f} seconds"
+        return None
+
+    def _end_round(self, messages: list, response: AIMessage, submitted: list, tool_messages: list,
+                   rounds: list, started: float, round_started: float, model_done: float,
+                   context: Optional[ConversationContext], on_results, on_round) -> Optional[str]:
+        """Bookkeeping after a round's tools. Returns the exhausted budget, if any."""
+        messages.extend(tool_messages)
+        if tool_messages and on_results is not None:
+            on_results(submitted, tool_messages)
+
+        usage = getattr(response, 'usage_metadata', None) or {}
+        info = {
+            'round': len(rounds) + 1,
+            'model_seconds': round(model_done - round_started, 3),
+            'tool_seconds': round(time.perf_counter() - model_done, 3),
+            'tool_calls': [name for name, _ in submitted],
+            'tokens': int(usage.get('total_tokens', 0) or 0),
+            'context_tokens': context.last_tokens if context is not None else None,
+        }
+        rounds.append(info)
+        if on_round is not None:
+            on_round(info, response)
+        print(f"[AGENT] Round {info['round']}: model {info['model_seconds']:.2f}s, "
+              f"{len(submitted)} tool call(s) {info['tool_seconds']:.2f}s, {info['tokens']} tokens"
+              + (f", context {context.last_tokens}/{context.full_tokens} tokens" if context is not None else ""))
+
+        if not submitted:
+            return None
+        stopped = self._budget_exceeded(rounds, started)
+        if stopped:
+            # Close the turn with a visible note instead of leaving it mid-way
+            note = (f"I've paused here because this request reached its limit of {stopped}. "
+                    f"Reply 'continue' and I'll pick up where I left off.")
+            messages.append(AIMessage(content=note))
+            print(f"[AGENT] Turn stopped: budget of {stopped} reached")
+        return stopped
+
+    def _route(self, messages: list, user_input: str) -> Optional[Generator]:
+        if self.router is None:
+            return None
+        try:
+            return self.router.route(messages, user_input)
+        except Exception as e:
+            print(f"[FAST PATH] Routing failed, using the model: {str(e)}")
+            return None
+
+    @staticmethod
+    def _start_fast_call(request: tuple, messages: list, prepare_call) -> tuple:
+        tool_name, tool_args = request
+        call = {'name': tool_name, 'args': tool_args, 'id': f"call_fast_{uuid.uuid4().hex[:20]}"}
+        messages.append(AIMessage(content='', tool_calls=[call]))
+        return prepare_call(call)
+
+    def _finish_fast_turn(self, reply: str, messages: list, submitted: list, tool_messages: list, started: float,
+                          on_token, on_results, on_round) -> dict:
+        if tool_messages and on_results is not None:
+            on_results(submitted, tool_messages)
+        response = AIMessage(content=reply)
+        messages.append(response)
+        if self.streaming and on_token is not None:
+            on_token(reply)
+        info = {
+            'round': 1,
+            'model_seconds': 0.0,
+            'tool_seconds': round(time.perf_counter() - started, 3),
+            'tool_calls': [name for name, _ in submitted],
+            'tokens': 0,
+            'context_tokens': None,
+            'fast_path': True,
+        }
+        if on_round is not None:
+            on_round(info, response)
+        print(f"[FAST PATH] {len(submitted)} tool call(s) ({', '.join(info['tool_calls'])}) "
+              f"in {info['tool_seconds']:.2f}s, no model call")
+        return {'content': reply, 'rounds': [info], 'stopped': None}
+
+    def _run_fast_turn(self, turn: Generator, messages: list, started: float, on_token, prepare_call,
+                       on_results, on_round) -> dict:
+        submitted, tool_messages = [], []
+        try:
+            request = next(turn)
+            while True:
+                tool_name, tool_args, call_id, blocked = self._start_fast_call(request, messages, prepare_call)
+                result = blocked if blocked is not None else invoke_tool(self.tools, tool_name, tool_args, call_id)
+                messages.append(result)
+                submitted.append((tool_name, tool_args))
+                tool_messages.append(result)
+                request = turn.send(result.content)
+        except StopIteration as stop:
+            reply = stop.value
+        return self._finish_fast_turn(reply, messages, submitted, tool_messages, started, on_token, on_results, on_round)
+
+    async def _arun_fast_turn(self, turn: Generator, messages: list, started: float, on_token, prepare_call,
+                              on_results, on_round) -> dict:
+        submitted, tool_messages = [], []
+        try:
+            request = next(turn)
+            while True:
+                tool_name, tool_args, call_id, blocked = self._start_fast_call(request, messages, prepare_call)
+                result = blocked if blocked is not None else await ainvoke_tool(self.tools, tool_name, tool_args, call_id)
+                messages.append(result)
+                submitted.append((tool_name, tool_args))
+                tool_messages.append(result)
+                request = turn.send(result.content)
+        except StopIteration as stop:
+            reply = stop.value
+        return self._finish_fast_turn(reply, messages, submitted, tool_messages, started, on_token, on_results, on_round)
+
+    def run_turn(self, messages: list, user_input: str, context: Optional[ConversationContext] = None,
+                 on_token: Optional[Callable[[str], None]] = None,
+                 prepare_call: Callable[[dict], tuple] = _default_prepare,
+                 on_results: Optional[Callable[[list, list], None]] = None,
+                 on_round: Optional[Callable[[dict, AIMessage], None]] = None) -> dict:
+        """
+        Append the user's message and everything the agent does to messages.
+        With a context, the model sees context.build(messages) (a bounded
+        window) instead of the whole history.
+        Returns {'content': final reply, 'rounds': [per-round timing],
+        'stopped': None or the budget that ended the turn early}.
+        """
+        fast_turn = self._route(messages, user_input)
+        messages.append(HumanMessage(content=user_input))
+        started = time.perf_counter()
+        if fast_turn is not None:
+            return self._run_fast_turn(fast_turn, messages, started, on_token, prepare_call, on_results, on_round)
+        rounds = []
+        stopped = None
+
+        while True:
+            round_started = time.perf_counter()
+            tool_batch = new_tool_batch(self.tools)
+            submitted = []
+
+            def submit(tool_call: dict) -> None:
+                if tool_call.get('error'):
+                    # Unparseable arguments (see streaming): answer the call with the error, run nothing
+                    tool_batch.add_result(ToolMessage(content=tool_call['error'], tool_call_id=tool_call['id']))
+                    submitted.append((tool_call['name'], {}))
+                    return
+                tool_name, tool_args, call_id, blocked = prepare_call(tool_call)
+                if blocked is not None:
+                    tool_batch.add_result(blocked)
+                else:
+                    tool_batch.submit(tool_name, tool_args, call_id)
+                submitted.append((tool_name, tool_args))
+
+            prompt = context.build(messages) if context is not None else messages
+            if self.streaming:
+                # Tools start as soon as each call's arguments have streamed in
+                response = stream_response(self.model, prompt, on_token=on_token, on_tool_call=submit)
+            else:
+                response = self.model.invoke(prompt)
+                for tool_call in response.tool_calls:
+                    submit(tool_call)
+            model_done = time.perf_counter()
+            messages.append(response)
+
+            tool_messages = tool_batch.results() if submitted else []
+            stopped = self._end_round(messages, response, submitted, tool_messages, rounds, started,
+                                      round_started, model_done, context, on_results, on_round)
+            if not submitted or stopped:
+                break
+
+        return {'content': messages[-1].content, 'rounds': rounds, 'stopped': stopped}
+
+    async def arun_turn(self, messages: list, user_input: str, context: Optional[ConversationContext] = None,
+                        on_token: Optional[Callable[[str], None]] = None,
+                        prepare_call: Callable[[dict], tuple] = _default_prepare,
+                        on_results: Optional[Callable[[list, list], None]] = None,
+                        on_round: Optional[Callable[[dict, AIMessage], None]] = None) -> dict:
+        """
+        run_turn() on the event loop: model calls go through the async
+        OpenAI client and tool calls are tasks, so one process interleaves
+        many sessions' turns. Hooks are plain callables run on the loop.
+        """
+        fast_turn = self._route(messages, user_input)
+        messages.append(HumanMessage(content=user_input))
+        started = time.perf_counter()
+        if fast_turn is not None:
+            return await self._arun_fast_turn(fast_turn, messages, started, on_token, prepare_call, on_results, on_round)
+        rounds = []
+        stopped = None
+
+        while True:
+            round_started = time.perf_counter()
+            tool_batch = new_async_tool_batch(self.tools)
+            submitted = []
+
+            def submit(tool_call: dict) -> None:
+                if tool_call.get('error'):
+                    # Unparseable arguments (see streaming): answer the call with the error, run nothing
+                    tool_batch.add_result(ToolMessage(content=tool_call['error'], tool_call_id=tool_call['id']))
+                    submitted.append((tool_call['name'], {}))
+                    return
+                tool_name, tool_args, call_id, blocked = prepare_call(tool_call)
+                if blocked is not None:
+                    tool_batch.add_result(blocked)
+                else:
+                    tool_batch.submit(tool_name, tool_args, call_id)
+                submitted.append((tool_name, tool_args))
+
+            prompt = context.build(messages) if context is not None else messages
+            if self.streaming:
+                response = await astream_response(self.model, prompt, on_token=on_token, on_tool_call=submit)
+            else:
+                response = await self.model.ainvoke(prompt)
+                for tool_call in response.tool_calls:
+                    submit(tool_call)
+            model_done = time.perf_counter()
+            messages.append(response)
+
+            tool_messages = await tool_batch.results() if submitted else []
+            stopped = self._end_round(messages, response, submitted, tool_messages, rounds, started,
+                                      round_started, model_done, context, on_results, on_round)
+            if not submitted or stopped:
+                break
+
+        return {'content': messages[-1].content, 'rounds': rounds, 'stopped': stopped}
@@ -0,0 +1,350 @@
+import itertools
+import os
+import sqlite3
+import sys
+import threading
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Iterable, Optional
+
+import pandas as pd
+
+from app.agent.file_store import FileVersionConflict, atomic_write, file_lock, file_version
+from app.config import SCHEDULE_BACKEND, SCHEDULE_DB_PATH, SCHEDULE_XLSX_PATH
+
+# Optimistic attempts at a workbook update before the read is done under the file lock
+_OPTIMISTIC_ATTEMPTS = 3
+
+SLOT_FIELDS = ['slot_id', 'doctor', 'location', 'date', 'start_time', 'end_time', 'is_booked']
+
+
+class _BookingConflict(Exception):
+    pass
+
+
+def _normalize_time(value) -> str:
+    """Return HH:MM for strings like "09:00", "09:00:00" or datetime.time values."""
+    text = str(value).strip()
+    parts = text.split(':')
+    if len(parts) >= 2 and parts[0].isdigit() and parts[1][:2].isdigit():
+        return f"{int(parts[0]):02d}:{parts[1][:2]}"
+    return text
+
+
+def _write_excel(df: pd.DataFrame, f) -> None:
+    with pd.ExcelWriter(f, engine='openpyxl') as writer:
+        df.to_excel(writer, index=False)
+
+
+def _read_schedule_excel(xlsx_path: str) -> pd.DataFrame:
+    df = pd.read_excel(xlsx_path)
+    df['date'] = df['date'].astype(str).str.split(' ').str[0]
+    df['start_time'] = df['start_time'].map(_normalize_time)
+    df['end_time'] = df['end_time'].map(_normalize_time)
+    df['is_booked'] = df['is_booked'].fillna(False).astype(bool)
+    return df
+
+
+class ScheduleStore:
+    """
+    Interface for schedule backends. Slots are dicts with the keys in
+    SLOT_FIELDS; slot_id is a stable integer (the row index of the slot in
+    schedules.xlsx) that the tools embed in Calendly-style slot IDs.
+    """
+
+    def free_slots(self, doctor: str, date: str, after_time: str = "", limit: Optional[int] = None) -> list:
+        """
+        Unbooked slots for a doctor (case-insensitive) on a YYYY-MM-DD date, ordered by
+        start time; optionally only those starting at or after after_time (HH:MM) and
+        at most limit of them.
+        """
+        raise NotImplementedError
+
+    def free_slots_between(self, start_date: str, end_date: str, doctors: Optional[Iterable[str]] = None,
+                           location: str = "") -> list:
+        """
+        Unbooked slots with start_date <= date <= end_date, optionally limited to
+        some doctors and/or a location (both case-insensitive), ordered by
+        (date, doctor, start time).
+        """
+        raise NotImplementedError
+
+    def get_slots(self, slot_ids: Iterable[int]) -> list:
+        """Slots for the given IDs in the requested order; unknown IDs are skipped."""
+        raise NotImplementedError
+
+    def book_slots(self, slot_ids: Iterable[int]) -> bool:
+        """Atomically mark all slots booked. Returns False (and books nothing) if any is taken or missing."""
+        raise NotImplementedError
+
+    def release_slots(self, slot_ids: Iterable[int]) -> int:
+        """Mark slots free again. Returns the number of slots released."""
+        raise NotImplementedError
+
+
+class ExcelScheduleStore(ScheduleStore):
+    """
+    Legacy backend that reads and rewrites schedules.xlsx on every call.
+    Writes replace the workbook atomically (see app.agent.file_store), so
+    several processes can book against the same file.
+    """
+
+    def __init__(self, xlsx_path: str = SCHEDULE_XLSX_PATH):
+        self.xlsx_path = xlsx_path
+
+    @staticmethod
+    def _to_slot(idx, row) -> dict:
+        return {
+            'slot_id': int(idx),
+            'doctor': row['doctor'],
+            'location': row['location'],
+            'date': row['date'],
+            'start_time': row['start_time'],
+            'end_time': row['end_time'],
+            'is_booked': bool(row['is_booked']),
+        }
+
+    def free_slots(self, doctor: str, date: str, after_time: str = "", limit: Optional[int] = None) -> list:
+        df = _read_schedule_excel(self.xlsx_path)
+        mask = (df['doctor'].str.lower() == doctor.lower()) & (df['date'] == date) & (~df['is_booked'])
+        if after_time:
+            mask &= df['start_time'] >= _normalize_time(after_time)
+        day = df[mask].sort_values('start_time')
+        if limit is not None:
+            day = day.head(limit)
+        return [self._to_slot(idx, row) for idx, row in day.iterrows()]
+
+    def free_slots_between(self, start_date: str, end_date: str, doctors: Optional[Iterable[str]] = None,
+                           location: str = "") -> list:
+        df = _read_schedule_excel(self.xlsx_path)
+        mask = (df['date'] >= start_date) & (df['date'] <= end_date) & (~df['is_booked'])
+        if doctors:
+            mask &= df['doctor'].str.lower().isin([d.strip().lower() for d in doctors])
+        if location:
+            mask &= df['location'].str.lower() == location.strip().lower()
+        rows = df[mask].sort_values(['date', 'doctor', 'start_time'])
+        return [self._to_slot(idx, row) for idx, row in rows.iterrows()]
+
+    def get_slots(self, slot_ids: Iterable[int]) -> list:
+        df = _read_schedule_excel(self.xlsx_path)
+        return [self._to_slot(i, df.loc[i]) for i in slot_ids if i in df.index]
+
+    def _update(self, change: Callable[[pd.DataFrame], tuple]):
+        """
+        Read-modify-write of the workbook. change(df) edits df in place and
+        returns (result, changed). The workbook is parsed without holding the
+        file lock and replaced only if no other writer got there first
+        (optimistic version check); after a few conflicts the read happens
+        under the lock too, so a writer waits its turn instead of starving.
+        """
+        for attempt in itertools.count():
+            with file_lock(self.xlsx_path) if attempt >= _OPTIMISTIC_ATTEMPTS else nullcontext():
+                version = file_version(self.xlsx_path)
+                df = pd.read_excel(self.xlsx_path)
+                result, changed = change(df)
+                if not changed:
+                    return result
+                try:
+                    atomic_write(self.xlsx_path, lambda f: _write_excel(df, f), mode='wb', expected_version=version)
+                except FileVersionConflict:
+                    continue
+                return result
+
+    def book_slots(self, slot_ids: Iterable[int]) -> bool:
+        ids = list(slot_ids)
+
+        def book(df: pd.DataFrame) -> tuple:
+            if not ids or any(i not in df.index or bool(df.loc[i, 'is_booked']) for i in ids):
+                return False, False
+            df.loc[ids, 'is_booked'] = True
+            return True, True
+
+        return self._update(book)
+
+    def release_slots(self, slot_ids: Iterable[int]) -> int:
+        requested = list(slot_ids)
+
+        def release(df: pd.DataFrame) -> tuple:
+            ids = [i for i in requested if i in df.index and bool(df.loc[i, 'is_booked'])]
+            if ids:
+                df.loc[ids, 'is_booked'] = False
+            return len(ids), bool(ids)
+
+        return self._update(release)
+
+
+class SQLiteScheduleStore(ScheduleStore):
+    """
+    Default backend. Slots live in a WAL-mode SQLite database indexed on
+    (doctor, date, is_booked, start_time), so a page of a doctor's day
+    (start_time >= ? ORDER BY start_time LIMIT ?) is a range scan that stops
+    after the page instead of sorting the whole day; bookings are a single compare-and-set UPDATE
+    inside an IMMEDIATE transaction, so concurrent sessions cannot both win
+    the same slot.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS slots (
+            id INTEGER PRIMARY KEY,
+            doctor TEXT NOT NULL COLLATE NOCASE,
+            location TEXT NOT NULL DEFAULT '',
+            date TEXT NOT NULL,
+            start_time TEXT NOT NULL,
+            end_time TEXT NOT NULL,
+            is_booked INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_slots_doctor_date_booked_start
+            ON slots (doctor, date, is_booked, start_time);
+        DROP INDEX IF EXISTS idx_slots_doctor_date_booked;
+        CREATE INDEX IF NOT EXISTS idx_slots_date_booked
+            ON slots (date, is_booked);
+    """
+
+    def __init__(self, db_path: str = SCHEDULE_DB_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._connection().executescript(self.SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+    @staticmethod
+    def _to_slot(row) -> dict:
+        return {
+            'slot_id': row['id'],
+            'doctor': row['doctor'],
+            'location': row['location'],
+            'date': row['date'],
+            'start_time': row['start_time'],
+            'end_time': row['end_time'],
+            'is_booked': bool(row['is_booked']),
+        }
+
+    def count(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM slots").fetchone()[0]
+
+    def free_slots(self, doctor: str, date: str, after_time: str = "", limit: Optional[int] = None) -> list:
+        rows = self._connection().execute(
+            "SELECT * FROM slots WHERE doctor = ? AND date = ? AND is_booked = 0 AND start_time >= ? "
+            "ORDER BY start_time LIMIT ?",
+            (doctor.strip(), date, _normalize_time(after_time) if after_time else "", -1 if limit is None else int(limit)),
+        ).fetchall()
+        return [self._to_slot(r) for r in rows]
+
+    def free_slots_between(self, start_date: str, end_date: str, doctors: Optional[Iterable[str]] = None,
+                           location: str = "") -> list:
+        sql = "SELECT * FROM slots WHERE date BETWEEN ? AND ? AND is_booked = 0"
+        params = [start_date, end_date]
+        doctors = [d.strip() for d in (doctors or []) if d and d.strip()]
+        if doctors:
+            sql += f" AND doctor IN ({','.join('?' * len(doctors))})"
+            params.extend(doctors)
+        if location:
+            sql += " AND location = ? COLLATE NOCASE"
+            params.append(location.strip())
+        sql += " ORDER BY date, doctor, start_time"
+        return [self._to_slot(r) for r in self._connection().execute(sql, params).fetchall()]
+
+    def get_slots(self, slot_ids: Iterable[int]) -> list:
+        ids = [int(i) for i in slot_ids]
+        if not ids:
+            return []
+        marks = ','.join('?' * len(ids))
+        rows = self._connection().execute(f"SELECT * FROM slots WHERE id IN ({marks})", ids).fetchall()
+        by_id = {r['id']: self._to_slot(r) for r in rows}
+        return [by_id[i] for i in ids if i in by_id]
+
+    def book_slots(self, slot_ids: Iterable[int]) -> bool:
+        ids = sorted({int(i) for i in slot_ids})
+        if not ids:
+            return False
+        marks = ','.join('?' * len(ids))
+        try:
+            with self._transaction() as conn:
+                cur = conn.execute(f"UPDATE slots SET is_booked = 1 WHERE id IN ({marks}) AND is_booked = 0", ids)
+                if cur.rowcount != len(ids):
+                    # Someone else holds at least one slot: roll back the partial claim
+                    raise _BookingConflict()
+        except _BookingConflict:
+            return False
+        return True
+
+    def release_slots(self, slot_ids: Iterable[int]) -> int:
+        ids = sorted({int(i) for i in slot_ids})
+        if not ids:
+            return 0
+        marks = ','.join('?' * len(ids))
+        with self._transaction() as conn:
+            return conn.execute(f"UPDATE slots SET is_booked = 0 WHERE id IN ({marks}) AND is_booked = 1", ids).rowcount
+
+    def import_dataframe(self, df: pd.DataFrame, replace: bool = False) -> int:
+        """Load slots from a schedules.xlsx-shaped frame, keeping the row index as slot ID."""
+        rows = [
+            (int(idx), str(r['doctor']), str(r['location']), str(r['date']),
+             str(r['start_time']), str(r['end_time']), int(bool(r['is_booked'])))
+            for idx, r in df.iterrows()
+        ]
+        with self._transaction() as conn:
+            if replace:
+                conn.execute("DELETE FROM slots")
+            elif conn.execute("SELECT COUNT(*) FROM slots").fetchone()[0]:
+                return 0
+            conn.executemany(
+                "INSERT OR REPLACE INTO slots (id, doctor, location, date, start_time, end_time, is_booked) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        return len(rows)
+
+
+def import_schedule_from_excel(xlsx_path: str = SCHEDULE_XLSX_PATH, db_path: str = SCHEDULE_DB_PATH, replace: bool = False) -> int:
+    """
+    One-time import of schedules.xlsx into the SQLite slot store. Does nothing
+    if the database already has slots unless replace=True. Returns rows imported.
+    """
+    store = SQLiteScheduleStore(db_path)
+    return store.import_dataframe(_read_schedule_excel(xlsx_path), replace=replace)
+
+
+_store: Optional[ScheduleStore] = None
+_store_lock = threading.Lock()
+
+
+def get_schedule_store() -> ScheduleStore:
+    """Process-wide store for the configured SCHEDULE_BACKEND."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            if SCHEDULE_BACKEND == 'excel':
+                _store = ExcelScheduleStore(SCHEDULE_XLSX_PATH)
+            else:
+                store = SQLiteScheduleStore(SCHEDULE_DB_PATH)
+                if store.count() == 0 and os.path.exists(SCHEDULE_XLSX_PATH):
+                    imported = store.import_dataframe(_read_schedule_excel(SCHEDULE_XLSX_PATH))
+                    print(f"[SCHEDULE] Imported {imported} slots from {SCHEDULE_XLSX_PATH} into {SCHEDULE_DB_PATH}")
+                _store = store
+        return _store
+
+
+if __name__ == "__main__":
+    # python -m app.agent.schedule_store [--replace]
+    count = import_schedule_from_excel(replace='--replace' in sys.argv[1:])
+    print(f"Imported {count} slots into {SCHEDULE_DB_PATH}")
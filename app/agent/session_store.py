@@ -0,0 +1,386 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Optional
+
+from langchain_core.messages import messages_from_dict
+
+from app.config import (
+    SESSION_BACKEND, SESSION_DB_PATH, SESSION_MAX_SESSIONS, SESSION_REDIS_URL, SESSION_TTL_SECONDS,
+)
+
+# Per-message fields that are never needed to resume a conversation
+_DROPPED_FIELDS = {'response_metadata', 'usage_metadata', 'id'}
+
+# Seconds between TTL sweeps triggered by saves
+_PURGE_INTERVAL_SECONDS = 60.0
+
+
+def dump_messages(messages: list) -> str:
+    """
+    Compact JSON for a message list: fields left at their defaults are
+    omitted, as are response metadata, usage and message IDs, and the
+    OpenAI-format copy of tool calls (rebuilt from tool_calls on send).
+    """
+    rows = []
+    for message in messages:
+        data = message.model_dump(exclude_defaults=True, exclude=_DROPPED_FIELDS)
+        extra = data.get('additional_kwargs')
+        if extra and 'tool_calls' in extra and data.get('tool_calls'):
+            extra = {k: v for k, v in extra.items() if k != 'tool_calls'}
+            if extra:
+                data['additional_kwargs'] = extra
+            else:
+                data.pop('additional_kwargs')
+        data.pop('type', None)
+        rows.append([message.type, data])
+    return json.dumps(rows, ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+def load_messages(payload: str) -> list:
+    return messages_from_dict([{'type': kind, 'data': data} for kind, data in json.loads(payload)])
+
+
+def _dump_state(state: Optional[dict]) -> str:
+    return json.dumps(state or {}, ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+class SessionConflict(Exception):
+    """The session was saved by someone else since it was loaded."""
+
+
+class SessionStore:
+    """
+    Interface for session backends. A session is its message list plus a
+    small JSON dict of front-end state (patient details, booking summary...)
+    and a version. Saves are optimistic: save() takes the version load()
+    returned (0 for a new session) and raises SessionConflict if another
+    writer got there first, so two workers can never interleave one
+    session's turns. Sessions idle longer than the TTL expire.
+    """
+
+    def load(self, session_id: str) -> Optional[dict]:
+        """{'messages', 'state', 'version'} of a session, or None if it does not exist (or expired)."""
+        raise NotImplementedError
+
+    def save(self, session_id: str, messages: list, state: Optional[dict] = None, version: int = 0) -> int:
+        """Write a session loaded at `version`. Returns the new version."""
+        raise NotImplementedError
+
+    def delete(self, session_id: str) -> bool:
+        raise NotImplementedError
+
+    def purge(self) -> int:
+        """Drop expired sessions. Returns how many were removed."""
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    """
+    Sessions in this process only, least recently used first out once there
+    are more than max_sessions. Sessions are held serialized, so a caller
+    mutating its message list never changes the stored copy.
+    """
+
+    def __init__(self, max_sessions: int = SESSION_MAX_SESSIONS, ttl_seconds: float = SESSION_TTL_SECONDS):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._sessions: OrderedDict = OrderedDict()  # session_id -> (version, messages, state, updated_at)
+        self._lock = threading.Lock()
+
+    def load(self, session_id: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            if time.time() - entry[3] > self.ttl_seconds:
+                del self._sessions[session_id]
+                return None
+            self._sessions.move_to_end(session_id)
+        return {'messages': load_messages(entry[1]), 'state': json.loads(entry[2]), 'version': entry[0]}
+
+    def save(self, session_id: str, messages: list, state: Optional[dict] = None, version: int = 0) -> int:
+        payload, state_json = dump_messages(messages), _dump_state(state)
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None and time.time() - entry[3] > self.ttl_seconds:
+                entry = None
+            if (entry[0] if entry is not None else 0) != version:
+                raise SessionConflict(f"Session {session_id} was changed by another request")
+            self._sessions[session_id] = (version + 1, payload, state_json, time.time())
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return version + 1
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def purge(self) -> int:
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            expired = [sid for sid, entry in self._sessions.items() if entry[3] < cutoff]
+            for session_id in expired:
+                del self._sessions[session_id]
+        return len(expired)
+
+
+class SQLiteSessionStore(SessionStore):
+    """Sessions in a SQLite file shared by every worker process on the host."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_id TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            messages TEXT NOT NULL,
+            state TEXT NOT NULL DEFAULT '{}',
+            updated_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions (updated_at);
+    """
+
+    def __init__(self, db_path: str = SESSION_DB_PATH, ttl_seconds: float = SESSION_TTL_SECONDS):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+        self._last_purge = 0.0
+        self._connection().executescript(self.SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+    def load(self, session_id: str) -> Optional[dict]:
+        row = self._connection().execute(
+            "SELECT version, messages, state FROM sessions WHERE session_id = ? AND updated_at >= ?",
+            (session_id, time.time() - self.ttl_seconds),
+        ).fetchone()
+        if row is None:
+            return None
+        return {'messages': load_messages(row[1]), 'state': json.loads(row[2]), 'version': row[0]}
+
+    def save(self, session_id: str, messages: list, state: Optional[dict] = None, version: int = 0) -> int:
+        payload, state_json = dump_messages(messages), _dump_state(state)
+        with self._transaction() as conn:
+            if version:
+                updated = conn.execute(
+                    "UPDATE sessions SET version = version + 1, messages = ?, state = ?, updated_at = ? "
+                    "WHERE session_id = ? AND version = ?",
+                    (payload, state_json, time.time(), session_id, version),
+                ).rowcount
+            else:
+                # A new session may reuse the ID of one that has expired
+                conn.execute("DELETE FROM sessions WHERE session_id = ? AND updated_at < ?",
+                             (session_id, time.time() - self.ttl_seconds))
+                updated = conn.execute(
+                    "INSERT OR IGNORE INTO sessions (session_id, version, messages, state, updated_at) "
+                    "VALUES (?, 1, ?, ?, ?)",
+                    (session_id, payload, state_json, time.time()),
+                ).rowcount
+            if not updated:
+                raise SessionConflict(f"Session {session_id} was changed by another request")
+        if time.monotonic() - self._last_purge > _PURGE_INTERVAL_SECONDS:
+            self.purge()
+        return version + 1
+
+    def delete(self, session_id: str) -> bool:
+        with self._transaction() as conn:
+            return conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,)).rowcount > 0
+
+    def purge(self) -> int:
+        self._last_purge = time.monotonic()
+        with self._transaction() as conn:
+            return conn.execute(
+                "DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl_seconds,)
+            ).rowcount
+
+
+class WatchError(Exception):
+    """A watched key changed before the transaction ran (redis.exceptions.WatchError for LocalRedis)."""
+
+
+class LocalRedis:
+    """
+    In-process stand-in for the part of the redis-py client RedisSessionStore
+    uses: get/set with expiry, delete, and WATCH/MULTI/EXEC pipelines.
+    For development and tests without a Redis server.
+    """
+
+    def __init__(self):
+        self._data: dict = {}  # key -> (value, expires_at or None, revision)
+        self._lock = threading.Lock()
+        self._revision = 0
+
+    def _live(self, key: str):
+        entry = self._data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.time():
+            del self._data[key]
+            return None
+        return entry
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._live(key)
+            return entry[0] if entry is not None else None
+
+    def _set(self, key: str, value, ex: Optional[float]) -> None:
+        self._revision += 1
+        data = value.encode('utf-8') if isinstance(value, str) else value
+        self._data[key] = (data, time.time() + ex if ex else None, self._revision)
+
+    def set(self, key: str, value, ex: Optional[float] = None) -> bool:
+        with self._lock:
+            self._set(key, value, ex)
+            return True
+
+    def delete(self, *keys: str) -> int:
+        with self._lock:
+            return sum(self._data.pop(key, None) is not None for key in keys)
+
+    def pipeline(self) -> 'LocalRedisPipeline':
+        return LocalRedisPipeline(self)
+
+
+class LocalRedisPipeline:
+    def __init__(self, client: LocalRedis):
+        self._client = client
+        self._watched: dict = {}
+        self._queued: list = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.reset()
+
+    def watch(self, *keys: str) -> None:
+        with self._client._lock:
+            for key in keys:
+                entry = self._client._live(key)
+                self._watched[key] = entry[2] if entry is not None else None
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._client.get(key)
+
+    def multi(self) -> None:
+        self._queued = []
+
+    def set(self, key: str, value, ex: Optional[float] = None) -> None:
+        self._queued.append((key, value, ex))
+
+    def execute(self) -> list:
+        with self._client._lock:
+            for key, revision in self._watched.items():
+                entry = self._client._live(key)
+                if (entry[2] if entry is not None else None) != revision:
+                    raise WatchError(f"Watched key {key} changed")
+            for key, value, ex in self._queued:
+                self._client._set(key, value, ex)
+        return [True] * len(self._queued)
+
+    def reset(self) -> None:
+        self._watched, self._queued = {}, []
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Sessions in Redis (or anything speaking its protocol), for replicas on
+    different hosts. Each session is one key holding version, messages and
+    state; Redis expires idle sessions itself, and saves use WATCH/MULTI
+    so a concurrent writer makes the transaction fail instead of
+    overwriting. Pass LocalRedis() as the client to run without a server.
+    """
+
+    KEY_PREFIX = 'scheduler:session:'
+
+    def __init__(self, client, ttl_seconds: float = SESSION_TTL_SECONDS):
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+        try:
+            from redis.exceptions import WatchError as RedisWatchError
+            self._watch_errors = (WatchError, RedisWatchError)
+        except ImportError:
+            self._watch_errors = (WatchError,)
+
+    def _key(self, session_id: str) -> str:
+        return self.KEY_PREFIX + session_id
+
+    @staticmethod
+    def _decode(raw) -> dict:
+        return json.loads(raw.decode('utf-8') if isinstance(raw, bytes) else raw)
+
+    def load(self, session_id: str) -> Optional[dict]:
+        raw = self.client.get(self._key(session_id))
+        if raw is None:
+            return None
+        record = self._decode(raw)
+        return {'messages': load_messages(record['m']), 'state': json.loads(record['s']), 'version': record['v']}
+
+    def save(self, session_id: str, messages: list, state: Optional[dict] = None, version: int = 0) -> int:
+        key = self._key(session_id)
+        value = json.dumps({'v': version + 1, 'm': dump_messages(messages), 's': _dump_state(state)},
+                           separators=(',', ':'))
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                raw = pipe.get(key)
+                if (self._decode(raw)['v'] if raw is not None else 0) != version:
+                    raise SessionConflict(f"Session {session_id} was changed by another request")
+                pipe.multi()
+                pipe.set(key, value, ex=int(self.ttl_seconds))
+                pipe.execute()
+            except self._watch_errors:
+                raise SessionConflict(f"Session {session_id} was changed by another request")
+        return version + 1
+
+    def delete(self, session_id: str) -> bool:
+        return self.client.delete(self._key(session_id)) > 0
+
+    def purge(self) -> int:
+        # Keys expire on their own
+        return 0
+
+
+_store: Optional[SessionStore] = None
+_lock = threading.Lock()
+
+
+def create_session_store(backend: str = SESSION_BACKEND) -> SessionStore:
+    if backend == 'memory':
+        return MemorySessionStore()
+    if backend == 'redis':
+        if SESSION_REDIS_URL:
+            import redis
+            return RedisSessionStore(redis.Redis.from_url(SESSION_REDIS_URL))
+        return RedisSessionStore(LocalRedis())
+    return SQLiteSessionStore()
+
+
+def get_session_store() -> SessionStore:
+    """Process-wide store for the configured SESSION_BACKEND."""
+    global _store
+    with _lock:
+        if _store is None:
+            _store = create_session_store()
+        return _store
@@ -0,0 +1,130 @@
+from typing import Callable, Optional
+
+import numpy as np
+
+# Slots whose end and next start differ by at most this much count as adjacent
+MAX_GAP_MINUTES = 1
+
+
+def time_to_minutes(values) -> np.ndarray:
+    """Vectorized "HH:MM[:SS]" -> minutes since midnight."""
+    arr = np.asarray([str(v) for v in values])
+    if arr.size == 0:
+        return np.zeros(0, dtype=np.int64)
+    parts = np.char.partition(arr, ':')
+    hours = parts[:, 0].astype(np.int64)
+    minutes = np.char.partition(parts[:, 2], ':')[:, 0].astype(np.int64)
+    return hours * 60 + minutes
+
+
+def find_contiguous_runs(starts: np.ndarray, ends: np.ndarray, duration_minutes: int,
+                         max_gap_minutes: int = MAX_GAP_MINUTES):
+    """
+    Find every window of back-to-back free slots covering duration_minutes.
+
+    starts/ends are minute offsets of free slots sorted by start. Returns two
+    arrays (first, last) of equal length: slots first[k]..last[k] inclusive
+    form one block. Works for any slot granularity; a 45-minute visit on a
+    30-minute grid takes two slots, a 120-minute visit four.
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    m = starts.size
+    if m == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty
+
+    # breaks_before[k] = number of non-adjacent neighbour pairs among slots 0..k
+    gaps = starts[1:] - ends[:-1]
+    breaks = (gaps < 0) | (gaps > max_gap_minutes)
+    breaks_before = np.concatenate(([0], np.cumsum(breaks)))
+
+    # Last slot needed for each start: first slot ending at or after the target end
+    last = np.searchsorted(ends, starts + int(duration_minutes), side='left')
+    first = np.arange(m)
+    in_range = last < m
+    first, last = first[in_range], last[in_range]
+    contiguous = breaks_before[last] == breaks_before[first]
+    return first[contiguous], last[contiguous]
+
+
+def find_runs_in_slots(slots: list, duration_minutes: int, max_gap_minutes: int = MAX_GAP_MINUTES):
+    """
+    Run search over slots from several doctors and days in one pass. slots must
+    be ordered by (date, doctor, start time). Each (date, doctor) group is
+    shifted onto its own stretch of a single timeline so runs never cross
+    groups. Returns (first, last, starts, ends) with starts/ends in minutes
+    since midnight of each slot's own day.
+    """
+    starts = time_to_minutes([s['start_time'] for s in slots])
+    ends = time_to_minutes([s['end_time'] for s in slots])
+    if not slots:
+        return starts, ends, starts, ends
+    keys = [(s['date'], str(s['doctor']).lower()) for s in slots]
+    changed = np.fromiter((keys[k] != keys[k - 1] for k in range(1, len(keys))), dtype=bool, count=len(keys) - 1)
+    offset = np.concatenate(([0], np.cumsum(changed))) * 2 * 24 * 60
+    first, last = find_contiguous_runs(starts + offset, ends + offset, duration_minutes, max_gap_minutes)
+    return first, last, starts, ends
+
+
+def find_runs_page(fetch_slots: Callable[[int], list], duration_minutes: int, limit: int,
+                   max_gap_minutes: int = MAX_GAP_MINUTES):
+    """
+    The first limit + 1 blocks of an ordered slot source, reading as few slots as possible.
+
+    fetch_slots(n) returns up to n free slots ordered by start time (e.g. a
+    LIMIT query on the schedule index). Blocks found in a prefix of the slots
+    are always the earliest blocks overall, so the window only grows (doubling)
+    while it is full and still holds no more than limit blocks. Returns
+    (slots, first, last) as find_contiguous_runs; a block past limit means
+    there is another page.
+    """
+    want = max(int(limit), 0) + 1
+    fetch = want * 2 + 8
+    while True:
+        slots = fetch_slots(fetch)
+        starts = time_to_minutes([s['start_time'] for s in slots])
+        ends = time_to_minutes([s['end_time'] for s in slots])
+        first, last = find_contiguous_runs(starts, ends, duration_minutes, max_gap_minutes)
+        if len(first) >= want or len(slots) < fetch:
+            return slots, first[:want], last[:want]
+        fetch *= 2
+
+
+def make_slot_id(slot_ids) -> str:
+    """Calendly-style ID encoding the whole run of schedule slot IDs."""
+    ids = [int(i) for i in slot_ids]
+    if len(ids) == 1:
+        return f"calendly_{ids[0]}"
+    return "calendly_run_" + "_".join(str(i) for i in ids)
+
+
+def parse_slot_id(slot_id: str) -> Optional[list]:
+    """
+    Inverse of make_slot_id. Also accepts the older "calendly_pair_i_j" form.
+    Returns None for malformed IDs.
+    """
+    text = str(slot_id).strip()
+    for prefix in ("calendly_run_", "calendly_pair_"):
+        if text.startswith(prefix):
+            body = text[len(prefix):]
+            break
+    else:
+        body = text.split('_')[-1] if '_' in text else ""
+    try:
+        ids = [int(part) for part in body.split('_')]
+    except ValueError:
+        return None
+    return ids or None
+
+
+def is_contiguous_block(slots: list, max_gap_minutes: int = MAX_GAP_MINUTES) -> bool:
+    """True if the slots are one doctor on one date, back to back in the given order."""
+    if not slots:
+        return False
+    if len({(str(s['doctor']).lower(), s['date']) for s in slots}) != 1:
+        return False
+    starts = time_to_minutes([s['start_time'] for s in slots])
+    ends = time_to_minutes([s['end_time'] for s in slots])
+    gaps = starts[1:] - ends[:-1]
+    return bool(np.all((gaps >= 0) & (gaps <= max_gap_minutes)))
@@ -0,0 +1,99 @@
+import json
+import time
+from typing import Callable, Optional
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+
+def _complete_call(chunk: dict) -> dict:
+    """
+    Tool call from a fully streamed tool-call chunk (arguments arrive as JSON
+    text). If they are not a JSON object the call carries an 'error' instead
+    of being run with made-up arguments.
+    """
+    call = {'name': chunk.get('name') or '', 'args': {}, 'id': chunk.get('id') or ''}
+    try:
+        args = json.loads(chunk.get('args') or '{}')
+    except ValueError:
+        args = None
+    if isinstance(args, dict):
+        call['args'] = args
+    else:
+        call['error'] = f"Error: the arguments for {call['name'] or 'this tool'} were not valid JSON; call it again."
+    return call
+
+
+class _StreamAssembler:
+    """Chunk-by-chunk state shared by stream_response() and astream_response()."""
+
+    def __init__(self, on_token: Optional[Callable[[str], None]], on_tool_call: Optional[Callable[[dict], None]]):
+        self.on_token = on_token
+        self.on_tool_call = on_tool_call
+        self.started = time.perf_counter()
+        self.full: Optional[AIMessageChunk] = None
+        self.completed = set()
+        self.first_token_logged = False
+
+    def _flush_calls(self, before_index: Optional[int]) -> None:
+        for call_chunk in self.full.tool_call_chunks:
+            index = call_chunk.get('index')
+            if index in self.completed or (before_index is not None and (index is None or index >= before_index)):
+                continue
+            self.completed.add(index)
+            if self.on_tool_call is not None:
+                self.on_tool_call(_complete_call(call_chunk))
+
+    def add(self, chunk: AIMessageChunk) -> None:
+        self.full = chunk if self.full is None else self.full + chunk
+        if chunk.content:
+            if not self.first_token_logged:
+                print(f"[STREAM] First token after {(time.perf_counter() - self.started) * 1000:.0f} ms")
+                self.first_token_logged = True
+            if self.on_token is not None:
+                self.on_token(chunk.content)
+        indexes = [c.get('index') for c in chunk.tool_call_chunks if c.get('index') is not None]
+        if indexes:
+            self._flush_calls(min(indexes))
+
+    def finish(self) -> AIMessage:
+        full = self.full
+        if full is None:
+            return AIMessage(content='')
+        self._flush_calls(None)
+        return AIMessage(
+            content=full.content,
+            additional_kwargs=full.additional_kwargs,
+            response_metadata=full.response_metadata,
+            tool_calls=full.tool_calls,
+            # Kept so the error results of unparseable calls still answer a call ID the provider knows
+            invalid_tool_calls=full.invalid_tool_calls,
+            id=full.id,
+            usage_metadata=full.usage_metadata,
+        )
+
+
+def stream_response(model, messages: list, on_token: Optional[Callable[[str], None]] = None,
+                    on_tool_call: Optional[Callable[[dict], None]] = None) -> AIMessage:
+    """
+    Stream one model turn instead of blocking on invoke().
+
+    on_token gets each text delta as it arrives. Tool-call deltas are
+    assembled on the fly; the model streams calls one after another, so a
+    call is complete as soon as a delta for a later call (or the end of the
+    stream) shows up, and on_tool_call gets it right then, while the rest
+    of the response is still arriving. Returns the assembled AIMessage,
+    equivalent to what invoke() would have returned.
+    """
+    assembler = _StreamAssembler(on_token, on_tool_call)
+    for chunk in model.stream(messages):
+        assembler.add(chunk)
+    return assembler.finish()
+
+
+async def astream_response(model, messages: list, on_token: Optional[Callable[[str], None]] = None,
+                           on_tool_call: Optional[Callable[[dict], None]] = None) -> AIMessage:
+    """stream_response() for the asyncio runtime (callbacks run on the event loop)."""
+    assembler = _StreamAssembler(on_token, on_tool_call)
+    async for chunk in model.astream(messages):
+        assembler.add(chunk)
+    return assembler.finish()
@@ -1,7 +1,21 @@
+import numpy as np
 import pandas as pd
 from langchain.tools import tool
+from typing import List, Optional
 from datetime import datetime, timedelta, timezone
-from app.config import PATIENT_CSV_PATH, SCHEDULE_XLSX_PATH, FORMS_DIR, USE_REAL_EMAIL, EXPORTS_DIR
+from app.config import PATIENT_CSV_PATH, FORMS_DIR, USE_REAL_EMAIL, EXPORTS_DIR, AVAILABILITY_MAX_RESULTS
+from app.agent.analytics_store import get_analytics_store
+from app.agent.dates import normalize_date
+from app.agent.form_attachments import get_form_attachment_cache
+from app.agent.mailer import get_mail_queue
+from app.agent.export_journal import EVENT_CANCELLED, EXPORT_COLUMNS, get_appointment_journal
+from app.agent.file_store import atomic_write, file_lock
+from app.agent.patient_registry import get_patient_registry, normalize_patient_frame, read_patients_csv, write_patients_csv
+from app.agent.reminders import get_reminder_store, notify_reminder_worker
+from app.agent.report_rollups import get_rollup_store
+from app.agent.schedule_store import get_schedule_store
+from app.agent.slot_finder import find_runs_in_slots, find_runs_page, is_contiguous_block, make_slot_id, parse_slot_id, time_to_minutes
+import csv
 import os
 
 
@@ -10,45 +24,29 @@ def _normalize_date_string(date_str: str) -> str:
     Accept flexible human date inputs (e.g., "September 10, 2025", "2025/09/10")
     and return canonical YYYY-MM-DD string. Falls back to original if parsing fails.
     """
-    try:
-        # pandas is robust to many formats
-        parsed = pd.to_datetime(str(date_str), errors='raise')
-        return parsed.strftime('%Y-%m-%d')
-    except Exception:
-        # Last resort: try common formats
-        for fmt in ("%Y-%m-%d", "%d-%m-%Y", "%m/%d/%Y", "%B %d, %Y", "%b %d, %Y"):
-            try:
-                parsed = datetime.strptime(str(date_str), fmt)
-                return parsed.strftime('%Y-%m-%d')
-            except Exception:
-                continue
-        return str(date_str)
+    return normalize_date(str(date_str))
 
 @tool
 def lookup_patient(first_name: str, last_name: str, dob: str) -> dict:
     """
     Looks up a patient in the patient database (patients.csv) using their
     first name, last name, and date of birth (YYYY-MM-DD).
-    Returns the patient's details if found, otherwise indicates the patient is new.
+    Returns the patient's details if found. Otherwise returns the name and
+    DOB of close matches (a likely typo in the name or DOB) under
+    'possible_matches', or indicates the patient is new.
     """
     try:
-        df = pd.read_csv(PATIENT_CSV_PATH)
-        # Normalize and strip all relevant fields in both input and CSV
-        def norm(s):
-            return str(s).strip().lower()
-        input_first = norm(first_name)
-        input_last = norm(last_name)
-        input_dob = str(dob).strip()
-        df['first_name_norm'] = df['first_name'].astype(str).str.strip().str.lower()
-        df['last_name_norm'] = df['last_name'].astype(str).str.strip().str.lower()
-        df['dob_norm'] = df['dob'].astype(str).str.strip()
-        patient = df[
-            (df['first_name_norm'] == input_first) &
-            (df['last_name_norm'] == input_last) &
-            (df['dob_norm'] == input_dob)
-        ]
-        if not patient.empty:
-            return patient.drop(columns=['first_name_norm','last_name_norm','dob_norm']).to_dict('records')[0]
+        registry = get_patient_registry()
+        patient = registry.lookup(first_name, last_name, dob)
+        if patient is not None:
+            return patient
+        possible_matches = registry.fuzzy_lookup(first_name, last_name, dob)
+        if possible_matches:
+            return {
+                "message": "No exact match. Ask the patient to confirm one of these records before "
+                           "treating them as new; if they confirm, look up again with its exact name and DOB.",
+                "possible_matches": possible_matches,
+            }
         else:
             return {"message": "Patient not found. This is a new patient."}
     except Exception as e:
@@ -59,152 +57,114 @@ def book_calendly_slot(calendly_link: str, slot_id: str, patient_name: str, pati
     """
     Books an appointment slot through Calendly integration.
     This tool creates a booking in the Calendly calendar and marks the slot as booked.
+    Slot IDs come from get_calendly_availability_with_duration; a run ID
+    ("calendly_run_i_j_...") reserves the whole block of consecutive slots at once.
     Returns a confirmation message with booking details.
     """
     try:
-        # Simulate Calendly booking by updating our Excel schedule
-        df = pd.read_excel(SCHEDULE_XLSX_PATH)
-        df['date'] = df['date'].astype(str).str.split(' ').str[0]
-        df['start_time'] = df['start_time'].astype(str)
-        
-        # Handle merged 60-minute slot IDs: calendly_pair_i_j
-        if slot_id.startswith("calendly_pair_"):
-            try:
-                _, _, i_str, j_str = slot_id.split('_')
-                idx1 = int(i_str)
-                idx2 = int(j_str)
-            except Exception:
-                return "Error: Invalid merged slot ID format."
-
-            if idx1 in df.index and idx2 in df.index:
-                slot1 = df.loc[idx1]
-                slot2 = df.loc[idx2]
-                if (not bool(slot1['is_booked'])) and (not bool(slot2['is_booked'])):
-                    df.loc[idx1, 'is_booked'] = True
-                    df.loc[idx2, 'is_booked'] = True
-                    df.to_excel(SCHEDULE_XLSX_PATH, index=False)
-
-                    email_display = patient_email if patient_email else "your email"
-                    booking_id = f"calendly_booking_{idx1}_{idx2}"
-                    
-                    # Export admin record (60-minute merged)
-                    try:
-                        export_appointment.invoke({
-                            "booking_id": booking_id,
-                            "patient_name": patient_name,
-                            "patient_email": patient_email or "",
-                            "patient_phone": "",
-                            "doctor": str(slot1['doctor']),
-                            "date": str(slot1['date']),
-                            "start_time": str(slot1['start_time']),
-                            "end_time": str(slot2['end_time']),
-                            "duration_minutes": 60,
-                            "location": str(slot1['location'])
-                        })
-                    except Exception as _:
-                        pass
-
-                    # Automatically send intake forms if email is provided
-                    forms_message = ""
-                    if patient_email and '@' in patient_email:
-                        try:
-                            forms_result = send_intake_forms.invoke({
-                                "booking_id": booking_id,
-                                "patient_name": patient_name,
-                                "patient_email": patient_email,
-                                "appointment_date": str(slot1['date']),
-                                "doctor_name": str(slot1['doctor'])
-                            })
-                            if "Success" in forms_result:
-                                forms_message = " Intake forms have been sent to your email."
-                            else:
-                                forms_message = f" Note: {forms_result}"
-                        except Exception as e:
-                            forms_message = f" Note: Could not send intake forms: {str(e)}"
-
-                    return (
-                        f"Success: Calendly booking confirmed! Booking ID: {booking_id}. "
-                        f"Appointment with {slot1['doctor']} on {slot1['date']} from {slot1['start_time']} to {slot2['end_time']}. "
-                        f"Calendar invite has been sent to {email_display}.{forms_message}"
-                    )
-                else:
-                    return "Error: One of the paired slots is already booked."
-            else:
-                return "Error: Paired slot indices not found."
+        # Simulate Calendly booking by claiming the slot(s) in the schedule store
+        store = get_schedule_store()
 
-        # Extract single-slot index format: calendly_<index>
-        try:
-            slot_index = int(slot_id.split('_')[-1]) if '_' in slot_id else None
-        except ValueError:
+        slot_ids = parse_slot_id(slot_id)
+        if not slot_ids:
             return "Error: Invalid slot ID format."
 
-        if slot_index is not None and 0 <= slot_index < len(df):
-            slot = df.iloc[slot_index]
-            if bool(slot['is_booked']):
+        slots = store.get_slots(slot_ids)
+        if len(slots) != len(slot_ids):
+            return "Error: Invalid slot ID or slot not available in Calendly."
+        if not is_contiguous_block(slots):
+            return "Error: The slots in this ID are not one continuous block."
+
+        # Compare-and-set: every slot in the block is claimed together or not at all
+        if not store.book_slots(slot_ids):
+            if len(slot_ids) == 1:
                 return "Error: This slot is already booked."
+            return "Error: One of the slots in this block is already booked."
 
-            df.loc[slot_index, 'is_booked'] = True
-            df.to_excel(SCHEDULE_XLSX_PATH, index=False)
+        first, last = slots[0], slots[-1]
+        duration_minutes = int((time_to_minutes([last['end_time']]) - time_to_minutes([first['start_time']]))[0])
+        email_display = patient_email if patient_email else "your email"
+        booking_id = "calendly_booking_" + "_".join(str(i) for i in slot_ids)
 
-            email_display = patient_email if patient_email else "your email"
-            booking_id = f"calendly_booking_{slot_index}"
-            
-            # Export admin record (30-minute single)
+        # Export admin record
+        try:
+            export_appointment.invoke({
+                "booking_id": booking_id,
+                "patient_name": patient_name,
+                "patient_email": patient_email or "",
+                "patient_phone": "",
+                "doctor": str(first['doctor']),
+                "date": str(first['date']),
+                "start_time": str(first['start_time']),
+                "end_time": str(last['end_time']),
+                "duration_minutes": duration_minutes,
+                "location": str(first['location'])
+            })
+        except Exception as _:
+            pass
+
+        # Automatically send intake forms if email is provided
+        forms_message = ""
+        if patient_email and '@' in patient_email:
             try:
-                export_appointment.invoke({
+                forms_result = send_intake_forms.invoke({
                     "booking_id": booking_id,
                     "patient_name": patient_name,
-                    "patient_email": patient_email or "",
-                    "patient_phone": "",
-                    "doctor": str(slot['doctor']),
-                    "date": str(slot['date']),
-                    "start_time": str(slot['start_time']),
-                    "end_time": str(slot['end_time']),
-                    "duration_minutes": 30,
-                    "location": str(slot['location'])
+                    "patient_email": patient_email,
+                    "appointment_date": str(first['date']),
+                    "doctor_name": str(first['doctor'])
                 })
-            except Exception as _:
-                pass
-
-            # Automatically send intake forms if email is provided
-            forms_message = ""
-            if patient_email and '@' in patient_email:
-                try:
-                    forms_result = send_intake_forms.invoke({
-                        "booking_id": booking_id,
-                        "patient_name": patient_name,
-                        "patient_email": patient_email,
-                        "appointment_date": str(slot['date']),
-                        "doctor_name": str(slot['doctor'])
-                    })
-                    if "Success" in forms_result:
-                        forms_message = " Intake forms have been sent to your email."
-                    else:
-                        forms_message = f" Note: {forms_result}"
-                except Exception as e:
-                    forms_message = f" Note: Could not send intake forms: {str(e)}"
-
-            return (
-                f"Success: Calendly booking confirmed! Booking ID: {booking_id}. "
-                f"Appointment with {slot['doctor']} on {slot['date']} at {slot['start_time']}. "
-                f"Calendar invite has been sent to {email_display}.{forms_message}"
-            )
+                if "Success" in forms_result:
+                    forms_message = " Intake forms have been sent to your email."
+                else:
+                    forms_message = f" Note: {forms_result}"
+            except Exception as e:
+                forms_message = f" Note: Could not send intake forms: {str(e)}"
+
+        if len(slots) == 1:
+            when = f"at {first['start_time']}"
         else:
-            return "Error: Invalid slot ID or slot not available in Calendly."
+            when = f"from {first['start_time']} to {last['end_time']}"
+        return (
+            f"Success: Calendly booking confirmed! Booking ID: {booking_id}. "
+            f"Appointment with {first['doctor']} on {first['date']} {when}. "
+            f"Calendar invite has been sent to {email_display}.{forms_message}"
+        )
     except Exception as e:
         return f"Calendly booking error: {str(e)}"
 
+def _compact_slot_table(rows: list, columns: list) -> dict:
+    """
+    Token-lean availability payload: fields with the same value on every row
+    are stated once, the rest become a table ("columns" + "slots" rows).
+    """
+    shared = {}
+    if rows:
+        for col in columns:
+            values = {row[col] for row in rows}
+            if len(values) == 1:
+                shared[col] = rows[0][col]
+    varying = [col for col in columns if col not in shared]
+    return {**shared, "columns": varying, "slots": [[row[col] for col in varying] for row in rows]}
+
 @tool
-def get_calendly_availability_with_duration(calendly_link: str, date: str, required_duration_minutes: int, doctor_name: str = "") -> list:
+def get_calendly_availability_with_duration(calendly_link: str, date: str, required_duration_minutes: int, doctor_name: str = "", limit: int = AVAILABILITY_MAX_RESULTS, after_time: str = "", cursor: str = "") -> dict:
     """
-    Duration-aware Calendly availability. For 60-minute appointments, this merges
-    two consecutive 30-minute free slots into one 60-minute option.
-    Returns a list of slots in Calendly-like format. Slot IDs for merged pairs use
-    the form: "calendly_pair_{i}_{j}" where i and j are row indices in the schedule.
+    Duration-aware Calendly availability. Consecutive free slots are merged into
+    blocks long enough for required_duration_minutes (e.g. two 30-minute slots
+    for a 45 or 60-minute visit, four for 120 minutes).
+    Returns a compact table: fields shared by every block (doctor, date, location,
+    calendly_link, duration_minutes) appear once, and "slots" holds one row per
+    block in the order given by "columns" (slot_id, start, end).
+    Paging:
+    - limit: how many blocks to return (e.g. 5 for "the next 5 slots")
+    - after_time (HH:MM): only blocks starting at or after this time
+    - cursor: the "next_cursor" of a previous result, to get the following page;
+      "next_cursor" is only present when more blocks exist that day
+    Slot IDs encode the whole block: "calendly_{i}" for a single slot,
+    "calendly_run_{i}_{j}_..." for runs, where i, j, ... are slot indices in the schedule.
     """
     try:
-        df = pd.read_excel(SCHEDULE_XLSX_PATH)
-        df['date'] = df['date'].astype(str).str.split(' ').str[0]
         date_str = _normalize_date_string(date)
         # Use datetime objects for robust comparison
         try:
@@ -214,7 +174,7 @@ def get_calendly_availability_with_duration(calendly_link: str, date: str, requi
             if requested_date < today_date:
                 user_date = requested_date.strftime('%B %d, %Y')
                 print(f"[DEBUG] Date rejected: requested_date < today_date")
-                return [{"error": f"{user_date} is in the past. Please choose today or a future date."}]
+                return {"error": f"{user_date} is in the past. Please choose today or a future date.", "slots": []}
         except Exception as e:
             print(f"[DEBUG] Date parsing error: {e}, date_str={date_str}")
             # If parsing fails, fallback to string comparison
@@ -223,64 +183,114 @@ def get_calendly_availability_with_duration(calendly_link: str, date: str, requi
             if isinstance(date_str, str) and date_str < today_str:
                 user_date = date_str
                 print(f"[DEBUG] Date rejected (string): date_str < today_str")
-                return [{"error": f"{user_date} is in the past. Please choose today or a future date."}]
+                return {"error": f"{user_date} is in the past. Please choose today or a future date.", "slots": []}
         # Determine doctor explicitly if provided; otherwise fall back to link heuristic
         if not doctor_name:
             doctor_name = "Dr. Sharma" if "sharma" in calendly_link.lower() else "Dr. Verma"
 
-        day_slots = df[(df['doctor'].str.lower() == doctor_name.lower()) & (df['date'] == date) & (df['is_booked'] == False)].copy()
-        if day_slots.empty:
-            return [{"message": "No available slots found for the specified date."}]
-
-        # Normalize times to datetime for sequencing
-        day_slots['start_time_str'] = day_slots['start_time'].astype(str)
-        day_slots['end_time_str'] = day_slots['end_time'].astype(str)
-        day_slots['start_dt'] = pd.to_datetime(day_slots['date'] + ' ' + day_slots['start_time_str'])
-        day_slots['end_dt'] = pd.to_datetime(day_slots['date'] + ' ' + day_slots['end_time_str'])
-        day_slots = day_slots.sort_values('start_dt')
-
-        results = []
-        if required_duration_minutes <= 30:
-            for idx, slot in day_slots.iterrows():
-                results.append({
-                    "slot_id": f"calendly_{idx}",
-                    "start_time": str(slot['start_time']),
-                    "end_time": str(slot['end_time']),
-                    "duration_minutes": 30,
-                    "available": True,
-                    "calendly_link": calendly_link,
-                    "doctor": slot['doctor'],
-                    "location": slot['location']
-                })
-            return results
-
-        # For 60 minutes: find consecutive pairs where end of first == start of second
-        indices = list(day_slots.index)
-        for i in range(len(indices) - 1):
-            idx1 = indices[i]
-            idx2 = indices[i + 1]
-            s1 = day_slots.loc[idx1]
-            s2 = day_slots.loc[idx2]
-            # Robust adjacency check: exact match on strings OR <= 1 minute gap
-            string_adjacent = str(s1['end_time_str']) == str(s2['start_time_str'])
-            time_gap = (s2['start_dt'] - s1['end_dt']).total_seconds()
-            near_adjacent = 0 <= time_gap <= 60  # allow up to 1 minute tolerance
-            if string_adjacent or near_adjacent:
-                results.append({
-                    "slot_id": f"calendly_pair_{idx1}_{idx2}",
-                    "start_time": str(s1['start_time']),
-                    "end_time": str(s2['end_time']),
-                    "duration_minutes": 60,
-                    "available": True,
-                    "calendly_link": calendly_link,
-                    "doctor": s1['doctor'],
-                    "location": s1['location']
-                })
-        if not results:
-            return [{"message": "No 60-minute continuous slots available. Please try another date."}]
-        return results
+        if cursor:
+            # Cursor tokens are "<date>T<HH:MM>" (start of the next page's first block)
+            cursor_date, _, cursor_time = cursor.rpartition('T')
+            if cursor_date and cursor_date != date_str:
+                return {"error": f"Cursor {cursor} belongs to {cursor_date}, not {date_str}. Search again without a cursor.", "slots": []}
+            after_time = cursor_time
+        limit = min(max(int(limit), 1), 50)
+
+        # Page straight off the (doctor, date, is_booked, start_time) index: only as many
+        # slots as the next limit + 1 blocks need are read, never the whole day
+        store = get_schedule_store()
+        free, firsts, lasts = find_runs_page(
+            lambda n: store.free_slots(doctor_name, date_str, after_time=after_time, limit=n),
+            required_duration_minutes, limit,
+        )
+        if not free:
+            return {"message": "No available slots found for the specified date.", "slots": []}
+        if len(firsts) == 0:
+            return {"message": f"No {required_duration_minutes}-minute continuous slots available. Please try another date.", "slots": []}
+
+        starts = time_to_minutes([slot['start_time'] for slot in free])
+        ends = time_to_minutes([slot['end_time'] for slot in free])
+        rows = []
+        for i, j in zip(firsts[:limit].tolist(), lasts[:limit].tolist()):
+            first, last = free[i], free[j]
+            rows.append({
+                "slot_id": make_slot_id(slot['slot_id'] for slot in free[i:j + 1]),
+                "start": str(first['start_time'])[:5],
+                "end": str(last['end_time'])[:5],
+                "duration_minutes": int(ends[j] - starts[i]),
+                "doctor": first['doctor'],
+                "date": date_str,
+                "location": first['location'],
+                "calendly_link": calendly_link,
+            })
+        result = _compact_slot_table(rows, ["doctor", "date", "location", "calendly_link", "duration_minutes", "slot_id", "start", "end"])
+        if len(firsts) > limit:
+            result["next_cursor"] = f"{date_str}T{str(free[int(firsts[limit])]['start_time'])[:5]}"
+        return result
     except Exception as e:
-        return [{"error": f"Calendly duration search error: {str(e)}"}]
+        return {"error": f"Calendly duration search error: {str(e)}", "slots": []}
+
+@tool
+def search_availability(start_date: str, required_duration_minutes: int, end_date: str = "", doctor_names: Optional[List[str]] = None, location: str = "", top_k: int = 5, preferred_time: str = "") -> dict:
+    """
+    Search free appointment blocks across a date range and several doctors in one call.
+    Use this instead of calling get_calendly_availability_with_duration once per
+    doctor and date, e.g. for "the earliest slot with any doctor this week".
+    - end_date defaults to 6 days after start_date
+    - doctor_names and location are optional filters (any doctor / any location if omitted)
+    - top_k limits how many options are returned
+    - preferred_time (HH:MM) ranks blocks closest to that time of day first; otherwise earliest first
+    Returns the same compact table as get_calendly_availability_with_duration (shared
+    fields once, "slots" rows in "columns" order). Slot IDs can be passed directly to
+    book_calendly_slot.
+    """
+    try:
+        s = _normalize_date_string(start_date)
+        e = _normalize_date_string(end_date) if end_date else ""
+        try:
+            start = max(datetime.strptime(s, '%Y-%m-%d').date(), datetime.today().date())
+            end = datetime.strptime(e, '%Y-%m-%d').date() if e else start + timedelta(days=6)
+        except ValueError:
+            return {"error": f"Could not understand the date range {start_date} to {end_date}. Please use YYYY-MM-DD.", "slots": []}
+        if end < start:
+            return {"error": "The end date is before the start date (or the whole range is in the past).", "slots": []}
+
+        # One indexed scan over the whole range
+        free = get_schedule_store().free_slots_between(
+            start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'), doctors=doctor_names, location=location
+        )
+        firsts, lasts, starts, ends = find_runs_in_slots(free, required_duration_minutes)
+        if len(firsts) == 0:
+            return {"message": f"No {required_duration_minutes}-minute slots available between {start} and {end}.", "slots": []}
+
+        # Rank: closeness to the preferred time of day, else chronological (slots are already ordered)
+        dates = np.array([free[i]['date'] for i in firsts])
+        if preferred_time:
+            target = time_to_minutes([preferred_time])[0]
+            order = np.lexsort((starts[firsts], dates, np.abs(starts[firsts] - target)))
+        else:
+            order = np.lexsort((starts[firsts], dates))
+
+        rows = []
+        for k in order[:max(int(top_k), 1)].tolist():
+            i, j = int(firsts[k]), int(lasts[k])
+            first, last = free[i], free[j]
+            rows.append({
+                "slot_id": make_slot_id(slot['slot_id'] for slot in free[i:j + 1]),
+                "date": first['date'],
+                "start": str(first['start_time'])[:5],
+                "end": str(last['end_time'])[:5],
+                "duration_minutes": int(ends[j] - starts[i]),
+                "doctor": first['doctor'],
+                "location": first['location'],
+                "calendly_link": "https://calendly.com/" + str(first['doctor']).lower().replace('.', '').replace(' ', '-'),
+            })
+        result = _compact_slot_table(rows, ["doctor", "date", "location", "calendly_link", "duration_minutes", "slot_id", "start", "end"])
+        if len(firsts) > len(rows):
+            result["more_available"] = int(len(firsts) - len(rows))
+        return result
+    except Exception as e:
+        return {"error": f"Availability search error: {str(e)}", "slots": []}
 
 @tool
 def save_new_patient(first_name: str, last_name: str, dob: str, email: str = "", phone: str = "", preferred_doctor: str = "", location: str = "") -> str:
@@ -303,24 +313,14 @@ def save_new_patient(first_name: str, last_name: str, dob: str, email: str = "",
         member_id = ""
         group_id = ""
 
-        # Load existing or create new DataFrame
-        if os.path.exists(PATIENT_CSV_PATH):
-            df = pd.read_csv(PATIENT_CSV_PATH)
-        else:
-            df = pd.DataFrame(columns=[
-                'first_name','last_name','dob','email','phone','preferred_doctor','location','created_at'
-            ])
-
-        # Prepare for case-insensitive match; handle missing columns gracefully
-        if 'first_name' in df.columns and 'last_name' in df.columns and 'dob' in df.columns:
-            mask = (
-                df['first_name'].astype(str).str.lower() == first.lower()
-            ) & (
-                df['last_name'].astype(str).str.lower() == last.lower()
-            ) & (
-                df['dob'].astype(str) == dob_norm
-            )
-            if df[mask].shape[0] > 0:
+        registry = get_patient_registry()
+
+        # Writers in every process queue here, so the duplicate check, the new
+        # patient_id and the write all see the same file
+        with file_lock(PATIENT_CSV_PATH):
+            # Duplicate protection through the registry index (no CSV scan)
+            position = registry.find_position(first, last, dob_norm)
+            if position is not None:
                 # Update missing details for existing patient
                 update_fields = {
                     'email': email,
@@ -331,58 +331,76 @@ def save_new_patient(first_name: str, last_name: str, dob: str, email: str = "",
                     'member_id': member_id,
                     'group_id': group_id
                 }
-                for field, value in update_fields.items():
-                    if value:
-                        df.loc[mask, field] = value
-                df.to_csv(PATIENT_CSV_PATH, index=False)
+                update_fields = {field: value for field, value in update_fields.items() if value}
+                if update_fields:
+                    df = read_patients_csv(PATIENT_CSV_PATH)
+                    for field, value in update_fields.items():
+                        if field not in df.columns:
+                            df[field] = ""
+                        df.loc[position, field] = value
+                    write_patients_csv(df, PATIENT_CSV_PATH)
+                    registry.record_updated(position, update_fields)
                 return f"Success: Updated details for existing patient {first} {last} ({dob_norm}) in the EMR."
 
-        # Build new row
-        new_row = {
-            'first_name': first,
-            'last_name': last,
-            'dob': dob_norm,
-            'email': email,
-            'phone': phone,
-            'preferred_doctor': preferred_doctor,
-            'location': location,
-            'insurance_carrier': insurance_carrier,
-            'member_id': member_id,
-            'group_id': group_id,
-            'created_at': datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
-        }
-
-        # Ensure all columns exist; extend df columns if needed
-        for key in new_row.keys():
-            if key not in df.columns:
-                df[key] = ""
-
-        # Append row and save
-        df = df.reindex(columns=list(df.columns))
-        row_df = pd.DataFrame([{col: new_row.get(col, "") for col in df.columns}])
-        df = pd.concat([df, row_df], ignore_index=True)
-        df.to_csv(PATIENT_CSV_PATH, index=False)
-
-        return f"Success: Added new patient {first} {last} ({dob_norm}) to the EMR."
+            # Build new row (in the normalized at-rest format: ISO DOB, lowercase name keys)
+            new_row = {
+                'patient_id': registry.next_patient_id(),
+                'first_name': first,
+                'last_name': last,
+                'first_name_key': first.lower(),
+                'last_name_key': last.lower(),
+                'dob': dob_norm,
+                'email': email,
+                'phone': phone,
+                'preferred_doctor': preferred_doctor,
+                'location': location,
+                'insurance_carrier': insurance_carrier,
+                'member_id': member_id,
+                'group_id': group_id,
+                'created_at': datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+            }
+
+            columns = registry.columns
+            if columns and all(key in columns for key in new_row):
+                # Fast path: append a single line instead of rewriting the file
+                needs_newline = False
+                with open(PATIENT_CSV_PATH, 'rb') as f:
+                    if f.seek(0, os.SEEK_END) > 0:
+                        f.seek(-1, os.SEEK_END)
+                        needs_newline = f.read(1) != b'\n'
+                with open(PATIENT_CSV_PATH, 'a', newline='', encoding='utf-8') as f:
+                    if needs_newline:
+                        f.write('\n')
+                    csv.writer(f).writerow([new_row.get(col, "") for col in columns])
+                registry.record_appended(new_row)
+            else:
+                # Missing file or new columns: rewrite once with the extended header
+                if os.path.exists(PATIENT_CSV_PATH):
+                    df = normalize_patient_frame(read_patients_csv(PATIENT_CSV_PATH))
+                else:
+                    df = pd.DataFrame(columns=[
+                        'first_name','last_name','dob','email','phone','preferred_doctor','location','created_at'
+                    ])
+                for key in new_row.keys():
+                    if key not in df.columns:
+                        df[key] = ""
+                row_df = pd.DataFrame([{col: new_row.get(col, "") for col in df.columns}])
+                df = pd.concat([df, row_df], ignore_index=True)
+                write_patients_csv(df, PATIENT_CSV_PATH)
+                registry.invalidate()
+
+            return f"Success: Added new patient {first} {last} ({dob_norm}) to the EMR."
     except Exception as e:
         return f"Error saving new patient: {str(e)}"
 
 @tool
 def export_appointment(booking_id: str, patient_name: str, patient_email: str, patient_phone: str, doctor: str, date: str, start_time: str, end_time: str, duration_minutes: int, location: str) -> str:
     """
-    Append a confirmed appointment to app/exports/appointments.xlsx.
-    Creates the file with headers if missing.
+    Append a confirmed appointment to the admin export journal
+    (app/exports/appointments.jsonl). Use compact_appointments_export to
+    produce appointments.xlsx from it.
     """
     try:
-        os.makedirs(EXPORTS_DIR, exist_ok=True)
-        export_path = os.path.join(EXPORTS_DIR, 'appointments.xlsx')
-
-        required_cols = [
-            'booking_id', 'patient_name', 'patient_email', 'patient_phone',
-            'doctor', 'location', 'date', 'start_time', 'end_time',
-            'duration_minutes', 'created_at'
-        ]
-
         record = {
             'booking_id': str(booking_id),
             'patient_name': str(patient_name),
@@ -397,66 +415,99 @@ def export_appointment(booking_id: str, patient_name: str, patient_email: str, p
             'created_at': datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
         }
 
-        if os.path.exists(export_path):
-            existing = pd.read_excel(export_path)
-            # Normalize existing to required schema only
-            for col in required_cols:
-                if col not in existing.columns:
-                    existing[col] = ''
-            existing = existing[required_cols]
-        else:
-            existing = pd.DataFrame(columns=required_cols)
-
-        new_row = pd.DataFrame([[record[c] for c in required_cols]], columns=required_cols)
-        out_df = pd.concat([existing, new_row], ignore_index=True)
-
-        with pd.ExcelWriter(export_path, engine='openpyxl', mode='w') as writer:
-            out_df.to_excel(writer, index=False)
-        return f"Success: Exported booking {booking_id} to appointments.xlsx"
+        # O(1) append; the workbook is rebuilt only by compact_appointments_export
+        get_appointment_journal().append(record)
+        _sync_rollups()
+        return f"Success: Exported booking {booking_id} to the appointments journal"
     except Exception as e:
         return f"Error exporting appointment: {str(e)}"
 
+def _sync_rollups() -> None:
+    # Report rollups catch up on the next report if this fails; never fail the booking over it
+    try:
+        get_rollup_store().sync()
+    except Exception as e:
+        print(f"[ROLLUPS] Deferred rollup update: {str(e)}")
+
 @tool
-def build_admin_report(start_date: str, end_date: str) -> str:
+def cancel_appointment(booking_id: str, reason: str = "") -> str:
     """
-    Build an admin summary report (appointments_report.xlsx) for a date range.
-    Summary tab by date and doctor; Raw tab with filtered rows.
+    Cancels a confirmed appointment by its booking ID (e.g. "calendly_booking_12_13").
+    Frees the slot(s) in the schedule and records the cancellation for admin reports.
     """
     try:
-        export_path = os.path.join(EXPORTS_DIR, 'appointments.xlsx')
-        if not os.path.exists(export_path):
-            return "Error: No appointments.xlsx found to build a report."
+        booking = get_rollup_store().booking(booking_id)
+        if booking is None or not booking['active']:
+            return f"Error: No active booking found with ID {booking_id}."
+
+        slot_ids = parse_slot_id(booking_id.replace("calendly_booking_", "calendly_run_", 1))
+        released = get_schedule_store().release_slots(slot_ids) if slot_ids else 0
+
+        get_appointment_journal().append({
+            'event': EVENT_CANCELLED,
+            'booking_id': str(booking_id),
+            'doctor': booking['doctor'],
+            'location': booking['location'],
+            'date': booking['date'],
+            'duration_minutes': booking['minutes'],
+            'cancel_reason': str(reason or ''),
+            'created_at': datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+        })
+        _sync_rollups()
+        get_reminder_store().cancel_booking(booking_id)
+        return (
+            f"Success: Booking {booking_id} with {booking['doctor']} on {booking['date']} has been cancelled. "
+            f"{released} slot(s) released."
+        )
+    except Exception as e:
+        return f"Error cancelling appointment: {str(e)}"
 
-        df = pd.read_excel(export_path)
-        if df.empty:
-            return "Error: appointments.xlsx has no rows."
+@tool
+def compact_appointments_export() -> str:
+    """
+    Admin tool: materialize app/exports/appointments.xlsx from the append-only
+    booking journal. Only needed when someone wants the workbook itself.
+    """
+    try:
+        rows = get_appointment_journal().compact_to_excel()
+        if rows < 0:
+            return "Success: appointments.xlsx is already up to date."
+        return f"Success: Wrote {rows} bookings to appointments.xlsx"
+    except Exception as e:
+        return f"Error compacting appointments export: {str(e)}"
 
+@tool
+def build_admin_report(start_date: str, end_date: str, include_raw: bool = True) -> str:
+    """
+    Build an admin summary report (appointments_report.xlsx) for a date range.
+    Summary tab by date and doctor, By Location and By Week tabs, and a Raw tab
+    with filtered rows (skip it with include_raw=False for a faster report).
+    """
+    try:
         s = _normalize_date_string(start_date)
         e = _normalize_date_string(end_date)
 
-        df['date'] = pd.to_datetime(df['date']).dt.strftime('%Y-%m-%d')
-        mask = (df['date'] >= s) & (df['date'] <= e)
-        filt = df[mask].copy()
-        if filt.empty:
+        # Summaries come from pre-aggregated rollups; no raw rows are touched
+        rollups = get_rollup_store()
+        summary = rollups.summary(s, e, by='doctor')
+        if summary.empty:
             return f"Info: No appointments between {s} and {e}."
+        by_location = rollups.summary(s, e, by='location')
+        by_week = rollups.summary(s, e, by='week')
 
-        # Convert duration to numeric
-        filt['duration_minutes'] = pd.to_numeric(filt['duration_minutes'], errors='coerce').fillna(0).astype(int)
+        # Only the date partitions in range are read
+        raw = get_analytics_store().read_range(s, e, columns=EXPORT_COLUMNS) if include_raw else None
 
-        # Summary by date/doctor
-        summary = (
-            filt.groupby(['date', 'doctor'])
-            .agg(total_appointments=('booking_id', 'count'),
-                 total_minutes_booked=('duration_minutes', 'sum'),
-                 avg_duration_minutes=('duration_minutes', 'mean'))
-            .reset_index()
-        )
-        summary['avg_duration_minutes'] = summary['avg_duration_minutes'].round(1)
+        def write(f) -> None:
+            with pd.ExcelWriter(f, engine='openpyxl') as writer:
+                summary.to_excel(writer, index=False, sheet_name='Summary')
+                by_location.to_excel(writer, index=False, sheet_name='By Location')
+                by_week.to_excel(writer, index=False, sheet_name='By Week')
+                if raw is not None:
+                    raw.to_excel(writer, index=False, sheet_name='Raw')
 
         report_path = os.path.join(EXPORTS_DIR, 'appointments_report.xlsx')
-        with pd.ExcelWriter(report_path, engine='openpyxl', mode='w') as writer:
-            summary.to_excel(writer, index=False, sheet_name='Summary')
-            filt.to_excel(writer, index=False, sheet_name='Raw')
+        atomic_write(report_path, write, mode='wb')
 
         return f"Success: Admin report saved to {report_path}"
     except Exception as e:
@@ -472,64 +523,63 @@ def schedule_enhanced_reminders(booking_id: str, patient_name: str, appointment_
     Returns confirmation of scheduled reminders.
     """
     try:
-        # For demo purposes, we'll simulate the scheduling
-        # In production, this would use a proper scheduler like APScheduler
-        
         # Handle time format - add seconds if not present
         if len(appointment_time.split(':')) == 2:
             appointment_time = appointment_time + ":00"
         appointment_datetime = datetime.strptime(f"{appointment_date} {appointment_time}", "%Y-%m-%d %H:%M:%S")
         
-        # Calculate reminder times (for demo: 1 day, 2 hours, 30 minutes before appointment)
+        # Calculate reminder times (1 day, 2 hours, 30 minutes before appointment)
         reminder1_time = appointment_datetime - timedelta(days=1)
         reminder2_time = appointment_datetime - timedelta(hours=2)
         reminder3_time = appointment_datetime - timedelta(minutes=30)
         
-        # Store reminder schedule (in production, this would be in a database)
-        reminder_schedule = {
+        reminders = [
+            {
+                "reminder_number": 1,
+                "due_at": reminder1_time,
+                "type": "regular_reminder",
+                "message": f"Reminder: You have an appointment with {doctor_name} on {appointment_date} at {appointment_time}. Please arrive 15 minutes early.",
+            },
+            {
+                "reminder_number": 2,
+                "due_at": reminder2_time,
+                "type": "forms_check",
+                "message": f"Reminder: Your appointment with {doctor_name} is in 2 hours. Have you completed the intake forms? Please reply YES if completed, NO if not.",
+            },
+            {
+                "reminder_number": 3,
+                "due_at": reminder3_time,
+                "type": "confirmation_check",
+                "message": f"Final reminder: Your appointment with {doctor_name} is in 30 minutes. Please confirm you're still coming or reply with your cancellation reason.",
+            }
+        ]
+        # Reminders whose time has already passed are recorded but never sent
+        now = datetime.now()
+        for reminder in reminders:
+            reminder["status"] = "scheduled" if reminder["due_at"] > now else "skipped"
+            reminder["due_at"] = reminder["due_at"].strftime('%Y-%m-%d %H:%M:%S')
+
+        # Persist to the durable queue; the reminder worker delivers them when due
+        pending = get_reminder_store().schedule({
             "booking_id": booking_id,
             "patient_name": patient_name,
-            "appointment_date": appointment_date,
-            "appointment_time": appointment_time,
-            "doctor_name": doctor_name,
             "patient_email": patient_email,
             "patient_phone": patient_phone,
-            "reminders": [
-                {
-                    "reminder_number": 1,
-                    "scheduled_time": reminder1_time.isoformat(),
-                    "type": "regular_reminder",
-                    "message": f"Reminder: You have an appointment with {doctor_name} on {appointment_date} at {appointment_time}. Please arrive 15 minutes early.",
-                    "status": "scheduled"
-                },
-                {
-                    "reminder_number": 2,
-                    "scheduled_time": reminder2_time.isoformat(),
-                    "type": "forms_check",
-                    "message": f"Reminder: Your appointment with {doctor_name} is in 2 hours. Have you completed the intake forms? Please reply YES if completed, NO if not.",
-                    "status": "scheduled"
-                },
-                {
-                    "reminder_number": 3,
-                    "scheduled_time": reminder3_time.isoformat(),
-                    "type": "confirmation_check",
-                    "message": f"Final reminder: Your appointment with {doctor_name} is in 30 minutes. Please confirm you're still coming or reply with your cancellation reason.",
-                    "status": "scheduled"
-                }
-            ]
-        }
-        
-        # In production, save to database or scheduler
-        print(f"[REMINDER SYSTEM] Scheduled 3 reminders for booking {booking_id}")
+        }, reminders)
+        notify_reminder_worker()
+
+        print(f"[REMINDER SYSTEM] Scheduled {pending} reminders for booking {booking_id}")
         print(f"[REMINDER 1] {reminder1_time.strftime('%Y-%m-%d %H:%M')} - Regular reminder")
         print(f"[REMINDER 2] {reminder2_time.strftime('%Y-%m-%d %H:%M')} - Forms completion check")
         print(f"[REMINDER 3] {reminder3_time.strftime('%Y-%m-%d %H:%M')} - Final confirmation/cancellation")
         
+        skipped = len(reminders) - pending
+        skipped_note = f" {skipped} reminder(s) were skipped because their time has already passed." if skipped else ""
         return f"Success: Enhanced reminder system activated for booking {booking_id}. " \
-               f"3 automated reminders scheduled: " \
+               f"{pending} automated reminders scheduled: " \
                f"1) Regular reminder 1 day before, " \
                f"2) Forms completion check 2 hours before, " \
-               f"3) Final confirmation 30 minutes before appointment."
+               f"3) Final confirmation 30 minutes before appointment.{skipped_note}"
     except Exception as e:
         return f"Error scheduling reminders: {str(e)}"
 
@@ -599,49 +649,14 @@ def send_intake_forms(booking_id: str, patient_name: str, patient_email: str, ap
         if not os.path.exists(FORMS_DIR):
             return f"Error: Forms directory not found at {FORMS_DIR}"
         
-        # Get list of available form files
-        form_files = []
-        for file in os.listdir(FORMS_DIR):
-            if file.endswith(('.pdf', '.doc', '.docx')):
-                form_files.append(file)
+        # Encoded once per file version; later emails reuse the cached MIME parts
+        form_attachments = get_form_attachment_cache().get_attachments()
         
-        if not form_files:
+        if not form_attachments:
             return f"Error: No form files found in {FORMS_DIR}"
         
-        # Read the main intake form PDF
-        main_form_path = os.path.join(FORMS_DIR, "New Patient Intake Form.pdf")
-        form_attachments = []
-        
-        if os.path.exists(main_form_path):
-            try:
-                with open(main_form_path, 'rb') as f:
-                    form_content = f.read()
-                    form_size = len(form_content)
-                    form_attachments.append({
-                        "filename": "New Patient Intake Form.pdf",
-                        "size": form_size,
-                        "content": form_content
-                    })
-                print(f"[FORM READ] Successfully read 'New Patient Intake Form.pdf' ({form_size} bytes)")
-            except Exception as e:
-                print(f"[FORM READ ERROR] Could not read main form: {str(e)}")
-        
-        # Read other available forms
-        for form_file in form_files:
-            if form_file != "New Patient Intake Form.pdf":
-                form_path = os.path.join(FORMS_DIR, form_file)
-                try:
-                    with open(form_path, 'rb') as f:
-                        form_content = f.read()
-                        form_size = len(form_content)
-                        form_attachments.append({
-                            "filename": form_file,
-                            "size": form_size,
-                            "content": form_content
-                        })
-                    print(f"[FORM READ] Successfully read '{form_file}' ({form_size} bytes)")
-                except Exception as e:
-                    print(f"[FORM READ ERROR] Could not read {form_file}: {str(e)}")
+        for attachment in form_attachments:
+            print(f"[FORM READ] Attaching '{attachment['filename']}' ({attachment['size']} bytes)")
         
         # Prepare email content
         form_subject = f"Intake Forms for Your Appointment with {doctor_name} - {appointment_date}"
@@ -691,9 +706,6 @@ MediCare Clinic Team
             try:
                 from email.mime.multipart import MIMEMultipart
                 from email.mime.text import MIMEText
-                from email.mime.application import MIMEApplication
-                import smtplib
-                import time
                 
                 # Create email message
                 msg = MIMEMultipart()
@@ -706,69 +718,11 @@ MediCare Clinic Team
                 
                 # Attach form files
                 for attachment in form_attachments:
-                    pdf_attachment = MIMEApplication(attachment['content'], _subtype='pdf')
-                    pdf_attachment.add_header('Content-Disposition', 'attachment', 
-                                            filename=attachment['filename'])
-                    msg.attach(pdf_attachment)
+                    msg.attach(attachment['part'])
                 
-                # Retry logic for email sending
-                max_retries = 3
-                retry_delay = 2  # seconds
-                
-                for attempt in range(max_retries):
-                    try:
-                        print(f"[REAL EMAIL] Attempt {attempt + 1}/{max_retries} - Connecting to {SMTP_SERVER}:{SMTP_PORT}")
-                        
-                        # Create SMTP connection with timeout
-                        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=30)
-                        server.set_debuglevel(0)  # Set to 1 for debug output
-                        
-                        # Enable TLS
-                        server.starttls()
-                        
-                        # Login with credentials
-                        server.login(SMTP_USERNAME, SMTP_PASSWORD)
-                        
-                        # Send the email
-                        server.send_message(msg)
-                        server.quit()
-                        
-                        print(f"[REAL EMAIL] Successfully sent email with {len(form_attachments)} attachments to {patient_email}")
-                        break  # Success, exit retry loop
-                        
-                    except smtplib.SMTPAuthenticationError as e:
-                        print(f"[REAL EMAIL ERROR] Authentication failed: {str(e)}")
-                        return f"Error: Email authentication failed. Please check your SMTP username and password in the .env file."
-                    except smtplib.SMTPRecipientsRefused as e:
-                        print(f"[REAL EMAIL ERROR] Recipient refused: {str(e)}")
-                        return f"Error: Email address {patient_email} was refused by the server. Please verify the email address."
-                    except smtplib.SMTPServerDisconnected as e:
-                        print(f"[REAL EMAIL ERROR] Server disconnected: {str(e)}")
-                        if attempt < max_retries - 1:
-                            print(f"[REAL EMAIL] Retrying in {retry_delay} seconds...")
-                            time.sleep(retry_delay)
-                            retry_delay *= 2  # Exponential backoff
-                        else:
-                            return f"Error: Email server connection failed after {max_retries} attempts. Please check your internet connection and SMTP settings."
-                    except smtplib.SMTPException as e:
-                        print(f"[REAL EMAIL ERROR] SMTP error: {str(e)}")
-                        if attempt < max_retries - 1:
-                            print(f"[REAL EMAIL] Retrying in {retry_delay} seconds...")
-                            time.sleep(retry_delay)
-                            retry_delay *= 2
-                        else:
-                            return f"Error: Email sending failed after {max_retries} attempts. SMTP error: {str(e)}"
-                    except Exception as e:
-                        print(f"[REAL EMAIL ERROR] Unexpected error: {str(e)}")
-                        if attempt < max_retries - 1:
-                            print(f"[REAL EMAIL] Retrying in {retry_delay} seconds...")
-                            time.sleep(retry_delay)
-                            retry_delay *= 2
-                        else:
-                            return f"Error: Email sending failed after {max_retries} attempts. Error: {str(e)}"
-                else:
-                    # This runs if the for loop completes without breaking
-                    return f"Error: Email sending failed after {max_retries} attempts. Please try again later or contact support."
+                # Hand off to the background mail queue (pooled connections, retries with backoff)
+                mail_id = get_mail_queue().enqueue(msg)
+                print(f"[REAL EMAIL] Queued {mail_id} with {len(form_attachments)} attachments for {patient_email} via {SMTP_SERVER}:{SMTP_PORT}")
                 
             except Exception as e:
                 print(f"[REAL EMAIL ERROR] Critical error: {str(e)}")
@@ -776,7 +730,8 @@ MediCare Clinic Team
         else:
             print("[EMAIL SIMULATION] Real email disabled - using simulation mode")
         
-        return f"Success: Intake forms sent to {patient_email} for booking {booking_id}. " \
+        delivery = "queued for delivery to" if USE_REAL_EMAIL else "sent to"
+        return f"Success: Intake forms {delivery} {patient_email} for booking {booking_id}. " \
                f"Attached {len(form_attachments)} form(s): {', '.join([att['filename'] for att in form_attachments])}"
     except Exception as e:
         return f"Error sending intake forms: {str(e)}"
@@ -784,9 +739,12 @@ MediCare Clinic Team
 all_tools = [
     lookup_patient,
     get_calendly_availability_with_duration,  # duration-aware availability (authoritative)
+    search_availability,  # multi-day / multi-doctor search in one call
     book_calendly_slot,
+    cancel_appointment,
     save_new_patient,
     export_appointment,
+    compact_appointments_export,
     build_admin_report,
     schedule_enhanced_reminders,
     validate_email_config,
@@ -0,0 +1,167 @@
+import asyncio
+import functools
+import json
+import uuid
+import weakref
+from contextlib import asynccontextmanager
+
+from pydantic import ValidationError
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from app.agent.async_tools import all_async_tools
+from app.agent.context import ConversationContext
+from app.agent.executor import get_tool_pool
+from app.agent.llm import get_chat_model
+from app.agent.reminders import start_reminder_worker
+from app.agent.runtime import AgentRuntime, new_conversation
+from app.agent.session_store import SessionConflict, get_session_store
+from app.agent.tools import all_tools
+
+
+class ToolResultResponse(JSONResponse):
+    """Tool results can hold dates and numpy scalars; send those as strings."""
+
+    def render(self, content) -> bytes:
+        return json.dumps(content, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+
+
+# Direct endpoints: path -> tool, called with the JSON body as arguments
+TOOL_ENDPOINTS = {
+    '/patients/lookup': 'lookup_patient',
+    '/availability': 'get_calendly_availability_with_duration',
+    '/availability/search': 'search_availability',
+    '/bookings': 'book_calendly_slot',
+    '/reports': 'build_admin_report',
+}
+
+# Turns of one session run one at a time within this worker
+_session_locks: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+_runtime = None
+
+
+def _get_runtime() -> AgentRuntime:
+    global _runtime
+    if _runtime is None:
+        _runtime = AgentRuntime(get_chat_model(all_tools), all_async_tools)
+    return _runtime
+
+
+def _session_lock(session_id: str) -> asyncio.Lock:
+    lock = _session_locks.get(session_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _session_locks[session_id] = lock
+    return lock
+
+
+async def _store_call(func, *args, **kwargs):
+    """Session store calls are blocking SQLite I/O: run them on the tool pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_tool_pool(), functools.partial(func, *args, **kwargs))
+
+
+async def _json_body(request: Request) -> dict:
+    try:
+        body = await request.json()
+    except ValueError:
+        body = None
+    if not isinstance(body, dict):
+        raise ValueError("Request body must be a JSON object")
+    return body
+
+
+def _transcript(messages: list) -> list:
+    """What a front end shows: user messages and the agent's text replies."""
+    return [{'role': 'user' if m.type == 'human' else 'assistant', 'content': m.content}
+            for m in messages if m.type in ('human', 'ai') and m.content]
+
+
+async def health(request: Request) -> JSONResponse:
+    return JSONResponse({'status': 'ok'})
+
+
+async def chat(request: Request) -> JSONResponse:
+    """
+    POST /chat {"session_id": optional, "message": "..."}: one agent turn.
+    The session is loaded from the shared store, so any worker can serve it;
+    a concurrent turn for the same session on another worker gets a 409.
+    """
+    try:
+        body = await _json_body(request)
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    message = str(body.get('message') or '').strip()
+    if not message:
+        return JSONResponse({'error': "Request needs a non-empty 'message'"}, status_code=400)
+    session_id = str(body.get('session_id') or uuid.uuid4().hex)
+
+    store = get_session_store()
+    async with _session_lock(session_id):
+        session = await _store_call(store.load, session_id)
+        if session is None:
+            session = {'messages': new_conversation(), 'state': {}, 'version': 0}
+        messages = session['messages']
+        seen = len(messages)
+        try:
+            result = await _get_runtime().arun_turn(messages, message, context=ConversationContext())
+        except Exception as e:
+            return JSONResponse({'session_id': session_id, 'error': f"Turn failed: {str(e)}"}, status_code=502)
+        try:
+            await _store_call(store.save, session_id, messages, session['state'], session['version'])
+        except SessionConflict as e:
+            return JSONResponse({'session_id': session_id, 'error': str(e)}, status_code=409)
+
+    tool_calls = [call['name'] for m in messages[seen:] for call in (getattr(m, 'tool_calls', None) or [])]
+    return JSONResponse({'session_id': session_id, 'reply': result['content'], 'tool_calls': tool_calls,
+                         'rounds': len(result['rounds']), 'stopped': result['stopped']})
+
+
+async def get_session(request: Request) -> JSONResponse:
+    session_id = request.path_params['session_id']
+    session = await _store_call(get_session_store().load, session_id)
+    if session is None:
+        return JSONResponse({'error': f"Session {session_id} not found"}, status_code=404)
+    return JSONResponse({'session_id': session_id, 'messages': _transcript(session['messages'])})
+
+
+async def delete_session(request: Request) -> JSONResponse:
+    session_id = request.path_params['session_id']
+    deleted = await _store_call(get_session_store().delete, session_id)
+    return JSONResponse({'session_id': session_id, 'deleted': deleted}, status_code=200 if deleted else 404)
+
+
+def _tool_endpoint(tool_name: str):
+    tool = next(t for t in all_async_tools if t.name == tool_name)
+
+    async def endpoint(request: Request) -> JSONResponse:
+        try:
+            args = await _json_body(request)
+            result = await tool.ainvoke(args)
+        except ValidationError as e:
+            return JSONResponse({'error': e.errors(include_url=False, include_context=False)}, status_code=422)
+        except ValueError as e:
+            return JSONResponse({'error': str(e)}, status_code=400)
+        return ToolResultResponse({'tool': tool_name, 'result': result})
+
+    return endpoint
+
+
+@asynccontextmanager
+async def lifespan(app: Starlette):
+    # Every worker sends due reminders; the store's claims keep them from doubling up
+    start_reminder_worker()
+    await _store_call(get_session_store().purge)
+    yield
+
+
+routes = [
+    Route('/health', health, methods=['GET']),
+    Route('/chat', chat, methods=['POST']),
+    Route('/sessions/{session_id}', get_session, methods=['GET']),
+    Route('/sessions/{session_id}', delete_session, methods=['DELETE']),
+] + [Route(path, _tool_endpoint(name), methods=['POST']) for path, name in TOOL_ENDPOINTS.items()]
+
+app = Starlette(routes=routes, lifespan=lifespan)
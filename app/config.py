@@ -9,14 +9,44 @@ BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 
 # --- Data File Paths ---
 DATA_DIR = os.path.join(BASE_DIR, 'app', 'data')
-PATIENT_CSV_PATH = os.path.join(DATA_DIR, 'patients.csv')
-SCHEDULE_XLSX_PATH = os.path.join(DATA_DIR, 'schedules.xlsx')
+PATIENT_CSV_PATH = os.getenv("PATIENT_CSV_PATH", os.path.join(DATA_DIR, 'patients.csv'))
+SCHEDULE_XLSX_PATH = os.getenv("SCHEDULE_XLSX_PATH", os.path.join(DATA_DIR, 'schedules.xlsx'))
 FORMS_DIR = os.path.join(DATA_DIR, 'forms')
+# Upper bound on base64-encoded intake-form attachments kept in memory
+FORM_CACHE_MAX_BYTES = int(os.getenv("FORM_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# Writers of the shared data files (patients.csv, schedules.xlsx, appointments.xlsx)
+# queue on an advisory lock; give up after this many seconds
+FILE_LOCK_TIMEOUT = float(os.getenv("FILE_LOCK_TIMEOUT", "30"))
+
+# --- Schedule Storage ---
+# "sqlite" (default) keeps slots in a transactional database imported once from
+# schedules.xlsx; "excel" reads and writes the workbook directly (legacy).
+SCHEDULE_BACKEND = os.getenv("SCHEDULE_BACKEND", "sqlite").lower()
+SCHEDULE_DB_PATH = os.getenv("SCHEDULE_DB_PATH", os.path.join(DATA_DIR, 'schedules.db'))
+# Most availability blocks one tool call returns (the rest are reachable via next_cursor)
+AVAILABILITY_MAX_RESULTS = int(os.getenv("AVAILABILITY_MAX_RESULTS", "8"))
+
+# --- Reminders ---
+REMINDERS_DB_PATH = os.getenv("REMINDERS_DB_PATH", os.path.join(DATA_DIR, 'reminders.db'))
+REMINDER_BATCH_SIZE = int(os.getenv("REMINDER_BATCH_SIZE", "100"))
+# A reminder claimed by a worker that died is handed out again after this long
+REMINDER_LEASE_SECONDS = int(os.getenv("REMINDER_LEASE_SECONDS", "300"))
+REMINDER_MAX_ATTEMPTS = int(os.getenv("REMINDER_MAX_ATTEMPTS", "5"))
 
 # --- Export File Paths ---
-EXPORTS_DIR = os.path.join(BASE_DIR, 'app', 'exports')
+EXPORTS_DIR = os.getenv("EXPORTS_DIR", os.path.join(BASE_DIR, 'app', 'exports'))
 os.makedirs(EXPORTS_DIR, exist_ok=True)
 
+# Bookings are appended to this journal; appointments.xlsx is materialized on demand
+APPOINTMENTS_JOURNAL_PATH = os.path.join(EXPORTS_DIR, 'appointments.jsonl')
+# "always" fsyncs every booking, "interval" at most once per EXPORT_FSYNC_INTERVAL seconds, "never" leaves it to the OS
+EXPORT_FSYNC = os.getenv("EXPORT_FSYNC", "interval").lower()
+EXPORT_FSYNC_INTERVAL = float(os.getenv("EXPORT_FSYNC_INTERVAL", "1.0"))
+# Date-partitioned Parquet copy of the journal that admin reports read from
+ANALYTICS_DIR = os.path.join(EXPORTS_DIR, 'appointments_parquet')
+# Pre-aggregated (date, doctor, location) counts kept in step with the journal
+ROLLUPS_DB_PATH = os.path.join(EXPORTS_DIR, 'rollups.db')
+
 # --- API Keys ---
 # Load the OpenAI API key for the ChatGPT model
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
@@ -25,6 +55,51 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 # We will use an OpenAI model now
 AGENT_MODEL_NAME = "gpt-4o-mini"
 
+# Point at any OpenAI-compatible endpoint (e.g. a local mock for benchmarks)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+# Keep-alive connection pool shared by every session in the process
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "10"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "60"))
+# Render replies token by token (and start tools as soon as their arguments arrive)
+AGENT_STREAMING = os.getenv("AGENT_STREAMING", "1") == "1"
+# Answer structured steps (name + DOB, a date, a slot number) by calling the tools directly, without the model
+AGENT_FAST_PATH = os.getenv("AGENT_FAST_PATH", "1") == "1"
+# Threads for running one turn's independent tool calls in parallel
+TOOL_MAX_WORKERS = int(os.getenv("TOOL_MAX_WORKERS", "4"))
+
+# Budget for one user turn (model -> tools -> model ... until the model stops)
+AGENT_MAX_ROUNDS = int(os.getenv("AGENT_MAX_ROUNDS", "6"))
+AGENT_MAX_TURN_TOKENS = int(os.getenv("AGENT_MAX_TURN_TOKENS", "60000"))
+AGENT_MAX_TURN_SECONDS = float(os.getenv("AGENT_MAX_TURN_SECONDS", "120"))
+
+# Prompt size: recent turns sent in full, older tool output digested, older turns summarized
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "12000"))
+CONTEXT_KEEP_TURNS = int(os.getenv("CONTEXT_KEEP_TURNS", "6"))
+CONTEXT_TOOL_DIGEST_CHARS = int(os.getenv("CONTEXT_TOOL_DIGEST_CHARS", "600"))
+
+# Headless mode (python app/main.py --headless): JSON-lines chat server on this address
+HEADLESS_HOST = os.getenv("HEADLESS_HOST", "127.0.0.1")
+HEADLESS_PORT = int(os.getenv("HEADLESS_PORT", "8765"))
+
+# HTTP API (python app/main.py --http): JSON endpoints for chat turns and the tools
+HTTP_HOST = os.getenv("HTTP_HOST", "127.0.0.1")
+HTTP_PORT = int(os.getenv("HTTP_PORT", "8000"))
+HTTP_WORKERS = int(os.getenv("HTTP_WORKERS", "1"))
+
+# --- Chat Sessions ---
+# Server-side session store used by the HTTP API and the Streamlit app:
+# "sqlite" (default) is shared by every worker on the host, "redis" by replicas
+# on any host (SESSION_REDIS_URL; an in-process fake when unset), "memory" is
+# per process. Idle sessions expire after the TTL.
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "sqlite").lower()
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", os.path.join(DATA_DIR, 'sessions.db'))
+SESSION_REDIS_URL = os.getenv("SESSION_REDIS_URL", "")
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", str(24 * 3600)))
+# Most sessions the memory backend keeps (least recently used are evicted first)
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "1000"))
+
 # --- Email Configuration ---
 USE_REAL_EMAIL = os.getenv("USE_REAL_EMAIL", "0") == "1"
 
@@ -32,3 +107,12 @@ SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp.gmail.com")
 SMTP_USERNAME = os.getenv("SMTP_USERNAME", "")
 SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", "")
 SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_USE_TLS = os.getenv("SMTP_USE_TLS", "1") == "1"
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "30"))
+
+# Outbound mail queue: persistent connections, each drained by its own sender thread
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "2"))
+SMTP_BATCH_SIZE = int(os.getenv("SMTP_BATCH_SIZE", "20"))
+SMTP_MAX_RETRIES = int(os.getenv("SMTP_MAX_RETRIES", "3"))
+# Reconnect (after a NOOP probe fails) once a connection has been idle this long
+SMTP_IDLE_PROBE_SECONDS = 30.0
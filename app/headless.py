@@ -0,0 +1,106 @@
+import asyncio
+import functools
+import json
+import uuid
+import weakref
+from typing import Optional
+
+from app.agent.context import ConversationContext
+from app.agent.executor import get_tool_pool
+from app.agent.runtime import AgentRuntime, new_conversation
+from app.agent.session_store import SessionConflict, SessionStore, get_session_store
+from app.config import HEADLESS_HOST, HEADLESS_PORT
+
+
+class HeadlessServer:
+    """
+    Chat sessions over a plain TCP socket, one JSON object per line.
+
+    Request:  {"session_id": "...", "message": "..."} (omit session_id to start one)
+    Response: {"session_id": "...", "reply": "...", "rounds": n, "stopped": null}
+              or {"session_id": ..., "error": "..."}
+
+    Every request is its own task on one event loop, so a single process
+    serves many sessions at once (and a client may pipeline requests for
+    different sessions on one connection). Turns within a session run one
+    at a time, in arrival order.
+
+    Conversations live in the shared session store (SESSION_BACKEND), like
+    the HTTP API's, so idle ones expire after SESSION_TTL_SECONDS instead of
+    accumulating in this process.
+    """
+
+    def __init__(self, runtime: AgentRuntime, store: Optional[SessionStore] = None):
+        self.runtime = runtime
+        self.store = store or get_session_store()
+        self._locks: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+
+    def _session_lock(self, session_id: str) -> asyncio.Lock:
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[session_id] = lock
+        return lock
+
+    async def _store_call(self, func, *args):
+        # Store calls are blocking I/O: keep them off the event loop
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_tool_pool(), functools.partial(func, *args))
+
+    async def handle_turn(self, session_id: Optional[str], message: str) -> dict:
+        session_id = session_id or uuid.uuid4().hex
+        async with self._session_lock(session_id):
+            session = await self._store_call(self.store.load, session_id)
+            if session is None:
+                session = {'messages': new_conversation(), 'state': {}, 'version': 0}
+            messages = session['messages']
+            result = await self.runtime.arun_turn(messages, message, context=ConversationContext())
+            try:
+                await self._store_call(self.store.save, session_id, messages, session['state'], session['version'])
+            except SessionConflict as e:
+                return {'session_id': session_id, 'error': str(e)}
+        return {'session_id': session_id, 'reply': result['content'],
+                'rounds': len(result['rounds']), 'stopped': result['stopped']}
+
+    async def _answer(self, line: bytes, writer: asyncio.StreamWriter, write_lock: asyncio.Lock) -> None:
+        session_id = None
+        try:
+            request = json.loads(line)
+            session_id = request.get('session_id')
+            message = str(request.get('message') or '').strip()
+            if not message:
+                response = {'session_id': session_id, 'error': "Request needs a non-empty 'message'"}
+            else:
+                response = await self.handle_turn(session_id, message)
+        except Exception as e:
+            response = {'session_id': session_id, 'error': f"Turn failed: {str(e)}"}
+        async with write_lock:
+            writer.write(json.dumps(response, ensure_ascii=False).encode('utf-8') + b"\n")
+            await writer.drain()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        write_lock = asyncio.Lock()
+        pending = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                task = asyncio.ensure_future(self._answer(line, writer, write_lock))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.wait(pending)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = HEADLESS_HOST, port: int = HEADLESS_PORT) -> None:
+        await self._store_call(self.store.purge)
+        server = await asyncio.start_server(self._handle_connection, host, port, limit=1 << 20)
+        print(f"[HEADLESS] Serving chat sessions on {host}:{server.sockets[0].getsockname()[1]} (JSON lines)")
+        async with server:
+            await server.serve_forever()
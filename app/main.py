@@ -1,32 +1,69 @@
 import sys
 import os
+import asyncio
 from dotenv import load_dotenv
 
 # Add the project root to the Python path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import SystemMessage, HumanMessage, ToolMessage
-from pydantic import SecretStr
 from app.agent.tools import all_tools
-from app.agent.prompts import AGENT_SYSTEM_PROMPT
-from app.config import OPENAI_API_KEY, AGENT_MODEL_NAME
+from app.agent.context import ConversationContext
+from app.agent.llm import get_chat_model
+from app.agent.reminders import start_reminder_worker
+from app.agent.runtime import AgentRuntime, new_conversation
+from app.config import OPENAI_API_KEY, AGENT_STREAMING
+
+def run_headless() -> None:
+    # One event loop serves every session; tools run on the bounded tool pool
+    from app.agent.async_tools import all_async_tools
+    from app.headless import HeadlessServer
+
+    runtime = AgentRuntime(get_chat_model(all_tools), all_async_tools)
+    start_reminder_worker()
+    try:
+        asyncio.run(HeadlessServer(runtime).serve())
+    except KeyboardInterrupt:
+        print("\n[HEADLESS] Stopped")
+
+def run_http() -> None:
+    # Sessions live in SESSION_DB_PATH, so any of the workers can serve any session
+    import uvicorn
+    from app.config import HTTP_HOST, HTTP_PORT, HTTP_WORKERS
+
+    uvicorn.run("app.api:app", host=HTTP_HOST, port=HTTP_PORT, workers=HTTP_WORKERS)
 
 def main() -> None:
     load_dotenv()
     if not OPENAI_API_KEY:
         print("Error: OPENAI_API_KEY not set")
         return
+    if '--headless' in sys.argv[1:]:
+        run_headless()
+        return
+    if '--http' in sys.argv[1:]:
+        run_http()
+        return
     
-    model = ChatOpenAI(
-        api_key=SecretStr(OPENAI_API_KEY),
-        model=AGENT_MODEL_NAME,
-        temperature=0
-    )
-    model_with_tools = model.bind_tools(all_tools)
+    runtime = AgentRuntime(get_chat_model(all_tools), all_tools)
+    start_reminder_worker()
     
     print("AI Medical Scheduler CLI. Type 'exit' to end.")
-    conversation_history = []
+    conversation_history = new_conversation()
+    context = ConversationContext()
+    
+    # Streamed text is printed as it arrives, one "AI:" line per model round
+    printed = []
+    def on_token(text):
+        if not printed:
+            print("AI: ", end="", flush=True)
+            printed.append(True)
+        print(text, end="", flush=True)
+    def on_round(info, response):
+        if printed:
+            print()
+            printed.clear()
+        elif not AGENT_STREAMING and response.content:
+            print(f"AI: {response.content}")
     
     while True:
         try:
@@ -36,61 +73,10 @@ def main() -> None:
                 print("AI: Thank you for using the scheduler. Goodbye!")
                 break
 
-            conversation_history.append(HumanMessage(content=user_input))
-            messages = [SystemMessage(content=AGENT_SYSTEM_PROMPT)] + conversation_history
-            response = model_with_tools.invoke(messages)
-            conversation_history.append(response)
-            print(f"AI: {response.content}")
-            
-            # If there are tool calls, execute them
-            if hasattr(response, 'additional_kwargs') and response.additional_kwargs.get('tool_calls'):
-                tool_calls = response.additional_kwargs['tool_calls']
-                # Process tool calls and collect results
-                tool_messages = []
-                for tool_call in tool_calls:
-                    try:
-                        # Handle nested function structure
-                        if 'function' in tool_call:
-                            tool_name = tool_call['function'].get('name', '')
-                            tool_args_str = tool_call['function'].get('arguments', '{}')
-                        else:
-                            tool_name = tool_call.get('name', '')
-                            tool_args_str = tool_call.get('args', '{}')
-                        
-                        import json
-                        try:
-                            tool_args = json.loads(tool_args_str) if isinstance(tool_args_str, str) else tool_args_str
-                        except:
-                            tool_args = {}
-                        tool_func = next((t for t in all_tools if t.name == tool_name), None)
-                        
-                        if tool_func:
-                            result = tool_func.invoke(tool_args)
-                            tool_message = ToolMessage(
-                                content=str(result),
-                                tool_call_id=tool_call.get('id', '')
-                            )
-                            tool_messages.append(tool_message)
-                        else:
-                            tool_message = ToolMessage(
-                                content=f"Tool {tool_name} not found",
-                                tool_call_id=tool_call.get('id', '')
-                            )
-                            tool_messages.append(tool_message)
-                            
-                    except Exception as e:
-                        print(f"[Tool call error: {str(e)}]")
-                        tool_message = ToolMessage(
-                            content=f"Tool call error: {str(e)}",
-                            tool_call_id=tool_call.get('id', '')
-                        )
-                        tool_messages.append(tool_message)
-                
-                conversation_history.extend(tool_messages)
-                follow_up_messages = [SystemMessage(content=AGENT_SYSTEM_PROMPT)] + conversation_history
-                follow_up_response = model_with_tools.invoke(follow_up_messages)
-                conversation_history.append(follow_up_response)
-                print(f"AI: {follow_up_response.content}")
+            result = runtime.run_turn(conversation_history, user_input, context=context,
+                                      on_token=on_token, on_round=on_round)
+            if result['stopped']:
+                print(f"AI: {result['content']}")
 
         except KeyboardInterrupt:
             print("\nAI: Conversation ended. Goodbye!")
@@ -101,4 +87,3 @@ def main() -> None:
 
 if __name__ == "__main__":
     main()
-
@@ -1,18 +1,22 @@
 import streamlit as st
 import sys
 import os
+import uuid
 from dotenv import load_dotenv
-import json
 
 # Add project root to path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from langchain_openai import ChatOpenAI
 from langchain_core.messages import SystemMessage, HumanMessage, ToolMessage
-from pydantic import SecretStr
 from app.agent.tools import all_tools
+from app.agent.context import ConversationContext
+from app.agent.executor import parse_tool_call
+from app.agent.llm import get_chat_model
 from app.agent.prompts import AGENT_SYSTEM_PROMPT
-from app.config import OPENAI_API_KEY, AGENT_MODEL_NAME
+from app.agent.reminders import start_reminder_worker
+from app.agent.runtime import AgentRuntime, new_conversation
+from app.agent.session_store import SessionConflict, get_session_store
+from app.config import OPENAI_API_KEY
 
 # Load environment variables
 load_dotenv()
@@ -176,29 +180,56 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+@st.cache_resource
+def get_cached_model():
+    """Tool-bound chat model shared by every session and rerun of this server."""
+    return get_chat_model(all_tools)
+
 def initialize_session_state():
-    """Initialize session state variables"""
-    if 'conversation_history' not in st.session_state:
-        st.session_state.conversation_history = []
-    if 'patient_details' not in st.session_state:
-        st.session_state.patient_details = {}
-    if 'appointment_booked' not in st.session_state:
-        st.session_state.appointment_booked = False
-    if 'booking_summary' not in st.session_state:
-        st.session_state.booking_summary = {}
+    """
+    Load this browser session from the shared session store. The session ID
+    lives in the URL (?sid=...), so a reload, a server restart or another
+    replica behind the load balancer resumes the same conversation.
+    """
+    session_id = st.query_params.get('sid')
+    if not session_id:
+        session_id = uuid.uuid4().hex
+        st.query_params['sid'] = session_id
+    session = get_session_store().load(session_id)
+    if session is None:
+        session = {'messages': new_conversation(), 'state': {}, 'version': 0}
+    state = session['state']
+    st.session_state.session_id = session_id
+    st.session_state.session_version = session['version']
+    st.session_state.conversation_history = session['messages']
+    st.session_state.patient_details = state.get('patient_details', {})
+    st.session_state.appointment_booked = state.get('appointment_booked', False)
+    st.session_state.booking_summary = state.get('booking_summary', {})
+    # Prompt windowing state is derived from the messages; keep it per process only
+    if st.session_state.get('context_session_id') != session_id:
+        st.session_state.context = ConversationContext()
+        st.session_state.context_session_id = session_id
+
+def save_session_state():
+    """Write this session back to the store (raises SessionConflict if another tab got there first)."""
+    st.session_state.session_version = get_session_store().save(
+        st.session_state.session_id,
+        st.session_state.conversation_history,
+        {
+            'patient_details': st.session_state.patient_details,
+            'appointment_booked': st.session_state.appointment_booked,
+            'booking_summary': st.session_state.booking_summary,
+        },
+        st.session_state.session_version,
+    )
 
-def get_ai_response(user_input):
-    """Get AI response using the agent"""
+def get_ai_response(user_input, on_token=None):
+    """Get AI response using the agent (on_token receives streamed text as it arrives)"""
     try:
         if not OPENAI_API_KEY:
             return "Error: OpenAI API key not found. Please set OPENAI_API_KEY in your environment variables."
         
-        model = ChatOpenAI(
-            api_key=SecretStr(OPENAI_API_KEY),
-            model=AGENT_MODEL_NAME,
-            temperature=0
-        )
-        model_with_tools = model.bind_tools(all_tools)
+        model_with_tools = get_cached_model()
         
         # Parse insurance details if user provides them
         import re
@@ -236,109 +267,64 @@ def get_ai_response(user_input):
                 # This is a simplified patch: in a real agent, you'd update the tool_args for save_new_patient
                 # Here, just log that insurance would be passed
                 print(f"[DEBUG] Insurance details to be saved: {st.session_state.patient_details['insurance']}")
-    # Add user message to conversation
-        st.session_state.conversation_history.append(HumanMessage(content=user_input))
-        
-        # Get AI response
-        messages = [SystemMessage(content=AGENT_SYSTEM_PROMPT)] + st.session_state.conversation_history
-        response = model_with_tools.invoke(messages)
-        st.session_state.conversation_history.append(response)
-        
-        # Process tool calls if any
-        if hasattr(response, 'additional_kwargs') and response.additional_kwargs.get('tool_calls'):
-            tool_calls = response.additional_kwargs['tool_calls']
-            
-            # Process all tool calls and collect results
-            tool_messages = []
-            for tool_call in tool_calls:
-                try:
-                    # Handle the nested function structure
-                    if 'function' in tool_call:
-                        tool_name = tool_call['function'].get('name', '')
-                        tool_args_str = tool_call['function'].get('arguments', '{}')
-                    else:
-                        tool_name = tool_call.get('name', '')
-                        tool_args_str = tool_call.get('args', '{}')
-                    
-                    # Parse arguments
-                    try:
-                        tool_args = json.loads(tool_args_str) if isinstance(tool_args_str, str) else tool_args_str
-                    except:
-                        tool_args = {}
-                    
-                    # Inject insurance details into save_new_patient tool call
-                    if tool_name == 'save_new_patient':
-                        insurance = st.session_state.patient_details.get('insurance', {}) if 'insurance' in st.session_state.patient_details else {}
-                        if insurance:
-                            # Map to expected argument names
-                            if 'carrier' in insurance:
-                                tool_args['insurance_carrier'] = insurance['carrier']
-                            if 'member_id' in insurance:
-                                tool_args['member_id'] = insurance['member_id']
-                            if 'group_id' in insurance:
-                                tool_args['group_id'] = insurance['group_id']
-                    # Insurance check before sending forms/reminders
-                    if tool_name in ['send_intake_forms', 'schedule_enhanced_reminders']:
-                        insurance = st.session_state.patient_details.get('insurance', {}) if 'insurance' in st.session_state.patient_details else {}
-                        missing_fields = []
-                        for field in ['carrier', 'member_id', 'group_id']:
-                            if not insurance.get(field):
-                                missing_fields.append(field)
-                        if missing_fields:
-                            tool_message = ToolMessage(
-                                content=f"Missing insurance details: {', '.join(missing_fields)}. Please provide carrier, member ID, and group ID before proceeding.",
-                                tool_call_id=tool_call.get('id', '')
-                            )
-                            tool_messages.append(tool_message)
-                            continue
-                    # Find and execute the tool
-                    tool_func = None
-                    for tool in all_tools:
-                        if tool.name == tool_name:
-                            tool_func = tool
-                            break
-                    
-                    if tool_func:
-                        result = tool_func.invoke(tool_args)
-                        tool_message = ToolMessage(
-                            content=str(result),
-                            tool_call_id=tool_call.get('id', '')
-                        )
-                        tool_messages.append(tool_message)
-                        
-                        # Check if this is a booking confirmation
-                        if tool_name == 'book_calendly_slot' and 'Success' in str(result):
-                            st.session_state.appointment_booked = True
-                            st.session_state.booking_summary = tool_args
-                    else:
-                        tool_message = ToolMessage(
-                            content=f"Tool {tool_name} not found",
-                            tool_call_id=tool_call.get('id', '')
-                        )
-                        tool_messages.append(tool_message)
-                        
-                except Exception as e:
-                    tool_message = ToolMessage(
-                        content=f"Tool call error: {str(e)}",
-                        tool_call_id=tool_call.get('id', '')
-                    )
-                    tool_messages.append(tool_message)
-            
-            # Add all tool messages to conversation
-            st.session_state.conversation_history.extend(tool_messages)
-            
-            # Get follow-up response from AI
-            follow_up_messages = [SystemMessage(content=AGENT_SYSTEM_PROMPT)] + st.session_state.conversation_history
-            follow_up_response = model_with_tools.invoke(follow_up_messages)
-            st.session_state.conversation_history.append(follow_up_response)
-            
-            return follow_up_response.content
-        
-        return response.content
+        # Model -> tools -> model until the agent is done (or the turn budget runs out)
+        history = st.session_state.conversation_history
+        if not history or not isinstance(history[0], SystemMessage):
+            history.insert(0, SystemMessage(content=AGENT_SYSTEM_PROMPT))
+        runtime = AgentRuntime(model_with_tools, all_tools)
+        result = runtime.run_turn(history, user_input, context=st.session_state.context, on_token=on_token,
+                                  prepare_call=prepare_tool_call, on_results=record_tool_results)
+        save_session_state()
+        return result['content']
         
+    except SessionConflict:
+        return "Error: This conversation was updated in another window. Reload the page to continue."
     except Exception as e:
         return f"Error: {str(e)}"
 
+def prepare_tool_call(tool_call):
+    """
+    Parse a tool call and apply the UI's insurance handling. Runs on the
+    script thread (it reads session state) before the tool is dispatched.
+    Returns (tool_name, tool_args, call_id, blocked) where blocked is a
+    ToolMessage to use instead of running the tool, or None.
+    """
+    tool_name, tool_args, call_id = parse_tool_call(tool_call)
+    
+    # Inject insurance details into save_new_patient tool call
+    if tool_name == 'save_new_patient':
+        insurance = st.session_state.patient_details.get('insurance', {}) if 'insurance' in st.session_state.patient_details else {}
+        if insurance:
+            # Map to expected argument names
+            if 'carrier' in insurance:
+                tool_args['insurance_carrier'] = insurance['carrier']
+            if 'member_id' in insurance:
+                tool_args['member_id'] = insurance['member_id']
+            if 'group_id' in insurance:
+                tool_args['group_id'] = insurance['group_id']
+    # Insurance check before sending forms/reminders
+    if tool_name in ['send_intake_forms', 'schedule_enhanced_reminders']:
+        insurance = st.session_state.patient_details.get('insurance', {}) if 'insurance' in st.session_state.patient_details else {}
+        missing_fields = []
+        for field in ['carrier', 'member_id', 'group_id']:
+            if not insurance.get(field):
+                missing_fields.append(field)
+        if missing_fields:
+            blocked = ToolMessage(
+                content=f"Missing insurance details: {', '.join(missing_fields)}. Please provide carrier, member ID, and group ID before proceeding.",
+                tool_call_id=call_id
+            )
+            return tool_name, tool_args, call_id, blocked
+    return tool_name, tool_args, call_id, None
+
+def record_tool_results(submitted, tool_messages):
+    """Update session state from finished tool calls (back on the script thread)."""
+    for (tool_name, tool_args), message in zip(submitted, tool_messages):
+        # Check if this is a booking confirmation
+        if tool_name == 'book_calendly_slot' and 'Success' in str(message.content):
+            st.session_state.appointment_booked = True
+            st.session_state.booking_summary = tool_args
+
 def display_conversation():
     """Display the conversation history"""
     # Render messages
@@ -373,7 +359,7 @@ def display_conversation():
                 </div>
             </div>
             """, unsafe_allow_html=True)
-        elif isinstance(message, ToolMessage):
+        elif isinstance(message, (ToolMessage, SystemMessage)):
             continue
         else:
             st.markdown(f"""
@@ -400,6 +386,8 @@ def main():
     
     # Initialize session state
     initialize_session_state()
+    # Reminder worker runs once per server process, not per rerun
+    start_reminder_worker()
     
     # Header (always visible)
     st.markdown(
@@ -424,9 +412,22 @@ def main():
         </div>
         """, unsafe_allow_html=True)
         
+        # Prompt size of the last model call vs. the full history
+        context = st.session_state.context
+        st.markdown(f"""
+        <div class="feature-card">
+            <h4>Context</h4>
+            <p>Last prompt: {context.last_tokens:,} / {context.max_tokens:,} tokens</p>
+            <p>Full history: {context.full_tokens:,} tokens</p>
+        </div>
+        """, unsafe_allow_html=True)
+        
         # Clear conversation button
         if st.button("Clear Conversation", type="secondary"):
-            st.session_state.conversation_history = []
+            get_session_store().delete(st.session_state.session_id)
+            st.query_params['sid'] = uuid.uuid4().hex
+            st.session_state.conversation_history = new_conversation()
+            st.session_state.context = ConversationContext()
             st.session_state.patient_details = {}
             st.session_state.appointment_booked = False
             st.session_state.booking_summary = {}
@@ -447,7 +448,7 @@ def main():
     with col1:
         # Chat interface
         # Display conversation
-        if st.session_state.conversation_history:
+        if len(st.session_state.conversation_history) > 1:
             display_conversation()
         else:
             st.markdown("Hi! I'm your AI medical scheduling assistant. How can I help you today?")
@@ -455,8 +456,20 @@ def main():
         # Chat input - Enter to send (Streamlit chat input)
         user_input = st.chat_input("Send a message…")
         if user_input is not None and user_input.strip():
+            # Show the reply while it streams in; the rerun then renders it in the history
+            placeholder = st.empty()
+            streamed = []
+            def on_token(text):
+                streamed.append(text)
+                placeholder.markdown(f"""
+                <div class="message-row ai">
+                    <div class="chat-message ai-message">
+                        <div>{''.join(streamed)}</div>
+                    </div>
+                </div>
+                """, unsafe_allow_html=True)
             with st.spinner("Processing..."):
-                _ = get_ai_response(user_input)
+                _ = get_ai_response(user_input, on_token=on_token)
                 st.rerun()
 
         # Success banner directly under the input
@@ -53,6 +53,12 @@ def generate_schedules():
     
     print(f"Successfully generated doctor schedules and saved to '{output_path}'")
 
+    # The agent books against the SQLite slot store, so replace its contents too
+    from app.agent.schedule_store import import_schedule_from_excel
+    from app.config import SCHEDULE_DB_PATH
+    count = import_schedule_from_excel(output_path, SCHEDULE_DB_PATH, replace=True)
+    print(f"Imported {count} slots into '{SCHEDULE_DB_PATH}'")
+
 if __name__ == "__main__":
     # To run this script, you need pandas and openpyxl:
     # pip install pandas openpyxl
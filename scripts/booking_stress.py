@@ -0,0 +1,186 @@
+import argparse
+import csv
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def _environment(workdir: str, backend: str) -> dict:
+    """Point every data file the booking tools touch at a scratch copy."""
+    return {
+        'PATIENT_CSV_PATH': os.path.join(workdir, 'patients.csv'),
+        'SCHEDULE_XLSX_PATH': os.path.join(workdir, 'schedules.xlsx'),
+        'SCHEDULE_DB_PATH': os.path.join(workdir, 'schedules.db'),
+        'SCHEDULE_BACKEND': backend,
+        'EXPORTS_DIR': os.path.join(workdir, 'exports'),
+        'REMINDERS_DB_PATH': os.path.join(workdir, 'reminders.db'),
+        'EXPORT_FSYNC': 'never',
+        'USE_REAL_EMAIL': '0',
+    }
+
+
+def _worker(worker: int, env: dict, pool: list, attempts: int, shared_patients: int, own_patients: int,
+            start, results) -> None:
+    os.environ.update(env)
+    from app.agent.analytics_store import get_analytics_store
+    from app.agent.tools import book_calendly_slot, save_new_patient
+
+    rng = random.Random(worker)
+    start.wait()
+    booked, registered, report_errors = [], [], []
+    for _ in range(attempts):
+        slot = rng.choice(pool)
+        outcome = book_calendly_slot.invoke({'calendly_link': 'https://calendly.com/stress',
+                                             'slot_id': f"calendly_slot_{slot}", 'patient_name': f"Worker {worker}"})
+        if outcome.startswith('Success'):
+            booked.append(slot)
+            # Admin reports sync the Parquet copy of the journal from every process at once
+            try:
+                get_analytics_store().read_range('0000-01-01', '9999-12-31', columns=['booking_id'])
+            except Exception as e:
+                report_errors.append(f"{type(e).__name__}: {e}")
+    # Everyone registers the shared patients (only one row each may result) and a few of their own
+    names = [('Shared', f"Patient{n}") for n in range(shared_patients)]
+    names += [(f"Worker{worker}", f"Patient{n}") for n in range(own_patients)]
+    rng.shuffle(names)
+    for first, last in names:
+        outcome = save_new_patient.invoke({'first_name': first, 'last_name': last, 'dob': '1990-01-01'})
+        if outcome.startswith('Success'):
+            registered.append((first, last))
+    results.put((worker, booked, registered, report_errors))
+
+
+def run(backend: str, processes: int, attempts: int, pool_size: int, shared_patients: int, own_patients: int) -> bool:
+    workdir = tempfile.mkdtemp(prefix=f"booking_stress_{backend}_")
+    try:
+        shutil.copy(os.path.join(ROOT, 'app', 'data', 'schedules.xlsx'), workdir)
+        shutil.copy(os.path.join(ROOT, 'app', 'data', 'patients.csv'), workdir)
+        env = _environment(workdir, backend)
+        with open(env['PATIENT_CSV_PATH'], newline='', encoding='utf-8') as f:
+            patients_before = sum(1 for _ in csv.DictReader(f))
+
+        # Pick the contended slots in a child so this process never imports the app with the wrong paths
+        ctx = multiprocessing.get_context('spawn')
+        queue = ctx.Queue()
+        picker = ctx.Process(target=_free_slots, args=(env, pool_size, queue))
+        picker.start()
+        pool = queue.get()
+        picker.join()
+
+        start = ctx.Barrier(processes)
+        workers = [ctx.Process(target=_worker, args=(n, env, pool, attempts, shared_patients, own_patients,
+                                                      start, queue))
+                   for n in range(processes)]
+        started = time.perf_counter()
+        for p in workers:
+            p.start()
+        outcomes = [queue.get() for _ in workers]
+        for p in workers:
+            p.join()
+        elapsed = time.perf_counter() - started
+
+        checker = ctx.Process(target=_check, args=(env, pool, outcomes, patients_before, queue))
+        checker.start()
+        problems, summary = queue.get()
+        checker.join()
+        print(f"[{backend}] {processes} processes x {attempts} booking attempts on {len(pool)} slots "
+              f"in {elapsed:.1f}s: {summary}")
+        for problem in problems:
+            print(f"[{backend}]   FAIL {problem}")
+        return not problems
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _free_slots(env: dict, pool_size: int, queue) -> None:
+    os.environ.update(env)
+    from app.agent.schedule_store import get_schedule_store
+
+    slots = get_schedule_store().free_slots_between('0000-01-01', '9999-12-31')
+    queue.put([s['slot_id'] for s in slots[:pool_size]])
+
+
+def _check(env: dict, pool: list, outcomes: list, patients_before: int, queue) -> None:
+    os.environ.update(env)
+    from app.agent.analytics_store import get_analytics_store
+    from app.agent.export_journal import AppointmentJournal
+    from app.agent.schedule_store import get_schedule_store
+    from app.config import APPOINTMENTS_JOURNAL_PATH
+
+    problems = []
+    claims = Counter(slot for _, booked, _, _ in outcomes for slot in booked)
+    doubled = sorted(slot for slot, n in claims.items() if n > 1)
+    if doubled:
+        problems.append(f"double bookings: slots {doubled} were confirmed to more than one worker")
+    on_disk = {s['slot_id'] for s in get_schedule_store().get_slots(pool) if s['is_booked']}
+    lost = sorted(set(claims) - on_disk)
+    if lost:
+        problems.append(f"lost bookings: slots {lost} were confirmed but are free in the schedule")
+    phantom = sorted(on_disk - set(claims))
+    if phantom:
+        problems.append(f"phantom bookings: slots {phantom} are booked but nobody was told so")
+    rows, _ = AppointmentJournal(APPOINTMENTS_JOURNAL_PATH, seed_xlsx_path=None).read_from(0)
+    exported = Counter(int(r['booking_id'].rsplit('_', 1)[-1]) for r in rows)
+    if exported != claims:
+        problems.append(f"export journal has {sum(exported.values())} bookings, expected {sum(claims.values())}")
+
+    report_errors = [error for _, _, _, errors in outcomes for error in errors]
+    if report_errors:
+        problems.append(f"{len(report_errors)} report reads failed during syncs, e.g. {report_errors[0]}")
+    analytics = get_analytics_store().read_range('0000-01-01', '9999-12-31', columns=['booking_id'])
+    in_analytics = Counter(int(b.rsplit('_', 1)[-1]) for b in analytics['booking_id'])
+    if in_analytics != claims:
+        problems.append(f"analytics copy has {sum(in_analytics.values())} bookings, expected {sum(claims.values())}")
+
+    with open(env['PATIENT_CSV_PATH'], newline='', encoding='utf-8') as f:
+        patients = list(csv.DictReader(f))
+    rows_by_name = Counter((p['first_name'], p['last_name']) for p in patients[patients_before:])
+    expected = {name for _, _, registered, _ in outcomes for name in registered}
+    duplicated = sorted(name for name, n in rows_by_name.items() if n > 1)
+    if duplicated:
+        problems.append(f"duplicate patients: {duplicated}")
+    missing = sorted(expected - set(rows_by_name))
+    if missing:
+        problems.append(f"lost patients: {missing}")
+    ids = Counter(p['patient_id'] for p in patients if p.get('patient_id'))
+    reused = sorted(i for i, n in ids.items() if n > 1)
+    if reused:
+        problems.append(f"patient IDs used twice: {reused}")
+
+    summary = (f"{sum(claims.values())} bookings confirmed, {len(on_disk)} slots booked on disk, "
+               f"{sum(exported.values())} exported, {sum(in_analytics.values())} in analytics; "
+               f"{len(rows_by_name)} patients added "
+               f"({len(expected)} distinct registered)")
+    queue.put((problems, summary))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Book the same slots and register the same patients from many processes at once, "
+                    "then check for lost or double bookings, duplicate patients and a stale analytics copy")
+    parser.add_argument('--processes', type=int, default=8)
+    parser.add_argument('--attempts', type=int, default=10, help="booking attempts per process")
+    parser.add_argument('--slots', type=int, default=24, help="size of the contended slot pool")
+    parser.add_argument('--shared-patients', type=int, default=3, help="patients every process registers")
+    parser.add_argument('--own-patients', type=int, default=2, help="patients only one process registers")
+    parser.add_argument('--backend', choices=['excel', 'sqlite', 'both'], default='both')
+    args = parser.parse_args()
+
+    backends = ['excel', 'sqlite'] if args.backend == 'both' else [args.backend]
+    ok = all([run(backend, args.processes, args.attempts, args.slots, args.shared_patients, args.own_patients)
+              for backend in backends])
+    print("No lost or double bookings" if ok else "Concurrency problems found")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -15,6 +15,7 @@ def main() -> int:
         _normalize_date_string,
         get_calendly_availability_with_duration,
         export_appointment,
+        compact_appointments_export,
     )
 
     results = []
@@ -68,6 +69,7 @@ def main() -> int:
             "duration_minutes": 60,
             "location": "Main Clinic",
         })
+        compact_appointments_export.invoke({})
         df = pd.read_excel(export_path)
         required_cols = [
             'booking_id','patient_name','patient_email','patient_phone','doctor','location','date','start_time','end_time','duration_minutes','created_at'
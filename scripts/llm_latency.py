@@ -0,0 +1,252 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+REPLY = ("Hello! I can help you schedule an appointment. Could you tell me your full name, "
+         "date of birth, and which doctor or location you prefer?")
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    """Minimal OpenAI-compatible /chat/completions endpoint returning a fixed reply."""
+
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real API
+    delay_seconds = 0.0
+    token_delay_seconds = 0.0
+    connections = 0
+    # {'name': ..., 'arguments': {...}}: answer a user message with this tool call first
+    tool_call = None
+
+    def setup(self):
+        super().setup()
+        MockOpenAIHandler.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _wants_tool_call(self, request: dict) -> bool:
+        messages = request.get('messages') or []
+        return bool(self.tool_call) and bool(messages) and messages[-1].get('role') == 'user'
+
+    def _tool_call_payload(self) -> dict:
+        return {'id': f"call_{int(time.time() * 1e6)}", 'type': 'function',
+                'function': {'name': self.tool_call['name'], 'arguments': json.dumps(self.tool_call['arguments'])}}
+
+    def _stream(self, request: dict) -> None:
+        """Server-sent events, one chunk per word, like the real streaming API."""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        def send(data: str) -> None:
+            payload = f"data: {data}\n\n".encode('utf-8')
+            self.wfile.write(f"{len(payload):x}\r\n".encode('ascii') + payload + b"\r\n")
+            self.wfile.flush()
+
+        words = [] if self._wants_tool_call(request) else REPLY.split(' ')
+        if not words:
+            send(json.dumps({
+                'id': 'chatcmpl-mock', 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                'model': request.get('model', 'mock'),
+                'choices': [{'index': 0, 'delta': {'tool_calls': [{'index': 0, **self._tool_call_payload()}]},
+                             'finish_reason': None}],
+            }))
+        for n, word in enumerate(words):
+            if n:
+                time.sleep(self.token_delay_seconds)
+            send(json.dumps({
+                'id': 'chatcmpl-mock', 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                'model': request.get('model', 'mock'),
+                'choices': [{'index': 0, 'delta': {'content': (' ' if n else '') + word}, 'finish_reason': None}],
+            }))
+        send(json.dumps({
+            'id': 'chatcmpl-mock', 'object': 'chat.completion.chunk', 'created': int(time.time()),
+            'model': request.get('model', 'mock'),
+            'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop' if words else 'tool_calls'}],
+        }))
+        if (request.get('stream_options') or {}).get('include_usage'):
+            send(json.dumps({
+                'id': 'chatcmpl-mock', 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                'model': request.get('model', 'mock'), 'choices': [],
+                'usage': {'prompt_tokens': 10, 'completion_tokens': 10, 'total_tokens': 20},
+            }))
+        send('[DONE]')
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        if self.delay_seconds:
+            time.sleep(self.delay_seconds)
+        if request.get('stream'):
+            return self._stream(request)
+        if self._wants_tool_call(request):
+            message = {'role': 'assistant', 'content': None, 'tool_calls': [self._tool_call_payload()]}
+        else:
+            # A non-streaming reply only goes out once the whole completion is "generated"
+            time.sleep(self.token_delay_seconds * (len(REPLY.split(' ')) - 1))
+            message = {'role': 'assistant', 'content': REPLY}
+        body = json.dumps({
+            'id': 'chatcmpl-mock',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'mock'),
+            'choices': [{
+                'index': 0,
+                'message': message,
+                'finish_reason': 'tool_calls' if message.get('tool_calls') else 'stop',
+            }],
+            'usage': {'prompt_tokens': 10, 'completion_tokens': 10, 'total_tokens': 20},
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _MockServer(ThreadingHTTPServer):
+    # Room for a burst of concurrent sessions connecting at once (the default backlog is 5)
+    request_queue_size = 1024
+
+
+def start_mock_server(port: int = 0, delay_seconds: float = 0.0, token_delay_seconds: float = 0.0):
+    """Serve the mock API on localhost in a background thread. Returns (base_url, server)."""
+    MockOpenAIHandler.delay_seconds = delay_seconds
+    MockOpenAIHandler.token_delay_seconds = token_delay_seconds
+    server = _MockServer(('127.0.0.1', port), MockOpenAIHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}/v1", server
+
+
+def _summary(label: str, samples: list) -> str:
+    ms = sorted(s * 1000 for s in samples)
+    p95 = ms[min(len(ms) - 1, int(len(ms) * 0.95))]
+    return f"- {label}: mean {statistics.mean(ms):.2f} ms, median {statistics.median(ms):.2f} ms, p95 {p95:.2f} ms"
+
+
+def _concurrent_sessions(base_url: str, sessions: int) -> int:
+    """
+    One event loop, many sessions: each turn asks the mock model, runs the
+    lookup_patient tool it answers with (on the bounded tool pool) and asks
+    the model again for the reply.
+    """
+    import asyncio
+    from app.agent import llm
+    from app.agent.async_tools import all_async_tools
+    from app.agent.runtime import AgentRuntime, new_conversation
+
+    MockOpenAIHandler.tool_call = {'name': 'lookup_patient',
+                                   'arguments': {'first_name': 'Aarav', 'last_name': 'Sharma', 'dob': '1985-05-20'}}
+    model = llm.create_chat_model(all_async_tools, api_key='mock', base_url=base_url,
+                                  http_async_client=llm.get_http_async_client())
+    runtime = AgentRuntime(model, all_async_tools)
+
+    async def one_session() -> float:
+        started = time.perf_counter()
+        result = await runtime.arun_turn(new_conversation(), "Hi, I'd like to book an appointment")
+        if len(result['rounds']) != 2:
+            raise RuntimeError(f"Expected a tool round and a reply round, got {len(result['rounds'])}")
+        return time.perf_counter() - started
+
+    async def run_all() -> tuple:
+        started = time.perf_counter()
+        durations = await asyncio.gather(*(one_session() for _ in range(sessions)))
+        return durations, time.perf_counter() - started
+
+    MockOpenAIHandler.connections = 0
+    durations, elapsed = asyncio.run(run_all())
+    print(f"{sessions} concurrent sessions in {elapsed:.2f} s on one event loop "
+          f"({MockOpenAIHandler.connections} connections, {sessions / elapsed:.1f} turns/s)")
+    print(_summary("Turn latency", durations))
+    return 0
+
+
+def main() -> int:
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if root not in sys.path:
+        sys.path.insert(0, root)
+
+    parser = argparse.ArgumentParser(description="Per-turn LLM client overhead: new client per turn vs the cached one")
+    parser.add_argument('--turns', type=int, default=50)
+    parser.add_argument('--delay', type=float, default=0.0, help="Simulated model latency per request (seconds)")
+    parser.add_argument('--token-delay', type=float, default=0.01, help="Simulated time per generated word (seconds)")
+    parser.add_argument('--serve', action='store_true', help="Only run the mock server (set OPENAI_BASE_URL to it)")
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--sessions', type=int, default=0,
+                        help="Instead: run this many concurrent sessions through the asyncio runtime")
+    args = parser.parse_args()
+
+    base_url, server = start_mock_server(args.port, args.delay, args.token_delay)
+    if args.serve:
+        print(f"Mock OpenAI API at {base_url} (Ctrl+C to stop)")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            return 0
+
+    if args.sessions:
+        result = _concurrent_sessions(base_url, args.sessions)
+        server.shutdown()
+        return result
+
+    from langchain_core.messages import HumanMessage, SystemMessage
+    from app.agent import llm
+    from app.agent.prompts import AGENT_SYSTEM_PROMPT
+    from app.agent.tools import all_tools
+
+    messages = [SystemMessage(content=AGENT_SYSTEM_PROMPT), HumanMessage(content="Hi, I'd like to book an appointment")]
+    print(f"Mock server at {base_url}, {args.turns} turns, {len(all_tools)} tools bound")
+
+    # Old behaviour: build and bind a fresh model on every turn
+    MockOpenAIHandler.connections = 0
+    fresh = []
+    for _ in range(args.turns):
+        started = time.perf_counter()
+        model = llm.create_chat_model(all_tools, api_key='mock', base_url=base_url)
+        model.invoke(messages)
+        fresh.append(time.perf_counter() - started)
+    fresh_connections = MockOpenAIHandler.connections
+
+    # Cached: one bound model and keep-alive pool for the whole process
+    MockOpenAIHandler.connections = 0
+    http_client = llm.get_http_client()
+    cached_model = llm.create_chat_model(all_tools, api_key='mock', base_url=base_url, http_client=http_client)
+    cached_model.invoke(messages)  # warm-up: first connection
+    cached = []
+    for _ in range(args.turns):
+        started = time.perf_counter()
+        cached_model.invoke(messages)
+        cached.append(time.perf_counter() - started)
+    cached_connections = MockOpenAIHandler.connections
+
+    print(_summary(f"New client per turn ({fresh_connections} connections)", fresh))
+    print(_summary(f"Cached client      ({cached_connections} connections)", cached))
+    print(f"- Saved per turn: {(statistics.mean(fresh) - statistics.mean(cached)) * 1000:.2f} ms")
+
+    # Time to first visible text: invoke() waits for the whole reply, streaming shows the first word
+    from app.agent.streaming import stream_response
+    blocking, streamed = [], []
+    for _ in range(min(args.turns, 10)):
+        started = time.perf_counter()
+        cached_model.invoke(messages)
+        blocking.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        first = []
+        stream_response(cached_model, messages, on_token=lambda text: first or first.append(time.perf_counter()))
+        streamed.append(first[0] - started)
+    print(_summary("First text, invoke()", blocking))
+    print(_summary("First text, streamed", streamed))
+    server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,151 @@
+import argparse
+import os
+import smtplib
+import socketserver
+import sys
+import threading
+import time
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+
+class _SinkHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP to accept and discard mail (used when aiosmtpd is not installed)."""
+
+    def _reply(self, line: str) -> None:
+        self.wfile.write((line + "\r\n").encode('ascii'))
+
+    def handle(self) -> None:
+        self._reply("220 localhost sink ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            verb = line.decode('ascii', 'replace').strip().split(' ')[0].upper()
+            if verb == 'EHLO':
+                self._reply("250-localhost")
+                self._reply("250 8BITMIME")
+            elif verb == 'DATA':
+                self._reply("354 end with .")
+                while self.rfile.readline() not in (b".\r\n", b".\n", b""):
+                    pass
+                self.server.received += 1
+                self._reply("250 OK")
+            elif verb == 'QUIT':
+                self._reply("221 bye")
+                return
+            else:
+                self._reply("250 OK")
+
+
+class _SinkServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    received = 0
+
+
+def start_local_server():
+    """Start a throwaway SMTP server on a free port. Returns (port, stop, received)."""
+    try:
+        from aiosmtpd.controller import Controller
+    except ImportError:
+        server = _SinkServer(('127.0.0.1', 0), _SinkHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print("[SMTP] Using built-in sink server (pip install aiosmtpd for the real one)")
+        return server.server_address[1], server.shutdown, lambda: server.received
+
+    class Handler:
+        received = 0
+
+        async def handle_DATA(self, server, session, envelope):
+            Handler.received += 1
+            return "250 OK"
+
+    controller = Controller(Handler(), hostname='127.0.0.1', port=0)
+    controller.start()
+    print("[SMTP] Using aiosmtpd")
+    return controller.server.sockets[0].getsockname()[1], controller.stop, lambda: Handler.received
+
+
+def build_message(n: int, attachment: bytes) -> MIMEMultipart:
+    msg = MIMEMultipart()
+    msg['From'] = 'clinic@example.com'
+    msg['To'] = f'patient{n}@example.com'
+    msg['Subject'] = f'Intake Forms #{n}'
+    msg.attach(MIMEText('Please find your intake forms attached.', 'plain'))
+    if attachment:
+        part = MIMEApplication(attachment, _subtype='pdf')
+        part.add_header('Content-Disposition', 'attachment', filename='New Patient Intake Form.pdf')
+        msg.attach(part)
+    return msg
+
+
+def run_per_message(host: str, port: int, messages: list) -> float:
+    """The old behaviour: a fresh connection for every email."""
+    started = time.perf_counter()
+    for msg in messages:
+        server = smtplib.SMTP(host, port, timeout=30)
+        server.send_message(msg)
+        server.quit()
+    return time.perf_counter() - started
+
+
+def main() -> int:
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if root not in sys.path:
+        sys.path.insert(0, root)
+
+    from app.config import FORMS_DIR
+    from app.agent.mailer import MailQueue
+
+    parser = argparse.ArgumentParser(description="Measure outbound mail throughput against a local SMTP server")
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--pool-size', type=int, default=4)
+    parser.add_argument('--batch-size', type=int, default=20)
+    parser.add_argument('--host', default='', help="Use an existing SMTP server instead of starting one")
+    parser.add_argument('--port', type=int, default=1025)
+    parser.add_argument('--no-attachment', action='store_true')
+    parser.add_argument('--baseline', action='store_true', help="Also time one connection per message")
+    args = parser.parse_args()
+
+    attachment = b''
+    form_path = os.path.join(FORMS_DIR, "New Patient Intake Form.pdf")
+    if not args.no_attachment and os.path.exists(form_path):
+        with open(form_path, 'rb') as f:
+            attachment = f.read()
+
+    if args.host:
+        host, port, stop, received = args.host, args.port, (lambda: None), None
+    else:
+        host = '127.0.0.1'
+        port, stop, received = start_local_server()
+
+    try:
+        messages = [build_message(n, attachment) for n in range(args.messages)]
+        print(f"[SMTP] {args.messages} messages, {len(attachment)} byte attachment, {host}:{port}")
+
+        if args.baseline:
+            elapsed = run_per_message(host, port, messages)
+            print(f"- Connection per message: {elapsed:.2f}s, {len(messages) / elapsed:.1f} msg/s")
+
+        mail_queue = MailQueue(server=host, port=port, username='', password='', use_tls=False,
+                               pool_size=args.pool_size, batch_size=args.batch_size)
+        for msg in messages:
+            mail_queue.enqueue(msg)
+        if not mail_queue.join(timeout=300):
+            print("[SMTP] Timed out waiting for the queue to drain")
+        mail_queue.stop()
+        stats = mail_queue.stats()
+        print(f"- Pooled queue (pool={args.pool_size}, batch={args.batch_size}): "
+              f"{stats.get('elapsed_seconds', 0):.2f}s, {stats.get('messages_per_second', 0)} msg/s, "
+              f"sent={stats['sent']} failed={stats['failed']} retried={stats['retried']}")
+        if received is not None:
+            print(f"- Server received: {received()}")
+        return 0 if stats['failed'] == 0 else 1
+    finally:
+        stop()
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())